@@ -0,0 +1,66 @@
+"""
+Cold import time of ytutils and download_utils.
+
+Each scenario runs in a fresh interpreter (so nothing is cached in sys.modules), and the
+median wall time of the imports is printed together with the heavy dependencies they loaded.
+
+Usage:
+    python benchmarks/bench_import.py [--repeat 5]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY_MODULES = ["cv2", "scenedetect", "IPython", "yt_dlp", "ffmpeg", "whisper", "torch"]
+
+SCENARIOS = {
+    "import ytutils": "import ytutils",
+    "ingest worker": "from ytutils import loadHistoryData, concatenateFullData",
+    "download worker": "import download_utils",
+    "scene worker": "from ytutils import mp4ToScenes",
+}
+
+TIMER = """
+import sys, time, json
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def timeImport(statement, repeat):
+    # Median of "repeat" runs, each in a new interpreter
+    code = TIMER.format(repo=REPO, statement=statement, heavy=HEAVY_MODULES)
+    times, loaded = [], []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        output = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(output["seconds"])
+        loaded = output["loaded"]
+    return statistics.median(times), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<18}{'ms':>10}  heavy modules loaded")
+    for name, statement in SCENARIOS.items():
+        seconds, loaded = timeImport(statement, args.repeat)
+        if seconds is None:
+            print(f"{name:<18}{'failed':>10}  {loaded}")
+        else:
+            print(f"{name:<18}{seconds * 1000:>10.1f}  {', '.join(loaded) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Accuracy versus speed of the two scene detectors in ytutils.PySceneDetect.
+
+Generates synthetic videos with known cuts, runs the precise ContentDetector ("content")
+and the approximate keyframe/low-resolution detector ("fast") on them, and prints
+precision, recall and wall time for each.
+
+Usage:
+    python benchmarks/bench_scene_detection.py [--videos 5] [--scenes 8] [--tolerance 2]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ytutils.PySceneDetect import SCENE_DETECTORS
+from synthetic import make_test_videos
+
+
+def score(detected, truth, tolerance):
+    # Greedy one-to-one matching of detected cuts to true cuts within +- tolerance frames
+    unmatched = list(truth)
+    hits = 0
+    for cut in detected:
+        match = next((true_cut for true_cut in unmatched if abs(true_cut - cut) <= tolerance), None)
+        if match is not None:
+            unmatched.remove(match)
+            hits += 1
+    return hits, len(detected), len(truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=5)
+    parser.add_argument("--scenes", type=int, default=8)
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--tolerance", type=int, default=2, help="frames a detected cut may be off by")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        folder_path += os.sep
+        print(f"Generating {args.videos} synthetic videos with {args.scenes} scenes each...")
+        ground_truth = make_test_videos(folder_path, n_videos=args.videos, n_scenes=args.scenes, fps=args.fps)
+        duration = args.scenes * 10  # upper bound, only used when no cuts are found
+
+        print(f"{'method':<10}{'precision':>12}{'recall':>10}{'seconds':>10}{'speedup':>10}")
+        baseline = None
+        for method, find_scenes in SCENE_DETECTORS.items():
+            hits = detected = true = 0
+            start = time.perf_counter()
+            for video_id, cuts in ground_truth.items():
+                scenes = find_scenes(video_id, duration, args.fps, folder_path)
+                detected_cuts = [start_frame.frame_num for start_frame, _ in scenes[1:]]
+                h, d, t = score(detected_cuts, cuts, args.tolerance)
+                hits, detected, true = hits + h, detected + d, true + t
+            seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+            precision = hits / detected if detected else 0.0
+            recall = hits / true if true else 0.0
+            print(f"{method:<10}{precision:>12.3f}{recall:>10.3f}{seconds:>10.2f}{baseline / seconds:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Time and peak memory of the ytutils hot paths on synthetic data, compared with a stored baseline.
+
+Generates watch histories for N participants, .info.json files, manual and rolling
+auto-caption .vtt files and (with ffmpeg) test-pattern videos with known cuts, then runs:
+
+    loadEpinionData, sampleVids, getMetadata, vttToTranscriptions (manual and auto),
+    mp4ToScenes, concatenateFullData, the download loop and concatenate_logs
+
+The download loop (download_utils.download_unique_videos) runs against a local stand-in for
+yt-dlp that writes the video and info file without network access. Benchmarks whose
+dependencies are missing (ffmpeg, OpenCV, PySceneDetect) are skipped.
+
+Each benchmark reports the median wall time of --repeat runs and the peak traced memory
+(tracemalloc, measured in a separate run). With --save-baseline the results are written to
+the baseline file; otherwise they are compared with it, and the script exits with status 1
+if any benchmark is more than --threshold times slower or larger than its baseline.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--participants 200] [--videos 300] [--repeat 3]
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --only getMetadata vttToTranscriptions_auto
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import platform
+import statistics
+import tracemalloc
+import contextlib
+
+import pandas as pd
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(REPO)
+from synthetic import make_watch_histories, make_info_json, make_vtt, make_scenes, make_test_videos
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+class Skip(Exception):
+    pass
+
+
+def makeData(folder_path, args):
+    # All inputs are generated once and shared by the benchmarks (which must not modify them)
+    data = {"folder_path": folder_path, "args": args}
+    history_path = os.path.join(folder_path, "history")
+    video_ids = make_watch_histories(history_path, args.participants, args.watches, args.video_pool, seed=args.seed)
+    data["history_path"] = history_path
+    with contextlib.redirect_stdout(io.StringIO()):
+        from ytutils import loadEpinionData
+        data["watch_history"] = loadEpinionData(history_path)
+    from ytutils.History import clean_dataframe
+    data["clean_watch_history"] = clean_dataframe(data["watch_history"])  # The download notebook starts from the cleaned history
+
+    # Info files and subtitles: half of the videos with uploaded (manual) subtitles, half with auto-captions
+    info_path = os.path.join(folder_path, "info") + os.sep
+    manual_path = os.path.join(folder_path, "manual") + os.sep
+    auto_path = os.path.join(folder_path, "auto") + os.sep
+    for path in (info_path, manual_path, auto_path):
+        os.makedirs(path)
+    durations = {}
+    for i, video_id in enumerate(video_ids[:args.videos]):
+        durations[video_id] = make_info_json(info_path, video_id, seed=args.seed)["duration"]
+        make_vtt(manual_path if i % 2 == 0 else auto_path, video_id, durations[video_id], kind="manual" if i % 2 == 0 else "rolling", seed=args.seed)
+    data.update(info_path=info_path, manual_path=manual_path, auto_path=auto_path, durations=durations)
+
+    # Videos with known cuts (only with ffmpeg)
+    data["video_path"] = None
+    if shutil.which("ffmpeg") and args.mp4s:
+        video_path = os.path.join(folder_path, "videos") + os.sep
+        ground_truth = make_test_videos(video_path, n_videos=args.mp4s, seed=args.seed)
+        data["video_path"] = video_path
+        data["video_durations"] = {video_id: cuts[-1] / 25 + 6 if cuts else 6 for video_id, cuts in ground_truth.items()}  # Upper bound: the last scene is at most 6 seconds
+    return data
+
+
+def standInDownload(video_id, download_dir, speed_limit, logger=None, po_token=None, cookie_file=None, artifact_type="video", clip=None):
+    # Local replacement for download_utils.download_video: about 1 in 10 videos is "unavailable", the others are written
+    # as a random payload plus an info file, like yt-dlp leaves them
+    if hashlib.sha256(video_id.encode()).digest()[0] < 26:
+        return False, "ERROR: [youtube] Video unavailable", []
+    with open(os.path.join(download_dir, f"{video_id}.mp4"), "wb") as file:
+        file.write(os.urandom(64 * 1024))
+    make_info_json(download_dir, video_id)
+    return True, "Download successful", []
+
+
+def runDownloadLoop(data, scratch):
+    # Returns the folders the loop wrote to (download directory and logs)
+    import download_utils
+    download_dir = os.path.join(scratch, "downloads")
+    log_path = os.path.join(scratch, "logs")
+    os.makedirs(download_dir)
+    os.makedirs(log_path)
+    original = download_utils.download_video, download_utils.refresh_auth
+    download_utils.download_video, download_utils.refresh_auth = standInDownload, lambda auth_dir: (None, None)
+    try:
+        logs = download_utils.download_unique_videos(data["clean_watch_history"], download_dir, log_path, speed_limit=None, log_df=pd.DataFrame(),
+                                                     wait_time_range=(0, 0), sample_size=data["args"].sample_size)
+    finally:
+        download_utils.download_video, download_utils.refresh_auth = original
+    return download_dir, log_path, logs
+
+
+# Each benchmark gets the shared data and an empty scratch folder, does its (untimed) preparation and
+# returns the call to time. The call returns the number of items it processed.
+
+def benchLoadEpinionData(data, scratch):
+    from ytutils import loadEpinionData
+    return lambda: len(loadEpinionData(data["history_path"]))
+
+
+def benchSampleVids(data, scratch):
+    from ytutils import sampleVids
+    return lambda: len(sampleVids(data["watch_history"], data["args"].sample_size)[1])
+
+
+def benchGetMetadata(data, scratch):
+    from ytutils import getMetadata
+    return lambda: len(getMetadata(data["watch_history"], data["info_path"], save_dataframe=False))
+
+
+def transcriptionMetadata(data):
+    metadata = pd.DataFrame({"video_id": list(data["durations"])})
+    metadata["subtitles_are_provided"] = [i % 2 == 0 for i in range(len(metadata))]
+    return metadata
+
+
+def benchManualSubtitles(data, scratch):
+    from ytutils import vttToTranscriptions
+    metadata = transcriptionMetadata(data)
+    return lambda: len(vttToTranscriptions(metadata, data["manual_path"], from_YouTube=True, save_dataframe=False))
+
+
+def benchAutoSubtitles(data, scratch):
+    from ytutils import vttToTranscriptions
+    metadata = transcriptionMetadata(data)
+    return lambda: len(vttToTranscriptions(metadata, data["auto_path"], from_YouTube=True, save_dataframe=False))
+
+
+def benchMp4ToScenes(data, scratch):
+    if data["video_path"] is None:
+        raise Skip("ffmpeg not found (needed to generate the videos)")
+    try:
+        from ytutils import mp4ToScenes  # Loads OpenCV and PySceneDetect
+    except ImportError as e:
+        raise Skip(str(e))
+    metadata = pd.DataFrame([(video_id, duration, 25) for video_id, duration in data["video_durations"].items()], columns=["video_id", "duration_seconds", "fps"])
+    return lambda: len(mp4ToScenes(metadata, data["video_path"], save_dataframe=False))
+
+
+def benchConcatenateFullData(data, scratch):
+    from ytutils import getMetadata, vttToTranscriptions, concatenateFullData
+    # One row per video: with a row per watch, the output grows with the square of the history size
+    metadata = getMetadata(data["watch_history"], data["info_path"], save_dataframe=False).drop_duplicates(subset="video_id")
+    with contextlib.redirect_stdout(io.StringIO()):
+        transcriptions = pd.concat([vttToTranscriptions(transcriptionMetadata(data), path, from_YouTube=True, save_dataframe=False)
+                                    for path in (data["manual_path"], data["auto_path"])], ignore_index=True)
+    scenes = pd.DataFrame(make_scenes(data["durations"], seed=data["args"].seed), columns=["id", "start_time", "end_time", "start_frame_num", "end_frame_num"])
+    # concatenateFullData adds columns to its inputs, so every run gets fresh copies
+    return lambda: len(concatenateFullData(metadata.copy(), scenes.copy(), transcriptions.copy(), from_YouTube=True))
+
+
+def benchDownloadLoop(data, scratch):
+    return lambda: len(runDownloadLoop(data, scratch)[2])
+
+
+def benchConcatenateLogs(data, scratch):
+    from download_utils import concatenate_logs
+    if "log_path" not in data:
+        with contextlib.redirect_stdout(io.StringIO()):
+            data["log_path"] = runDownloadLoop(data, tempfile.mkdtemp(dir=data["folder_path"]))[1]
+    return lambda: len(concatenate_logs(data["log_path"]))
+
+
+BENCHMARKS = {
+    "loadEpinionData": benchLoadEpinionData,
+    "sampleVids": benchSampleVids,
+    "getMetadata": benchGetMetadata,
+    "vttToTranscriptions_manual": benchManualSubtitles,
+    "vttToTranscriptions_auto": benchAutoSubtitles,
+    "mp4ToScenes": benchMp4ToScenes,
+    "concatenateFullData": benchConcatenateFullData,
+    "download_loop": benchDownloadLoop,
+    "concatenate_logs": benchConcatenateLogs,
+}
+
+
+def measure(bench, data, repeat):
+    # Median wall time over "repeat" runs, then one more run under tracemalloc for the peak memory
+    # (tracing slows Python code down, so it is kept out of the timed runs)
+    times = []
+    for run in range(repeat + 1):
+        scratch = tempfile.mkdtemp(dir=data["folder_path"])
+        call = bench(data, scratch)
+        with contextlib.redirect_stdout(io.StringIO()):  # The pipeline functions print progress
+            if run < repeat:
+                start = time.perf_counter()
+                items = call()
+                times.append(time.perf_counter() - start)
+            else:
+                tracemalloc.start()
+                call()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {"seconds": statistics.median(times), "peak_MB": peak / 1024**2, "items": items}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=200)
+    parser.add_argument("--watches", type=int, default=300, help="watch-history entries per participant")
+    parser.add_argument("--video-pool", type=int, default=5000, help="distinct videos in the watch histories")
+    parser.add_argument("--videos", type=int, default=300, help="videos with an info file and subtitles")
+    parser.add_argument("--mp4s", type=int, default=4, help="synthetic videos for mp4ToScenes (needs ffmpeg)")
+    parser.add_argument("--sample-size", type=int, default=5, help="videos per participant in sampleVids and the download loop")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio to the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key in ("participants", "watches", "video_pool", "videos", "mp4s", "sample_size", "seed")}
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline["config"] != config:
+            print(f"Warning: the baseline was measured with {baseline['config']}, not {config}")
+
+    results, regressions = {}, []
+    with tempfile.TemporaryDirectory() as folder_path:
+        cwd = os.getcwd()
+        os.chdir(folder_path)  # Anything a function saves to the current directory ends up in the temporary folder
+        try:
+            print(f"Generating data for {args.participants} participants and {args.videos} videos...")
+            data = makeData(folder_path, args)
+
+            print(f"{'benchmark':<28}{'seconds':>10}{'peak MB':>10}{'items':>9}  vs baseline")
+            for name in args.only or BENCHMARKS:
+                try:
+                    result = measure(BENCHMARKS[name], data, args.repeat)
+                except Skip as e:
+                    print(f"{name:<28}{'skipped':>10}  {e}")
+                    continue
+                results[name] = result
+                comparison = ""
+                if baseline and name in baseline["results"]:
+                    previous = baseline["results"][name]
+                    time_ratio = result["seconds"] / previous["seconds"]
+                    memory_ratio = result["peak_MB"] / previous["peak_MB"] if previous["peak_MB"] else 1.0
+                    comparison = f"time {time_ratio:.2f}x, memory {memory_ratio:.2f}x"
+                    if time_ratio > args.threshold or memory_ratio > args.threshold:
+                        regressions.append(name)
+                        comparison += "  REGRESSION"
+                print(f"{name:<28}{result['seconds']:>10.3f}{result['peak_MB']:>10.1f}{result['items']:>9}  {comparison}", flush=True)
+        finally:
+            os.chdir(cwd)
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):  # Keep the benchmarks that were not run this time
+            with open(args.baseline, encoding="utf-8") as file:
+                previous = json.load(file)
+            if previous["config"] == config:
+                results = {**previous["results"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"config": config, "python": platform.python_version(), "pandas": pd.__version__, "results": results}, file, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+    elif regressions:
+        print(f"Regressions (more than {args.threshold}x the baseline): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Synthetic data generators for the benchmarks.
+
+Everything is generated locally (ffmpeg test sources for videos), so the benchmarks
+run without network access and with known ground truth.
+"""
+import os
+import json
+import random
+import subprocess
+
+# ffmpeg test sources that look clearly different from each other, so every switch is a real cut
+VIDEO_SOURCES = [
+    "testsrc2",
+    "smptebars",
+    "mandelbrot",
+    "life=mold=10:ratio=0.5:death_color=#C83232:life_color=#00ff00",
+    "rgbtestsrc",
+    "cellauto=rule=110",
+]
+
+
+def make_test_video(path, n_scenes=8, fps=25, size="320x180", min_seconds=1.5, max_seconds=6.0, seed=0):
+    """
+    Writes a short mp4 made of n_scenes test-pattern segments with hard cuts between them.
+
+    Returns:
+        list: Frame numbers where the cuts are (the ground truth for scene detection).
+    """
+    rng = random.Random(seed)
+    durations = [round(rng.uniform(min_seconds, max_seconds) * fps) / fps for _ in range(n_scenes)]
+
+    inputs = []
+    for i, duration in enumerate(durations):
+        source = VIDEO_SOURCES[i % len(VIDEO_SOURCES)]
+        separator = ":" if "=" in source else "="
+        inputs += ["-f", "lavfi", "-t", str(duration), "-i", f"{source}{separator}size={size}:rate={fps}"]
+    inputs += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={sum(durations)}"]
+
+    streams = "".join(f"[{i}:v]format=yuv420p,setsar=1[v{i}];" for i in range(n_scenes))
+    concat = "".join(f"[v{i}]" for i in range(n_scenes)) + f"concat=n={n_scenes}:v=1:a=0[v]"
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", *inputs,
+         "-filter_complex", streams + concat, "-map", "[v]", "-map", f"{n_scenes}:a",
+         "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", "-shortest", path],
+        check=True,
+    )
+
+    cuts, frame = [], 0
+    for duration in durations[:-1]:
+        frame += round(duration * fps)
+        cuts.append(frame)
+    return cuts
+
+
+def make_test_videos(folder_path, n_videos=5, n_scenes=8, fps=25, seed=0):
+    """
+    Writes n_videos synthetic videos named like YouTube ids (11 characters) into folder_path.
+
+    Returns:
+        dict: video_id -> list of cut frame numbers.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    ground_truth = {}
+    for i in range(n_videos):
+        video_id = f"synthetic{i:02d}"
+        ground_truth[video_id] = make_test_video(os.path.join(folder_path, f"{video_id}.mp4"), n_scenes=n_scenes, fps=fps, seed=seed + i)
+    return ground_truth
+
+
+ID_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
+WORDS = ("the video shows how we can make this work with a few simple steps and then you will see "
+         "what happens when everything comes together at the end of the day").split()
+
+
+def make_video_ids(n_videos, seed=0):
+    # Random 11 character ids, like YouTube's
+    rng = random.Random(seed)
+    return ["".join(rng.choice(ID_CHARACTERS) for _ in range(11)) for _ in range(n_videos)]
+
+
+def make_watch_histories(folder_path, n_participants=50, watches_per_participant=200, n_videos=2000, seed=0):
+    """
+    Writes one Google Takeout style watch-history file per participant ([participant-id].json), with a share
+    of ads (details), YouTube Music entries (longer urls) and removed videos (no titleUrl), like the real exports.
+
+    Returns:
+        list: The video ids used.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    rng = random.Random(seed)
+    video_ids = make_video_ids(n_videos, seed)
+    popularity = [1 / (rank + 1) for rank in range(n_videos)]  # A few videos are watched by many participants
+
+    for participant in range(n_participants):
+        entries = []
+        for video_id in rng.choices(video_ids, weights=popularity, k=watches_per_participant):
+            kind = rng.random()
+            entry = {
+                "header": "YouTube",
+                "title": f"Watched {' '.join(rng.choices(WORDS, k=6))}",
+                "titleUrl": f"https://www.youtube.com/watch?v={video_id}",
+                "subtitles": [{"name": "Some Channel", "url": "https://www.youtube.com/channel/UC0000000000000000000000"}],
+                "time": f"202{rng.randint(0, 3)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00.000Z",
+                "products": ["YouTube"],
+                "activityControls": ["YouTube watch history"],
+                "Incorporation Date": f"2024-0{rng.randint(1, 6)}-01",
+            }
+            if kind < 0.05:
+                entry["details"] = [{"name": "From Google Ads"}]
+            elif kind < 0.08:
+                entry["titleUrl"] += "&feature=music"
+            elif kind < 0.10:
+                del entry["titleUrl"]  # Removed video
+            entries.append(entry)
+        with open(os.path.join(folder_path, f"{100000 + participant}.json"), "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+    return video_ids
+
+
+def make_info_json(folder_path, video_id, seed=0, duration=None):
+    """Writes a <video_id>.info.json with the fields yt-dlp writes and ytutils.Metadata reads (lists kept to one element, as pandas.read_json needs equal lengths)."""
+    rng = random.Random(f"{seed}-{video_id}")
+    duration = duration if duration is not None else rng.randint(20, 1200)
+    info = {
+        "id": video_id,
+        "title": " ".join(rng.choices(WORDS, k=8)),
+        "upload_date": f"20{rng.randint(10, 23)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}",
+        "channel_id": "UC" + "".join(rng.choice(ID_CHARACTERS) for _ in range(22)),
+        "channel": "Some Channel",
+        "channel_follower_count": rng.randint(0, 10**7),
+        "view_count": rng.randint(0, 10**8),
+        "like_count": rng.randint(0, 10**6),
+        "comment_count": rng.randint(0, 10**5),
+        "duration": duration,
+        "description": " ".join(rng.choices(WORDS, k=rng.randint(10, 300))),
+        "tags": [" ".join(rng.choices(WORDS, k=5))],
+        "categories": ["Entertainment"],
+        "age_limit": 0,
+        "is_live": False,
+        "was_live": False,
+        "availability": "public",
+        "fps": 25,
+        "asr": 44100,
+        "audio_channels": 2,
+        "height": 360,
+        "width": 640,
+        "format": "18 - 640x360 (360p)",
+        "format_note": "360p",
+        "vcodec": "avc1.42001E",
+        "acodec": "mp4a.40.2",
+        "dynamic_range": "SDR",
+        "aspect_ratio": 1.78,
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+    }
+    with open(os.path.join(folder_path, f"{video_id}.info.json"), "w", encoding="utf-8") as file:
+        json.dump(info, file)
+    return info
+
+
+def timestamp(seconds):
+    return f"{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{seconds % 60:06.3f}"
+
+
+def make_vtt(folder_path, video_id, duration=60, kind="manual", seed=0, language="en"):
+    """
+    Writes a subtitle file <video_id>.<language>.vtt.
+    kind="manual" writes plain cues (uploaded subtitles and Whisper output),
+    kind="rolling" writes YouTube's rolling auto-captions: word-level <c> timing tags, each line repeated in the next cue.
+    """
+    rng = random.Random(f"{seed}-{video_id}")
+    lines = ["WEBVTT", "Kind: captions", f"Language: {language}", ""]
+    start, previous_text = 0.0, " "
+    while start < duration - 1:
+        length = rng.uniform(1.5, 4.0)
+        end = min(start + length, duration)
+        words = rng.choices(WORDS, k=rng.randint(3, 9))
+        if kind == "manual":
+            lines += [f"{timestamp(start)} --> {timestamp(end)}", " ".join(words), ""]
+        else:
+            step = (end - start) / len(words)
+            tagged = words[0] + "".join(f"<{timestamp(start + (i + 1) * step)}><c> {word}</c>" for i, word in enumerate(words[1:]))
+            text = " ".join(words)
+            lines += [f"{timestamp(start)} --> {timestamp(end - 0.01)} align:start position:0%", previous_text, tagged, ""]
+            lines += [f"{timestamp(end - 0.01)} --> {timestamp(end)} align:start position:0%", text, " ", ""]
+            previous_text = text
+        start = end
+    with open(os.path.join(folder_path, f"{video_id}.{language}.vtt"), "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def make_scenes(durations, mean_seconds=4.0, fps=25, seed=0):
+    """
+    Scene rows like ytutils.PySceneDetect.mp4ToScenes returns, for videos that are not decoded
+    (durations: dict of video_id -> seconds).
+
+    Returns:
+        list: Rows of id, start_time, end_time, start_frame_num, end_frame_num.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for video_id, duration in durations.items():
+        start = 0.0
+        while start < duration:
+            end = min(start + rng.expovariate(1 / mean_seconds) + 0.5, duration)
+            rows.append([video_id, timestamp(start), timestamp(end), round(start * fps), round(end * fps)])
+            start = end
+    return rows
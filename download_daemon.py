@@ -0,0 +1,379 @@
+"""
+Long-running download daemon with a persistent, crash-safe work queue.
+
+The queue is a SQLite database of participants and their candidate videos, in the order
+download_unique_videos would try them (see download_utils.plan_downloads). Enqueueing a new
+donation batch only plans the participants that are not in the queue yet, and can be done while
+the daemon runs. The daemon downloads one video at a time with download_utils.download_video,
+writes the same log entries as download_unique_videos, and records every step in the queue,
+so after a crash it continues with the video it was downloading instead of rescanning.
+
+Usage:
+    python download_daemon.py enqueue --history clean_watch_history.csv [--queue download_queue.sqlite] [--sample-size 20]
+    python download_daemon.py run [--queue download_queue.sqlite] [--status-file download_status.json] [--status-port 8765]
+    python download_daemon.py status [--queue download_queue.sqlite]
+
+Status (written to --status-file after every video, served as JSON on http://127.0.0.1:<status-port>/):
+    queue_depth, videos_needed, participants per status, throughput (videos per hour) and the ETA
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from ytutils.Output import loadDataFrame
+from download_utils import (download_video, make_log_entry, concatenate_logs, plan_downloads, refresh_auth, get_video_info,
+                            is_video_attempted_downloded, now, MyLogger, ARTIFACT_TYPES)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS participants (
+    participant TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,       -- order of enqueueing; participants are worked through in this order
+    needed INTEGER NOT NULL,         -- videos still to download when enqueued
+    artifact_type TEXT NOT NULL,
+    status TEXT NOT NULL,            -- download, complete, insufficient (ran out of videos) or a status of plan_downloads
+    enqueued REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    participant TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    rank INTEGER NOT NULL,           -- order to try the videos of a participant in
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending, running, done, failed, skipped (attempted for another participant or by another run), unneeded
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    size_bytes INTEGER,
+    reply TEXT,
+    PRIMARY KEY (participant, video_id)
+);
+CREATE INDEX IF NOT EXISTS items_by_state ON items (state, participant, rank);
+CREATE INDEX IF NOT EXISTS items_by_video ON items (video_id, state);
+"""
+
+THROUGHPUT_WINDOW = 50  # Recent attempts the throughput and ETA are computed from
+
+
+class DownloadQueue:
+    """
+    The SQLite work queue. Every change is one transaction, and the database runs in WAL mode, so a crash (or kill)
+    never loses a finished step and other processes can enqueue or read the status while the daemon writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")  # A committed step survives a power cut, not only a crash
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()  # The status server reads from another thread
+
+    def transaction(self, statements):
+        # Run (sql, parameters) pairs as one transaction
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, parameters in statements:
+                    cursor.execute(sql, parameters)
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def known_participants(self):
+        return {row[0] for row in self.query("SELECT participant FROM participants")}
+
+    def enqueue(self, participants, candidates, artifact_type):
+        # Add a plan (from plan_downloads) for participants that are not queued yet; returns the number added
+        known = self.known_participants()
+        participants = participants[~participants['Participant ID'].astype(str).isin(known)]
+        candidates = candidates[candidates['Participant ID'].astype(str).isin(set(participants['Participant ID'].astype(str)))]
+        position = self.query("SELECT COALESCE(MAX(position), -1) FROM participants")[0][0] + 1
+        enqueued = time.time()
+        statements = [("INSERT INTO participants (participant, position, needed, artifact_type, status, enqueued) VALUES (?, ?, ?, ?, ?, ?)",
+                       (str(participant), position + i, int(needed), artifact_type, status, enqueued))
+                      for i, (participant, needed, status) in enumerate(participants[['Participant ID', 'needed', 'status']].itertuples(index=False))]
+        statements += [("INSERT OR IGNORE INTO items (participant, video_id, rank) VALUES (?, ?, ?)", (str(participant), video_id, int(rank)))
+                       for participant, video_id, rank in candidates[['Participant ID', 'video_id', 'rank']].itertuples(index=False)]
+        self.transaction(statements)
+        return len(participants)
+
+    def recover(self):
+        # Videos that were being downloaded when the daemon stopped are tried again (yt-dlp resumes its .part files)
+        self.transaction([("UPDATE items SET state = 'pending' WHERE state = 'running'", ())])
+
+    def claim(self):
+        # The next video to try: the first pending video of the first participant that still needs videos
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute(
+                    "SELECT i.participant, i.video_id, p.artifact_type FROM items i JOIN participants p USING (participant) "
+                    "WHERE p.status = 'download' AND i.state = 'pending' ORDER BY p.position, i.rank LIMIT 1").fetchone()
+                if row is not None:
+                    cursor.execute("UPDATE items SET state = 'running', attempts = attempts + 1, started = ? WHERE participant = ? AND video_id = ?",
+                                   (time.time(), row[0], row[1]))
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+        return row
+
+    def attempted_elsewhere(self, participant, video_id):
+        # Attempted for another participant (download_unique_videos tries each video once per run)
+        return bool(self.query("SELECT 1 FROM items WHERE video_id = ? AND participant != ? AND state IN ('done', 'failed') LIMIT 1",
+                               (video_id, participant)))
+
+    def finish(self, participant, video_id, state, reply=None, size=None):
+        # Record the outcome of a video and, in the same transaction, close the participant when it is done
+        finished = time.time()
+        self.transaction([
+            ("UPDATE items SET state = ?, finished = ?, reply = ?, size_bytes = ? WHERE participant = ? AND video_id = ?",
+             (state, finished, reply, size, participant, video_id)),
+            ("UPDATE participants SET status = 'complete', finished = ? WHERE participant = ? AND status = 'download' AND "
+             "needed <= (SELECT COUNT(*) FROM items WHERE participant = ? AND state = 'done')", (finished, participant, participant)),
+            ("UPDATE items SET state = 'unneeded' WHERE participant = ? AND state = 'pending' AND "
+             "(SELECT status FROM participants WHERE participant = ?) = 'complete'", (participant, participant)),
+        ])
+
+    def close_exhausted(self):
+        # Participants without pending videos that still need some ran out of videos; returns them with what is missing
+        rows = self.query(
+            "SELECT p.participant, p.needed - (SELECT COUNT(*) FROM items i WHERE i.participant = p.participant AND i.state = 'done') "
+            "FROM participants p WHERE p.status = 'download' AND NOT EXISTS "
+            "(SELECT 1 FROM items i WHERE i.participant = p.participant AND i.state IN ('pending', 'running'))")
+        if rows:
+            finished = time.time()
+            self.transaction([("UPDATE participants SET status = 'insufficient', finished = ? WHERE participant = ?", (finished, participant))
+                              for participant, _ in rows])
+        return rows
+
+    def status(self):
+        # Queue depth, progress, throughput and ETA, from the queue alone
+        participants = dict(self.query("SELECT status, COUNT(*) FROM participants GROUP BY status"))
+        items = dict(self.query("SELECT state, COUNT(*) FROM items GROUP BY state"))
+        queue_depth = self.query("SELECT COUNT(*) FROM items i JOIN participants p USING (participant) "
+                                 "WHERE p.status = 'download' AND i.state IN ('pending', 'running')")[0][0]
+        videos_needed = self.query("SELECT COALESCE(SUM(p.needed - (SELECT COUNT(*) FROM items i WHERE i.participant = p.participant AND i.state = 'done')), 0) "
+                                   "FROM participants p WHERE p.status = 'download'")[0][0]
+        running = self.query("SELECT participant, video_id, started FROM items WHERE state = 'running'")
+        recent = self.query("SELECT started, finished, state, size_bytes FROM items WHERE state IN ('done', 'failed') AND started IS NOT NULL "
+                            "ORDER BY finished DESC LIMIT ?", (THROUGHPUT_WINDOW,))
+
+        throughput = None
+        eta_seconds = None
+        if len(recent) >= 2:
+            span = max(recent[0][1] - min(started for started, _, _, _ in recent), 1e-9)
+            successes = sum(state == 'done' for _, _, state, _ in recent)
+            throughput = {
+                "attempts_per_hour": round(len(recent) / span * 3600, 2),
+                "videos_per_hour": round(successes / span * 3600, 2),
+                "MB_per_hour": round(sum(size or 0 for _, _, _, size in recent) / 1024**2 / span * 3600, 2),
+                "window": len(recent),
+            }
+            if successes:
+                eta_seconds = round(videos_needed / (successes / span))
+        return {
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "queue_depth": queue_depth,
+            "videos_needed": videos_needed,
+            "participants": participants,
+            "items": items,
+            "running": [{"participant": participant, "video_id": video_id, "seconds": round(time.time() - started)} for participant, video_id, started in running],
+            "throughput": throughput,
+            "eta_seconds": eta_seconds,
+            "eta": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() + eta_seconds)) if eta_seconds is not None else None,
+        }
+
+
+def already_downloaded(video_id, download_dir, artifact_type):
+    # A downloaded video also serves an audio run, but not the other way around (as in download_unique_videos)
+    usable = ['video'] if artifact_type == 'video' else ['video', 'audio']
+    return any(os.path.exists(os.path.join(download_dir, f"{video_id}.{ARTIFACT_TYPES[kind]}")) for kind in usable)
+
+
+def logged_attempt(video_id, log_path):
+    # The log entry of a video that was attempted already (by the daemon before it stopped, or by a download run), or None
+    if not is_video_attempted_downloded(video_id, log_path):
+        return None
+    return pd.read_csv(os.path.join(log_path, f"{video_id}.log.csv"), dtype={"Participant ID": str, "video_id": str}).iloc[0]
+
+
+def write_status(queue, status_path):
+    # Written to a temporary file first, so readers never see half a status
+    if not status_path:
+        return
+    temp_path = status_path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(queue.status(), file, indent=2)
+    os.replace(temp_path, status_path)
+
+
+def serve_status(queue, port):
+    # A small local endpoint: GET / returns the status as JSON (computed when asked)
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(queue.status(), indent=2).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Keep the daemon's output to the downloads
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StatusHandler)
+    threading.Thread(target=server.serve_forever, name="status-server", daemon=True).start()
+    return server
+
+
+def enqueue(args):
+    # Plan the participants of a (new) watch history that are not queued yet, exactly as download_unique_videos would
+    queue = DownloadQueue(args.queue)
+    watch_history = loadDataFrame(args.history)
+    watch_history = watch_history[watch_history["video_id"].notna()].astype({"Participant ID": str})
+    watch_history = watch_history[~watch_history["Participant ID"].isin(queue.known_participants())]  # Queued participants are not planned again
+    if watch_history.empty:
+        print("No new participants to enqueue.")
+        return
+
+    os.makedirs(args.log_path, exist_ok=True)
+    participants, candidates = plan_downloads(watch_history, concatenate_logs(args.log_path), args.log_path, args.sample_size, args.seed, args.artifact_type)
+    added = queue.enqueue(participants, candidates, args.artifact_type)
+
+    # Participants that can not get enough videos are logged like the download loop logs them
+    for participant, needed, status in participants[participants["status"].str.startswith("insufficient_")][["Participant ID", "needed", "status"]].itertuples(index=False):
+        if status != "insufficient_logged":
+            if status == "insufficient_unique":
+                message = f"Skipping Participant {participant}: Less than {needed} unique video(s) left."
+            else:
+                message = f"Skipping Participant {participant}: Fewer than {needed} new videos to download."
+            make_log_entry(participant, None, False, message, now(), now(), args.log_path, exept=True)
+    print(f"Enqueued {added} participants ({int((participants['status'] == 'download').sum())} to download for, "
+          f"{len(candidates)} candidate videos).")
+
+
+def run(args):
+    queue = DownloadQueue(args.queue)
+    queue.recover()
+    os.makedirs(args.download_dir, exist_ok=True)
+    os.makedirs(args.log_path, exist_ok=True)
+    server = serve_status(queue, args.status_port) if args.status_port else None
+    if server:
+        print(f"Status on http://127.0.0.1:{args.status_port}/", flush=True)
+
+    # SIGTERM (e.g. systemd stop) lets the current video finish; Ctrl+C stops right away (the video is retried on restart)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    speed_limit = int(args.speed_limit_KB * 1024) if args.speed_limit_KB else None
+
+    while not stopping.is_set():
+        for participant, missing in queue.close_exhausted():
+            make_log_entry(participant, None, False, f"Skipping Participant {participant}: ran out of videos ({missing} missing).",
+                           now(), now(), args.log_path, exept=True)
+
+        item = queue.claim()
+        if item is None:
+            write_status(queue, args.status_file)
+            if args.exit_when_idle:
+                break
+            stopping.wait(args.poll_seconds)  # Wait for new participants to be enqueued
+            continue
+        participant, video_id, artifact_type = item
+        extension = ARTIFACT_TYPES[artifact_type]
+
+        if queue.attempted_elsewhere(participant, video_id):
+            queue.finish(participant, video_id, "skipped", "Attempted for another participant")
+            continue
+        # Logged already: the log entry is kept as it is and only the queue is updated
+        entry = logged_attempt(video_id, args.log_path)
+        if entry is not None:
+            if entry["Participant ID"] == participant:  # The daemon stopped between the log entry and the queue update
+                size = int(entry["size_MB"] * 1024**2) if pd.notna(entry["size_MB"]) else None
+                queue.finish(participant, video_id, "done" if entry["status"] == "successful" else "failed", entry["server_reply"], size)
+            else:  # e.g. by a download_unique_videos run since the participant was enqueued
+                print(f"Video {video_id} already attempted for participant {entry['Participant ID']}.", flush=True)
+                queue.finish(participant, video_id, "skipped", "Attempted in another download run")
+            continue
+        if already_downloaded(video_id, args.download_dir, artifact_type):
+            print(f"Video {video_id} already in download folder.", flush=True)
+            make_log_entry(participant, video_id, True, "Already in download folder", now(), now(), args.log_path, artifact_type=artifact_type)
+            queue.finish(participant, video_id, "done", "Already in download folder")
+            continue
+
+        print(f"Attempting download for video {video_id} (participant {participant})", flush=True)
+        po_token, cookie_file = refresh_auth(args.auth_dir)
+        logger = MyLogger()
+        start_time = now()
+        success, server_reply, log = download_video(video_id, args.download_dir, speed_limit, logger, po_token, cookie_file, artifact_type)
+        end_time = now()
+        media_path = os.path.join(args.download_dir, f"{video_id}.{extension}")
+        size = os.path.getsize(media_path) if success and os.path.exists(media_path) else None
+        print(f"video: {video_id}, result: {success}, time: {(end_time - start_time).total_seconds() / 60:.2f} min, message: {server_reply}", flush=True)
+
+        # The log entry first: if the daemon dies in between, the retry finds the entry and only updates the queue
+        make_log_entry(participant, video_id, success, server_reply, start_time, end_time, args.log_path, log=log, size=size,
+                       info=get_video_info(video_id, args.download_dir), artifact_type=artifact_type)
+        queue.finish(participant, video_id, "done" if success else "failed", server_reply, size)
+        write_status(queue, args.status_file)
+
+        stopping.wait(random.uniform(*args.wait_time_range))  # Random wait between downloads (to avoid rate-limiting)
+
+    write_status(queue, args.status_file)
+    if server:
+        server.shutdown()
+    print("Download daemon stopped.")
+
+
+def status(args):
+    print(json.dumps(DownloadQueue(args.queue).status(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue", default="download_queue.sqlite", help="the queue database (created if missing)")
+    parser.add_argument("--log-path", default="Log_Entries")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subcommands.add_parser("enqueue", help="plan and queue the participants of a watch history that are not queued yet")
+    enqueue_parser.add_argument("--history", required=True, help="cleaned watch history (.csv, .parquet or .arrow) with 'Participant ID' and 'video_id'")
+    enqueue_parser.add_argument("--sample-size", type=int, default=20)
+    enqueue_parser.add_argument("--seed", type=int, default=42)
+    enqueue_parser.add_argument("--artifact-type", choices=["video", "audio"], default="video")
+    enqueue_parser.set_defaults(func=enqueue)
+
+    run_parser = subcommands.add_parser("run", help="download the queued videos until stopped")
+    run_parser.add_argument("--download-dir", default="Downloads")
+    run_parser.add_argument("--auth-dir", default="Authentication")
+    run_parser.add_argument("--speed-limit-KB", type=float, default=800)
+    run_parser.add_argument("--wait-time-range", type=float, nargs=2, default=(5, 10))
+    run_parser.add_argument("--status-file", default="download_status.json")
+    run_parser.add_argument("--status-port", type=int, default=None, help="serve the status as JSON on this local port")
+    run_parser.add_argument("--poll-seconds", type=float, default=30, help="how often to look for new participants when the queue is empty")
+    run_parser.add_argument("--exit-when-idle", action="store_true", help="stop when the queue is empty instead of waiting")
+    run_parser.set_defaults(func=run)
+
+    status_parser = subcommands.add_parser("status", help="print the queue status")
+    status_parser.set_defaults(func=status)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
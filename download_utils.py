@@ -19,20 +19,26 @@ download attempts and their outcomes.
 Dependencies:
 """
 import pandas as pd
-import yt_dlp as yt
 import subprocess
 import os
 import numpy as np
 import time
 import random
 import json
-import zipfile
+import hashlib
 import sys
-import ffmpeg
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 sys.path.append('../')
-from ytutils import *
+from ytutils.Profiling import profiled  # Opt-in stage timing (YTUTILS_PROFILE); a plain call when it is off
+
+from ytutils.Clips import clipSections, clipSummary, writeClip, readClip
+from ytutils.Output import saveDataFrame
+
+# yt_dlp, ffmpeg and ytutils.Dedup (OpenCV) are imported in the functions that use them, 
+# so that importing this module for planning, logging or reconciling stays fast.
 
 ###############################################################################################################
 # Function to check if a video is already in the downloads folder
@@ -110,12 +116,43 @@ def nb_videos_downloaded(log_df, participant):
     return len(filtered_df)
 ###############################################################################################################
 
+# What a download produces, and the extension of the media file it leaves in the download directory.
+# 'audio_stream' leaves no media file: the audio is decoded straight into an AudioCache (see stream_audio).
+ARTIFACT_TYPES = {
+    'video': 'mp4',
+    'audio': 'm4a',
+    'audio_stream': None,
+}
+
+# Smallest stream that is still good for transcription: the AAC track YouTube serves for every video (format 140)
+AUDIO_FORMAT = 'ba[ext=m4a]/ba[acodec^=mp4a]/ba'
+
+def log_artifact_types(log_df):
+    # The artifact type of each log entry (entries written before audio-only downloads existed are videos)
+    if 'artifact_type' not in log_df.columns:
+        return pd.Series('video', index=log_df.index)
+    return log_df['artifact_type'].fillna('video')
+
+
+def successful_downloads(log_df, artifact_type='video'):
+    """
+    The successful log entries that count toward the quota of a download run for artifact_type: a downloaded video 
+    also provides the audio, so audio runs count every success, while video runs only count videos.
+    """
+    if log_df.empty:
+        return log_df
+    successful = log_df['status'] == 'successful'
+    if artifact_type == 'video':
+        successful &= log_artifact_types(log_df) == 'video'
+    return log_df[successful]
+###############################################################################################################
+
 def now():
     return pd.to_datetime(datetime.now())
 ###############################################################################################################
 
 # Function that makes a log entry (.csv) for a video. This log entry is saved to log_path. 
-def make_log_entry(participant, video_id, success, server_reply, start_time, end_time, log_path, exept = False, log=False, size=None, info={}):
+def make_log_entry(participant, video_id, success, server_reply, start_time, end_time, log_path, exept = False, log=False, size=None, info={}, artifact_type='video'):
     """
     Creates a log entry for a video download attempt, recording the participant ID, video ID, download status, 
     server response, and download duration. Saves the entry as a CSV file in the specified log directory.
@@ -128,6 +165,7 @@ def make_log_entry(participant, video_id, success, server_reply, start_time, end
         time (float): Time taken for the download in minutes.
         log_path (str): Directory where the log file will be saved.
         exept (bool): If True, indicates that this log entry is a special case for participants with insufficient videos.
+        artifact_type (str): What was downloaded, one of ARTIFACT_TYPES (default is 'video').
 
     Returns:
         None
@@ -148,7 +186,8 @@ def make_log_entry(participant, video_id, success, server_reply, start_time, end
                     'start_time': start_time, 
                     'end_time': end_time,
                     'download_time_minutes': round(total_seconds/60, 2),
-                    'download_speed_KBs': round((size/1024)/total_seconds, 2) if size else None
+                    'download_speed_KBs': round((size/1024)/total_seconds, 2) if size else None,
+                    'artifact_type': artifact_type
                 }
     log_data.update(info)
     log_data.update({'log': log})
@@ -166,6 +205,7 @@ def make_log_entry(participant, video_id, success, server_reply, start_time, end
 # Function to run through all the log files in log_path (each created by make_log_entry) 
 # and concatinate them into one dataframe that can be used to check for vidoes downloaded 
 # or attempted downloaded  
+@profiled
 def concatenate_logs(log_path):
     """
     Combines all individual log CSV files in the specified directory into a single DataFrame. Useful for creating 
@@ -265,3 +305,1010 @@ class MyLogger:
         self.logs.append(f"ERROR: {msg}")
 ###############################################################################################################
 
+def refresh_auth(auth_dir):
+    po_token_path = os.path.join(auth_dir, "po-token_value.txt")
+    cookie_file_path = os.path.join(auth_dir, "cookies.txt")
+    
+    # Load PO token and cookies
+    try:
+        with open(po_token_path, "r") as token_file:
+            po_token = token_file.read().strip()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"PO token file not found at {po_token_path}")
+
+    if not os.path.exists(cookie_file_path):
+        raise FileNotFoundError(f"Cookie file not found at {cookie_file_path}")
+
+    return po_token, cookie_file_path
+###############################################################################################################
+
+# Function to join the time windows of a partial download into one file
+def join_sections(video_id, download_dir, extension):
+    """
+    Joins the files yt-dlp wrote for the windows of a partial download (<video_id>.section<start>.<ext>) into 
+    <video_id>.<ext>, in time order, without re-encoding, and deletes them. A single file (also the whole video, 
+    when it was too short to clip) is just renamed.
+    """
+    prefix = f'{video_id}.section'
+    parts = [file for file in os.listdir(download_dir) if file.startswith(prefix) and file.endswith('.' + extension)]
+    start = lambda file: float(file[len(prefix):-len('.' + extension)].replace('NA', '0'))
+    parts = [os.path.join(download_dir, file) for file in sorted(parts, key=start)]
+    output_path = os.path.join(download_dir, f'{video_id}.{extension}')
+    if len(parts) == 1:
+        os.replace(parts[0], output_path)
+    elif len(parts) > 1:
+        import ffmpeg
+        list_path = os.path.join(download_dir, f'{video_id}.sections.txt')
+        with open(list_path, 'w') as file:
+            file.writelines(f"file '{os.path.abspath(part)}'\n" for part in parts)
+        ffmpeg.input(list_path, format='concat', safe=0).output(output_path, c='copy').overwrite_output().run(quiet=True)
+        for path in parts + [list_path]:
+            os.remove(path)
+###############################################################################################################
+
+@profiled
+def download_video(video_id, download_dir, speed_limit, logger=None, po_token=None, cookie_file=None, artifact_type='video', clip=None):
+    """
+    Downloads a YouTube video based on the provided video ID and saves it in the specified directory 
+    with a set download speed limit and resolution (no av1 codec!!). Returns download status and a server response message.
+    With artifact_type='audio' only the audio stream is downloaded, as <video_id>.m4a.
+    With clip=(n_segments, segment_seconds) only those time windows are downloaded (see ytutils.Clips.clipSections), 
+    joined into one file with a <video_id>.clip.json sidecar recording where they came from.
+
+    Parameters:
+        video_id (str): Unique identifier of the video to download.
+        download_dir (str): Directory where the video will be saved.
+        speed_limit (int): Download rate limit in bytes per second.
+        logger (class): class defined in download_utils. Will save all output from yt-dlp so it can be added to the logs.
+        po_token (str): Personal OAuth token for authentication (if needed).
+        cookie_file (str): Path to the cookie file (if needed).
+        artifact_type (str): 'video' (default) or 'audio'.
+        clip (tuple): Optional (n_segments, segment_seconds), e.g. (1, 180) for the first 3 minutes or (3, 60) for three 
+                      one-minute windows spread over the video. Videos no longer than the windows are downloaded whole.
+
+    Returns:
+        tuple: (bool, str) where the boolean indicates success (True) or failure (False), 
+        the string provides a message detailing the outcome or error encountered, and the log of outputs (list).
+    """
+    # Ensure the output folder path ends with a separator
+    if not download_dir.endswith(os.sep):
+        download_dir += os.sep
+
+    video_url = f"https://www.youtube.com/watch?v={video_id}"
+
+    # Set options for downloading
+    ydl_opts = {
+        'ratelimit': speed_limit,
+        'throttledratelimit': int(200 * 1024),  # Throttling limit
+        'format': 'bv*[ext=mp4][height<=360][vcodec!*=av01]+ba[ext=m4a]/b[ext=mp4][height<=360][vcodec!*=av01]/b[ext=mp4][height<=360]/18',
+        'outtmpl': os.path.join(download_dir, f'{video_id}.%(ext)s'),
+        'noplaylist': True,
+        'quiet': False,
+        'verbose': True,
+        'writeinfojson': True,
+        'geo_bypass': True,
+        'age_limit': 18,
+        'retries': 3,
+        'logger': logger,
+        'cookiefile': cookie_file,
+        'extractor_args': {'youtube': {'player_client': ['web'], 'po_token': [f"web.gsv+{po_token}"]}}, #'extractor_args': {'youtube': {'player_client': ['web'], 'po_token': [f"web+{po_token}"]}},
+        'match_filter': lambda info: (
+            "Skipping livestream (live or past live)" if info.get('is_live') or info.get('was_live') else None
+        ),
+    }
+    if artifact_type == 'audio':
+        ydl_opts['format'] = AUDIO_FORMAT
+        ydl_opts['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a'}]  # Only converts the rare non-AAC fallback
+    elif artifact_type != 'video':
+        raise ValueError(f"download_video downloads 'video' or 'audio', not {artifact_type!r}")
+
+    sections = []
+    if clip is not None:
+        def download_ranges(info, ydl):
+            # Called by yt-dlp once the duration is known; each window is downloaded as its own file
+            sections[:] = clipSections(info.get('duration'), *clip) or []
+            return [{'start_time': start, 'end_time': end} for start, end in sections]
+        ydl_opts['download_ranges'] = download_ranges
+        ydl_opts['force_keyframes_at_cuts'] = True  # Exact cuts, so the times in the sidecar are exact
+        ydl_opts['outtmpl'] = {'default': os.path.join(download_dir, f'{video_id}.section%(section_start)s.%(ext)s'),
+                               'infojson': os.path.join(download_dir, f'{video_id}.%(ext)s')}
+
+    import yt_dlp as yt  # Outside the try: a missing yt_dlp stops the run instead of being logged as failed downloads
+
+    try:
+        # Use yt-dlp with the specified options
+        with yt.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(video_url, download=True)
+
+        if clip is not None:
+            join_sections(video_id, download_dir, ARTIFACT_TYPES[artifact_type])
+            if sections:
+                writeClip(download_dir, video_id, info.get('duration'), sections)
+
+        log = logger.logs if logger else None
+        return True, "Download successful", log
+
+    except Exception as e:
+        error_message = str(e)
+        log = logger.logs if logger else None
+        return False, error_message, log
+###############################################################################################################
+
+# Function to stream the audio of a video straight into an audio cache, without saving the media file
+@profiled
+def stream_audio(video_id, download_dir, audio_cache, logger=None, po_token=None, cookie_file=None):
+    """
+    Streams the audio of a YouTube video into an AudioCache (ytutils.AudioCache): ffmpeg decodes the audio stream 
+    to PCM while it downloads, so the compressed media is never written to disk. Only the .info.json file is saved 
+    in download_dir, so metadata and logging work as for downloaded videos.
+
+    Parameters:
+        video_id (str): Unique identifier of the video.
+        download_dir (str): Directory where the info file will be saved.
+        audio_cache (AudioCache): Cache the decoded audio is added to (Whisper reads it from there).
+        logger (class): class defined in download_utils. Will save all output from yt-dlp so it can be added to the logs.
+        po_token (str): Personal OAuth token for authentication (if needed).
+        cookie_file (str): Path to the cookie file (if needed).
+
+    Returns:
+        tuple: (bool, str, list, int) success, a message detailing the outcome or error, the log of outputs and 
+               the size in bytes of the audio stream (as reported by YouTube, None if unknown).
+
+    Notes:
+        - There is no speed limit: ffmpeg reads the stream as fast as it decodes (audio streams are small).
+    """
+    video_url = f"https://www.youtube.com/watch?v={video_id}"
+    ydl_opts = {
+        'format': AUDIO_FORMAT,
+        'outtmpl': os.path.join(download_dir, f'{video_id}.%(ext)s'),
+        'skip_download': True,  # Only the info file; the audio itself is read by ffmpeg
+        'writeinfojson': True,
+        'noplaylist': True,
+        'quiet': True,
+        'geo_bypass': True,
+        'age_limit': 18,
+        'logger': logger,
+        'cookiefile': cookie_file,
+        'extractor_args': {'youtube': {'player_client': ['web'], 'po_token': [f"web.gsv+{po_token}"]}},
+        'match_filter': lambda info: (
+            "Skipping livestream (live or past live)" if info.get('is_live') or info.get('was_live') else None
+        ),
+    }
+
+    import yt_dlp as yt  # Outside the try, as in download_video
+
+    try:
+        with yt.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(video_url, download=True)
+        if info is None:
+            raise ValueError("No video information (skipped by the match filter)")
+        audio_format = (info.get('requested_formats') or [info])[0]
+        headers = "".join(f"{key}: {value}\r\n" for key, value in (audio_format.get('http_headers') or {}).items())
+        audio_cache.add(video_id, audio_format['url'], input_options={'headers': headers} if headers else None)
+
+        log = logger.logs if logger else None
+        return True, "Audio streamed to the audio cache", log, audio_format.get('filesize') or audio_format.get('filesize_approx')
+
+    except Exception as e:
+        log = logger.logs if logger else None
+        return False, str(e), log, None
+###############################################################################################################
+
+# Bitrate profiles for the post-download pool. None remuxes (copies the streams into a fresh mp4 with the index 
+# at the front), the others transcode to H.264/AAC. The frame rate is never changed, so scene frame numbers stay valid.
+TRANSCODE_PROFILES = {
+    "remux": None,
+    "360p_600k": {"height": 360, "video_bitrate": "600k", "audio_bitrate": "96k"},
+    "240p_300k": {"height": 240, "video_bitrate": "300k", "audio_bitrate": "64k"},
+}
+
+
+@profiled
+def transcode_video(video_id, download_dir, profile, log_path):
+    """
+    Remuxes or transcodes a downloaded video in place with ffmpeg and records the bytes saved.
+
+    Parameters:
+        video_id (str): Unique identifier of the video.
+        download_dir (str): Directory where the video is saved.
+        profile (str): Name of a profile in TRANSCODE_PROFILES.
+        log_path (str): Directory of the download logs. The result is saved to log_path/transcode/<video_id>.transcode.csv.
+
+    Returns:
+        dict: The recorded entry (sizes before and after, bytes saved, time taken and any error).
+
+    Notes:
+        - The new file replaces the original only if ffmpeg succeeded, and for transcoding only if it is smaller.
+        - The .info.json file is left as downloaded, so its height/bitrate describe the original stream.
+    """
+    import ffmpeg
+
+    settings = TRANSCODE_PROFILES[profile]
+    video_path = os.path.join(download_dir, f"{video_id}.mp4")
+    temp_path = os.path.join(download_dir, f"{video_id}.transcode.tmp")  # Not .mp4, so listings of the videos never see it
+    size_before = os.path.getsize(video_path)
+    start_time = now()
+
+    if settings is None:
+        output_kwargs = {"c": "copy"}
+    else:
+        output_kwargs = {
+            "vcodec": "libx264", "preset": "veryfast", "video_bitrate": settings["video_bitrate"],
+            "maxrate": settings["video_bitrate"], "bufsize": "2M", "vf": f"scale=-2:'min({settings['height']},ih)'",
+            "acodec": "aac", "audio_bitrate": settings["audio_bitrate"],
+        }
+
+    error = None
+    try:
+        (
+            ffmpeg.input(video_path)
+            .output(temp_path, format="mp4", movflags="+faststart", loglevel="error", **output_kwargs)
+            .overwrite_output()
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        size_after = os.path.getsize(temp_path)
+        if settings is None or size_after < size_before:
+            os.replace(temp_path, video_path)
+        else:
+            os.remove(temp_path)  # Already below the profile bitrate
+            size_after = size_before
+    except ffmpeg.Error as e:
+        error = e.stderr.decode(errors="replace").strip()[-500:]
+        size_after = size_before
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    entry = {
+        'video_id': video_id,
+        'profile': profile,
+        'size_before_MB': round(size_before / 1024**2, 2),
+        'size_after_MB': round(size_after / 1024**2, 2),
+        'bytes_saved': size_before - size_after,
+        'transcode_time_minutes': round((now() - start_time).total_seconds() / 60, 2),
+        'error': error
+    }
+    os.makedirs(os.path.join(log_path, "transcode"), exist_ok=True)
+    pd.DataFrame([entry]).to_csv(os.path.join(log_path, "transcode", f"{video_id}.transcode.csv"), index=False)
+    return entry
+###############################################################################################################
+
+class PostDownloadPool:
+    """
+    Runs transcode_video on downloaded videos in background threads (ffmpeg does the work in its own process),
+    so the next download does not wait for it.
+
+    Parameters:
+        download_dir (str): Directory where the videos are saved.
+        log_path (str): Directory of the download logs.
+        profile (str): Name of a profile in TRANSCODE_PROFILES.
+        workers (int): Number of videos processed at the same time (default is 2).
+        on_done (callable): Optional function called with (participant, video_id) when a video has been processed, 
+                            also if processing failed (the original file is then kept).
+    """
+    def __init__(self, download_dir, log_path, profile, workers=2, on_done=None):
+        if profile not in TRANSCODE_PROFILES:
+            raise ValueError(f"Unknown transcode profile {profile}; choose one of {list(TRANSCODE_PROFILES)}")
+        self.download_dir = download_dir
+        self.log_path = log_path
+        self.profile = profile
+        self.on_done = on_done
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = set()
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+
+    def submit(self, participant, video_id):
+        future = self.executor.submit(transcode_video, video_id, self.download_dir, self.profile, self.log_path)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(lambda future: self._done(future, participant, video_id))
+
+    def _done(self, future, participant, video_id):
+        try:
+            entry = future.result()
+            with self.lock:
+                self.bytes_saved += entry['bytes_saved']
+            if entry['error']:
+                print(f"Transcoding {video_id} failed, keeping the original: {entry['error']}", flush=True)
+        except Exception as e:
+            print(f"Transcoding {video_id} failed, keeping the original: {e}", flush=True)
+        if self.on_done:
+            self.on_done(participant, video_id)
+        with self.lock:
+            self.futures.discard(future)
+
+    def pending(self):
+        return len(self.futures)
+
+    def shutdown(self):
+        # Wait for the videos still being processed
+        self.executor.shutdown(wait=True)
+        print(f"Post-download processing saved {self.bytes_saved / 1024**3:.2f} GB")
+###############################################################################################################
+
+class StorageMonitor:
+    """
+    Pauses the download loop when free disk space drops below min_free_GB, and resumes it once at least 
+    resume_free_GB is free again (the gap avoids pausing and resuming after every download).
+
+    Parameters:
+        path (str): Any path on the volume to watch (e.g. the download directory).
+        min_free_GB (float): Pause below this much free space.
+        resume_free_GB (float): Resume at or above this much free space (default is min_free_GB + 5).
+        evict (callable): Optional function called with the number of bytes to free while paused; it returns the 
+                          bytes it freed, e.g. AudioCache.freeBytes (ytutils.AudioCache).
+        poll_seconds (float): How often free space is checked while paused (default is 30).
+    """
+    def __init__(self, path, min_free_GB, resume_free_GB=None, evict=None, poll_seconds=30):
+        self.path = path
+        self.min_free = min_free_GB * 1024**3
+        self.resume_free = (resume_free_GB if resume_free_GB is not None else min_free_GB + 5) * 1024**3
+        self.evict = evict
+        self.poll_seconds = poll_seconds
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.path).free
+
+    def wait_for_space(self, pool=None):
+        """
+        Blocks while free space is too low, freeing space with evict meanwhile. Returns the number of seconds paused.
+        pool (PostDownloadPool) is only used to report whether transcoding may still free space.
+        """
+        free = self.free_bytes()
+        if free >= self.min_free:
+            return 0
+
+        print(f"Only {free / 1024**3:.2f} GB free on {self.path}. Pausing downloads until {self.resume_free / 1024**3:.2f} GB is free...", flush=True)
+        start = time.time()
+        warned = False
+        while free < self.resume_free:
+            freed = self.evict(self.resume_free - free) if self.evict else 0
+            if not freed and not (pool and pool.pending()) and not warned:
+                print("Nothing left that frees space automatically. Free space on the volume to continue.", flush=True)
+                warned = True
+            time.sleep(self.poll_seconds)
+            free = self.free_bytes()
+        print(f"Resuming downloads after {(time.time() - start) / 60:.1f} min ({free / 1024**3:.2f} GB free)", flush=True)
+        return time.time() - start
+###############################################################################################################
+
+def list_log_folder(log_path):
+    # One listing of the log folder: the attempted videos and the participants logged as having too few videos
+    log_files = os.listdir(log_path) if os.path.exists(log_path) else []
+    attempted = {file[:-len('.log.csv')] for file in log_files if file.endswith('.log.csv') and not file.startswith('insufficiant_vids_')}
+    insufficient = {file[len('insufficiant_vids_'):-len('.log.csv')] for file in log_files if file.startswith('insufficiant_vids_')}
+    return attempted, insufficient
+###############################################################################################################
+
+# Plan which videos to try for each participant, for all participants at once
+@profiled
+def plan_downloads(df, log_df, log_path, sample_size=20, seed=42, artifact_type='video'):
+    """
+    Plans the downloads of download_unique_videos: how many videos each participant still needs and the order 
+    in which their candidate videos are tried. The watch history and the log are grouped once, instead of being 
+    filtered for every participant.
+
+    Parameters:
+        df (pd.DataFrame): Watch history DataFrame with columns 'Participant ID' and 'video_id'.
+        log_df (pd.DataFrame): Concatenated log entries (from concatenate_logs).
+        log_path (str): Directory where log files are stored.
+        sample_size (int): Target number of unique videos to download for each participant (default is 20).
+        seed (int): Random seed for the order of the videos (default is 42).
+        artifact_type (str): What the run downloads, one of ARTIFACT_TYPES (default is 'video'). Downloaded videos also 
+                             count toward the quota of an audio run, but not the other way around.
+
+    Returns:
+        tuple: (participants, candidates)
+            participants (pd.DataFrame): One row per participant, in order of first appearance in df, with 
+                'downloaded_count', 'needed', 'unique_videos', 'new_videos' and 'status' (one of 'download', 'complete', 
+                'insufficient_logged', 'insufficient_unique', 'insufficient_new').
+            candidates (pd.DataFrame): 'Participant ID', 'video_id' and 'rank' (the order to try them in) of the videos 
+                not attempted before, for the participants with status 'download'.
+
+    Notes:
+        - Each video's place in the order comes from a hash of (seed, participant, video_id), so the order for a 
+          participant never changes when other participants (or other videos) are added to the watch history.
+        - Log files are listed once, instead of checking for a log file per video.
+    """
+    unique_videos = df[['Participant ID', 'video_id']].drop_duplicates()
+    participant_ids = pd.Index(unique_videos['Participant ID'].unique(), name='Participant ID')
+
+    attempted, insufficient = list_log_folder(log_path)
+
+    if log_df.empty:
+        downloaded_counts = pd.Series(dtype=int)
+    else:
+        downloaded_counts = successful_downloads(log_df, artifact_type).groupby('Participant ID').size()
+
+    unique_videos = unique_videos.assign(new=~unique_videos['video_id'].isin(attempted))
+    per_participant = unique_videos.groupby('Participant ID', sort=False)['new'].agg(['size', 'sum'])
+
+    participants = pd.DataFrame(index=participant_ids)
+    participants['downloaded_count'] = downloaded_counts.reindex(participant_ids, fill_value=0).astype(int)
+    participants['needed'] = sample_size - participants['downloaded_count']
+    participants['unique_videos'] = per_participant['size'].reindex(participant_ids).astype(int)
+    participants['new_videos'] = per_participant['sum'].reindex(participant_ids).astype(int)
+
+    # Same checks, and in the same order, as the download loop has always made them
+    status = np.select(
+        [participants.index.astype(str).isin(list(insufficient)),
+         participants['downloaded_count'] >= sample_size,
+         participants['unique_videos'] < participants['needed'],
+         participants['new_videos'] < participants['needed']],
+        ['insufficient_logged', 'complete', 'insufficient_unique', 'insufficient_new'],
+        default='download')
+    participants['status'] = status
+    participants = participants.reset_index()
+
+    # Order the new videos of the participants to download for by a per-row hash of (seed, participant, video_id)
+    downloading = participants.loc[participants['status'] == 'download', 'Participant ID']
+    candidates = unique_videos[unique_videos['new'] & unique_videos['Participant ID'].isin(downloading)][['Participant ID', 'video_id']]
+    hash_key = hashlib.sha256(str(seed).encode()).hexdigest()[:16]
+    participant_hash = pd.util.hash_array(candidates['Participant ID'].astype(str).to_numpy(dtype=object), hash_key=hash_key, categorize=False)
+    video_hash = pd.util.hash_array(candidates['video_id'].astype(str).to_numpy(dtype=object), hash_key=hash_key, categorize=False)
+    order_key = (participant_hash * np.uint64(0x9E3779B97F4A7C15)) ^ video_hash  # Wraps around (uint64), as intended
+    participant_order = participant_ids.get_indexer(candidates['Participant ID'])
+    order = np.lexsort((order_key, participant_order))
+
+    candidates = candidates.iloc[order].reset_index(drop=True)
+    starts = np.flatnonzero(np.r_[True, participant_order[order][1:] != participant_order[order][:-1]]) if len(order) else np.array([], dtype=int)
+    candidates['rank'] = np.arange(len(candidates)) - np.repeat(starts, np.diff(np.r_[starts, len(candidates)]))
+
+    return participants, candidates
+###############################################################################################################
+
+PLAN_PARTICIPANT_COLUMNS = ['Participant ID', 'downloaded_count', 'needed', 'unique_videos', 'new_videos', 'status']
+
+def save_download_plan(participants, candidates, plan_path):
+    """
+    Saves a plan from plan_downloads as one .csv file: a row per candidate video with the columns of its participant 
+    (participants without candidates get a single row without a video_id).
+    """
+    plan = participants.merge(candidates, on='Participant ID', how='left')
+    plan.to_csv(plan_path, index=False)
+
+
+def load_download_plan(plan_path, log_df, log_path, sample_size=20, artifact_type='video'):
+    """
+    Loads a plan saved by save_download_plan and brings it up to date with the downloads logged since it was compiled: 
+    videos attempted since are dropped, and the participants' download counts, new videos and status are recounted 
+    (as plan_downloads does).
+
+    Returns:
+        tuple: (participants, candidates), as returned by plan_downloads.
+    """
+    plan = pd.read_csv(plan_path, dtype={'Participant ID': str, 'video_id': str})
+    participants = plan.drop_duplicates(subset=['Participant ID'])[PLAN_PARTICIPANT_COLUMNS].reset_index(drop=True)
+
+    attempted, insufficient = list_log_folder(log_path)
+    candidates = plan[plan['video_id'].notna() & ~plan['video_id'].isin(attempted)][['Participant ID', 'video_id']].reset_index(drop=True)
+    candidates['rank'] = candidates.groupby('Participant ID', sort=False).cumcount()
+
+    if not log_df.empty:
+        downloaded_counts = successful_downloads(log_df, artifact_type).groupby('Participant ID').size()
+        participants['downloaded_count'] = participants['Participant ID'].map(downloaded_counts).fillna(0).astype(int)
+        participants['needed'] = sample_size - participants['downloaded_count']
+    participants['new_videos'] = participants['Participant ID'].map(candidates.groupby('Participant ID').size()).fillna(0).astype(int)
+
+    # The participants still to download for are checked again, in the order of plan_downloads
+    downloading = participants['status'] == 'download'
+    participants.loc[downloading, 'status'] = np.select(
+        [participants.loc[downloading, 'Participant ID'].isin(list(insufficient)),
+         participants.loc[downloading, 'needed'] <= 0,
+         participants.loc[downloading, 'new_videos'] < participants.loc[downloading, 'needed']],
+        ['insufficient_logged', 'complete', 'insufficient_new'],
+        default='download')
+    candidates = candidates[candidates['Participant ID'].isin(participants.loc[participants['status'] == 'download', 'Participant ID'])].reset_index(drop=True)
+    return participants, candidates
+###############################################################################################################
+
+# Forecast the storage and time a plan needs from the earlier download attempts in the logs
+@profiled
+def forecast_downloads(participants, candidates, log_df, wait_time_range=(5, 10), artifact_type=None):
+    """
+    Predicts the bytes and wall-clock time of a download plan from the historical log entries 
+    ('size_MB', 'download_time_minutes', 'download_speed_KBs', 'status' and 'format').
+
+    Parameters:
+        participants (pd.DataFrame): From plan_downloads.
+        candidates (pd.DataFrame): From plan_downloads.
+        log_df (pd.DataFrame): Concatenated log entries (from concatenate_logs).
+        wait_time_range (tuple): Range of the wait time (in seconds) between downloads.
+        artifact_type (str): Only forecast from earlier downloads of this artifact type (default is all of them).
+
+    Returns:
+        dict: {'participants': forecast per participant, 'resolutions': forecast per resolution/format, 'totals': dict}
+
+    Notes:
+        - Expected attempts per participant are the videos needed divided by the historical success rate, 
+          capped at the number of candidates.
+        - The resolution is read from the logged yt-dlp format (e.g. '(360p)'); the forecast assumes future downloads 
+          follow the historical mix of resolutions.
+        - Entries without a download attempt ("Already in download folder") are not used.
+    """
+    history = log_df
+    if not history.empty:
+        history = history[history['video_id'].notna() & (history['server_reply'] != 'Already in download folder')]
+        if artifact_type is not None:
+            history = history[log_artifact_types(history) == artifact_type]
+    if history.empty:
+        print("No earlier downloads in the logs, so sizes and times can not be forecast.")
+        history = pd.DataFrame(columns=['status', 'size_MB', 'download_time_minutes', 'download_speed_KBs', 'format'])
+
+    successful = history[history['status'] == 'successful'].copy()
+    success_rate = len(successful) / len(history) if len(history) else 1.0
+    failed_minutes = history.loc[history['status'] != 'successful', 'download_time_minutes'].astype(float).mean()
+    if np.isnan(failed_minutes):
+        failed_minutes = 0.0
+    wait_minutes = np.mean(wait_time_range) / 60
+
+    # Minutes per download, from the speed where the time is missing
+    size_MB = successful['size_MB'].astype(float)
+    minutes = successful['download_time_minutes'].astype(float)
+    successful['minutes'] = minutes.fillna(size_MB * 1024 / successful['download_speed_KBs'].astype(float) / 60)
+    successful['resolution'] = successful['format'].astype(str).str.extract(r'\((\d+p)\)', expand=False).fillna('unknown')
+
+    # Per participant
+    forecast = participants.copy()
+    n_candidates = candidates.groupby('Participant ID').size()
+    forecast['candidates'] = forecast['Participant ID'].map(n_candidates).fillna(0).astype(int)
+    downloading = forecast['status'] == 'download'
+    forecast['expected_videos'] = np.where(downloading, np.minimum(forecast['needed'], forecast['candidates']), 0)
+    forecast['expected_attempts'] = np.minimum(np.ceil(forecast['expected_videos'] / max(success_rate, 1e-9)), forecast['candidates']).astype(int)
+    forecast['expected_MB'] = forecast['expected_videos'] * size_MB.mean()
+    forecast['expected_hours'] = (forecast['expected_videos'] * successful['minutes'].mean()
+                                  + (forecast['expected_attempts'] - forecast['expected_videos']) * failed_minutes
+                                  + forecast['expected_attempts'] * wait_minutes) / 60
+
+    # Per resolution/format
+    total_videos = forecast['expected_videos'].sum()
+    resolutions = successful.groupby('resolution').agg(
+        historical_videos=('minutes', 'size'), mean_size_MB=('size_MB', 'mean'), mean_minutes=('minutes', 'mean'))
+    resolutions['share'] = resolutions['historical_videos'] / resolutions['historical_videos'].sum()
+    resolutions['expected_videos'] = resolutions['share'] * total_videos
+    resolutions['expected_GB'] = resolutions['expected_videos'] * resolutions['mean_size_MB'] / 1024
+    resolutions['expected_download_hours'] = resolutions['expected_videos'] * resolutions['mean_minutes'] / 60
+    resolutions = resolutions.reset_index()
+
+    totals = {
+        'participants_to_download': int(downloading.sum()),
+        'expected_videos': int(total_videos),
+        'expected_attempts': int(forecast['expected_attempts'].sum()),
+        'historical_success_rate': round(success_rate, 3),
+        'expected_GB': round(float(forecast['expected_MB'].sum(min_count=1)) / 1024, 2),  # NaN without history
+        'expected_hours': round(float(forecast['expected_hours'].sum(min_count=1)), 1),
+    }
+    return {'participants': forecast, 'resolutions': resolutions, 'totals': totals}
+###############################################################################################################
+
+# New main function sample and download
+@profiled
+def download_unique_videos(df, download_dir, log_path, speed_limit, log_df, wait_time_range=(5, 10), sample_size=20, seed=42, auth_dir="Authentication", on_downloaded=None,
+                           transcode_profile=None, transcode_workers=2, min_free_GB=None, resume_free_GB=None,
+                           dedup_index_path=None, dry_run=False, plan=None, plan_path="download_plan.csv", artifact_type='video', audio_cache=None,
+                           clip=None, inline_analysis=False, save_dataframe=False, evict=None):
+    """
+    Downloads a specified number of unique videos for each participant from a watch history DataFrame, 
+    logs the download attempts, and handles various download scenarios such as checking existing downloads 
+    and logging entries. The function shuffles the unique videos for each participant before filtering out 
+    any videos that have already been downloaded or attempted to insure reproducibility.
+
+    Parameters:
+        df (pd.DataFrame): Watch history DataFrame containing video data with columns for 'Participant ID' and 'video_id'.
+        download_dir (str): Path to the directory where downloaded videos will be saved.
+        log_path (str): Path to the directory where log files are stored and new entries will be created.
+        speed_limit (int): Download rate limit in bytes per second to avoid overwhelming the server.
+        wait_time_range (tuple): Range of wait time (in seconds) to pause between downloads to avoid 
+                                 triggering rate limits (default is (5, 35)).
+        sample_size (int): Target number of unique videos to download for each participant (default is 20).
+        seed (int): Random seed for reproducibility in shuffling video lists (default is 42).
+        on_downloaded (callable): Optional function called with (participant, video_id) after each successful 
+                                  download, so later stages can start on the video while downloading continues. 
+                                  Also called for videos found in the download folder (logged "Already in download folder").
+                                  With a transcode_profile it is called once the video has been processed.
+        transcode_profile (str): Optional name of a profile in TRANSCODE_PROFILES. Downloaded videos are then remuxed or 
+                                 transcoded in the background, and the bytes saved are logged to log_path/transcode.
+        transcode_workers (int): Number of videos transcoded at the same time (default is 2).
+        min_free_GB (float): Optional free disk space (in the download directory) below which downloading pauses 
+                             until resume_free_GB is free again (default resume is min_free_GB + 5).
+        evict (callable): Optional function called with the number of bytes to free while downloading is paused for 
+                          disk space, returning the bytes it freed, e.g. AudioCache.freeBytes (see StorageMonitor).
+        dedup_index_path (str): Optional .json file of a DedupIndex (ytutils.Dedup). Each download is fingerprinted and 
+                                the id of the first downloaded copy of the same clip is logged as 'canonical_id'.
+        dry_run (bool): If True, nothing is downloaded or logged. The plan is compiled, saved to plan_path and 
+                        forecast from the earlier downloads in the logs (see forecast_downloads).
+        plan (str): Optional path of a plan saved by a dry run. It is used (brought up to date with the logs) instead 
+                    of planning again, so the run downloads exactly the forecast queue.
+        plan_path (str): Where a dry run saves the plan (default is "download_plan.csv").
+        artifact_type (str): 'video' (default), 'audio' (only the audio stream, saved as .m4a) or 'audio_stream' (the 
+                             audio is decoded into audio_cache while it downloads and no media file is saved). The type 
+                             is logged with every entry, and audio runs count downloaded videos toward the quota.
+        audio_cache (AudioCache): Cache for artifact_type='audio_stream' (ytutils.AudioCache), also filled by 
+                                  inline_analysis. Use on_downloaded to start transcribing each video from the cache 
+                                  as soon as it has been streamed.
+        clip (tuple): Optional (n_segments, segment_seconds): only download these time windows of each video (see 
+                      download_video). The windows are logged as 'clip_segments' and 'clip_duration_seconds'.
+        inline_analysis (bool): Probe and analyze each file right after it is downloaded, in one read while it is still 
+                                in the page cache (ytutils.InlineAnalysis): <video_id>.probe.json, approximate scenes in 
+                                <video_id>.scenes.csv (used by mp4ToScenes(method="fast", inline_scenes=True)) and, with 
+                                audio_cache, the decoded audio (used by Whisper), so later stages do not read the file 
+                                again. Default is False.
+        save_dataframe (bool or str): Also save the combined log as Downloads_log in the ytutils output folder: True 
+                                      (the configured format), "csv", "parquet" or "arrow" (see ytutils.Output). 
+                                      Default is False.
+
+    Returns:
+        pd.DataFrame: A concatenated DataFrame of log entries for all download attempts, capturing successes, 
+                      failures, and insufficient video cases.
+        dict: With dry_run=True, the forecast (see forecast_downloads) instead.
+
+    Process Overview:
+    - The function begins by planning the downloads for all participants at once (see plan_downloads), using the 
+      existing log entries to track previous downloads.
+    - It iterates through each unique participant, skipping those with prior download attempts or without 
+      sufficient videos remaining for downloading.
+    - The unique videos of each participant are tried in a random order derived from the seed and the participant 
+      ID, leaving out videos that have been previously attempted or successfully downloaded.
+    - The function downloads videos until the specified sample size is achieved (or no more videos are available), 
+      logging each attempt's success or failure along with relevant timing information.
+    - Random wait times are introduced between downloads to mitigate potential rate-limiting issues from the 
+      video source.
+
+    Notes:
+        - The function creates log entries for each video download attempt, noting successes, failures, and 
+          cases where participants do not have enough unique videos available.
+        - If a participant has already met the sample size requirement, they are skipped in subsequent runs.
+        - Ensures that each download is unique and that previously downloaded videos are not re-attempted.
+        - Note that sometimes downloads is slowed to a halt regardles of video size (maybe something done on youtube's end)
+    """
+    random.seed(seed)  # Set the seed for reproducibility (of the wait times)
+
+    if artifact_type not in ARTIFACT_TYPES:
+        raise ValueError(f"artifact_type must be one of {list(ARTIFACT_TYPES)}, got {artifact_type!r}")
+    if artifact_type == 'audio_stream' and audio_cache is None:
+        raise ValueError("artifact_type='audio_stream' needs an audio_cache to stream into")
+    if artifact_type != 'video' and (transcode_profile or dedup_index_path):
+        raise ValueError("Transcoding and deduplication work on video files, so they need artifact_type='video'")
+    if artifact_type == 'audio_stream' and clip is not None:
+        raise ValueError("Time windows (clip) can not be streamed; use artifact_type='audio' to download audio windows")
+    if artifact_type == 'audio_stream' and inline_analysis:
+        raise ValueError("Streamed audio is already decoded into the audio cache while it downloads; inline_analysis needs a downloaded file")
+
+    if plan is not None:
+        participants, candidates = load_download_plan(plan, log_df, log_path, sample_size, artifact_type)
+    else:
+        participants, candidates = plan_downloads(df, log_df, log_path, sample_size, seed, artifact_type)
+
+    if dry_run:
+        save_download_plan(participants, candidates, plan_path)
+        forecast = forecast_downloads(participants, candidates, log_df, wait_time_range, artifact_type)
+        print(f"Saved the download plan to {plan_path}")
+        print(forecast['participants']['status'].value_counts().to_string())
+        print(forecast['resolutions'].round(2).to_string(index=False))
+        for name, value in forecast['totals'].items():
+            print(f"{name}: {value}")
+        return forecast
+
+    # The candidates are sorted by participant, so each participant's videos are one slice
+    starts = np.flatnonzero(candidates['rank'].to_numpy() == 0)
+    videos_per_participant = dict(zip(candidates['Participant ID'].to_numpy()[starts], np.split(candidates['video_id'].to_numpy(), starts[1:])))
+    # One listing instead of a check per video: video id -> artifact type on disk. Videos also count for audio runs
+    extension = ARTIFACT_TYPES[artifact_type]
+    usable = ['video'] if artifact_type == 'video' else ['video', 'audio']
+    downloaded = {}
+    if artifact_type == 'audio_stream':
+        downloaded.update(dict.fromkeys(audio_cache.index, 'audio_stream'))
+    usable_extensions = {ARTIFACT_TYPES[usable_type]: usable_type for usable_type in usable}
+    for file in os.listdir(download_dir):
+        # Only finished files (<id>.mp4 / <id>.m4a), not unmerged streams (<id>.f134.mp4) or unjoined windows (<id>.section0.mp4)
+        stem, _, file_extension = file.rpartition('.')
+        if file_extension in usable_extensions and stem and '.' not in stem:
+            downloaded[stem] = usable_extensions[file_extension]
+    attempted = set()  # Videos attempted in this run (the plan only knows about earlier runs)
+    
+    n_participants = len(participants)
+    counter = 0
+
+    pool = PostDownloadPool(download_dir, log_path, transcode_profile, transcode_workers, on_downloaded) if transcode_profile else None
+    monitor = StorageMonitor(download_dir, min_free_GB, resume_free_GB, evict) if min_free_GB is not None else None
+    if dedup_index_path:
+        from ytutils.Dedup import DedupIndex
+        dedup_index = DedupIndex(dedup_index_path)
+    else:
+        dedup_index = None
+
+    for participant, downloaded_count, needed_vids, status in participants[['Participant ID', 'downloaded_count', 'needed', 'status']].itertuples(index=False):
+        counter += 1
+
+        if status == 'insufficient_logged':
+            print(f"Skipping Participant {participant}: Not enough videos. See log entry {log_path}/insufficiant_vids_{participant}.log.csv")
+            continue      
+        
+        if status == 'complete':
+            print(f"Download already complete for participant {participant}.")
+            continue
+
+        if status != 'download':
+            if status == 'insufficient_unique':
+                m = f"Skipping Participant {participant}: Less than {needed_vids} unique video(s) left."
+            else:
+                m = f"Skipping Participant {participant}: Fewer than {needed_vids} new videos to download."
+            print(m)
+            make_log_entry(participant, None, False, m, now(), now(), log_path, exept=True)
+            continue
+
+        # Videos shared with a participant earlier in this run are attempted already (the plan only knows about earlier runs)
+        video_list = [video_id for video_id in videos_per_participant.get(participant, []) if video_id not in attempted]
+        if len(video_list) < needed_vids:
+            m = f"Skipping Participant {participant}: Fewer than {needed_vids} new videos to download."
+            print(m)
+            make_log_entry(participant, None, False, m, now(), now(), log_path, exept=True)
+            continue
+
+        print(f"Downloading videos for Participant {participant}...")
+
+        for video_id in video_list:
+            if downloaded_count >= sample_size:
+                break
+            attempted.add(video_id)
+
+            # we have videos that are downloaded but not logged
+            if video_id in downloaded:
+                print(f"Video {video_id} already in download folder. Going to next video", flush=True)
+                make_log_entry(participant, video_id, True, "Already in download folder", now(), now(), log_path, artifact_type=downloaded[video_id])
+                downloaded_count += 1
+                if on_downloaded:
+                    on_downloaded(participant, video_id)  # Newly logged, so later stages have not seen it either
+                continue
+
+            if monitor:
+                monitor.wait_for_space(pool)
+
+            print(f"Attempting download for video {video_id}", flush=True) 
+            po_token, cookie_file = refresh_auth(auth_dir)
+            
+            my_logger = MyLogger() # Instantiate the logger
+            start_time = now() # start timer
+            if artifact_type == 'audio_stream':
+                success, server_reply, log, size = stream_audio(video_id, download_dir, audio_cache, my_logger, po_token, cookie_file)
+            else:
+                success, server_reply, log = download_video(video_id, download_dir, speed_limit, my_logger, po_token, cookie_file, artifact_type, clip)
+            end_time = now() # end timer
+            
+            time_min = (end_time - start_time).total_seconds()/60
+            print(f"video: {video_id}, result: {success}, time: {time_min:.2f} min, message: {server_reply}", flush=True)
+
+            if extension:
+                try:
+                    size = os.path.getsize(download_dir + f"/{video_id}.{extension}")  # Get file size in bytes
+                except FileNotFoundError:
+                    size = None
+
+            info = get_video_info(video_id, download_dir)
+            clipped = readClip(download_dir, video_id) if clip is not None else None
+            if clipped:
+                info.update(clipSummary({video_id: clipped}).iloc[0].drop('video_id').to_dict())
+
+            # Probe, scenes and audio from one read of the fresh file (a failed analysis leaves them to the later stages)
+            if inline_analysis and success and size:
+                from ytutils.InlineAnalysis import analyzeMedia
+                try:
+                    info['n_scenes'] = analyzeMedia(download_dir + f"/{video_id}.{extension}", video_id, download_dir, audio_cache=audio_cache)['n_scenes']
+                except Exception as e:
+                    print(f"Inline analysis of {video_id} failed: {e}", flush=True)
+
+            # Fingerprint before transcoding, so every copy of a clip is compared as downloaded
+            if dedup_index and success and size:
+                info['canonical_id'] = dedup_index.add(video_id, download_dir + f"/{video_id}.mp4")
+                dedup_index.save()
+                if info['canonical_id'] != video_id:
+                    print(f"Video {video_id} is a re-upload of {info['canonical_id']}", flush=True)
+            
+            make_log_entry(participant, video_id, success, server_reply, start_time, end_time, log_path, log=log, size=size, info=info, artifact_type=artifact_type)
+            
+            if success:
+                downloaded_count += 1
+                downloaded[video_id] = artifact_type
+                # Exactly one of the two calls on_downloaded: the pool once the file has been processed, or this loop
+                if pool and size:
+                    pool.submit(participant, video_id)
+                elif on_downloaded:
+                    on_downloaded(participant, video_id)  # Also with a pool, when there is no file to process
+
+            # Random wait between downloads (to avoid rate-limiting) 
+            wait_time = random.uniform(*wait_time_range)
+            print(f"Waiting for {wait_time:.2f} seconds...")
+            time.sleep(wait_time)
+
+        if downloaded_count < sample_size:  # Too many of the candidates failed
+            m = f"Skipping Participant {participant}: ran out of videos ({sample_size - downloaded_count} missing)."
+            print(m)
+            make_log_entry(participant, None, False, m, now(), now(), log_path, exept=True)
+
+        print(f"Done with participant number {counter} of {n_participants} ({round(counter/n_participants * 100, 2)}% completed)")
+        print('─' * 20) 
+
+    if pool:
+        pool.shutdown()  # Wait for the last videos to be processed
+
+    print("Download process completed.")
+    logs = concatenate_logs(log_path)
+    saveDataFrame(logs, "Downloads_log", save_dataframe)
+    return logs
+###############################################################################################################
+
+# YouTube video ids: 11 characters of [A-Za-z0-9_-]
+VIDEO_ID_PATTERN = r'[A-Za-z0-9_-]{11}'
+
+# Partial downloads: yt-dlp fragments, unmerged format streams (<id>.f137.mp4), interrupted transcodes and
+# time windows (<id>.section<start>.mp4) that were not joined
+FRAGMENT_PATTERN = r'(?:^|\.)(?:part|ytdl|temp|transcode\.tmp)$|\.part-Frag\d+$|^f\d+\.[^.]+$|^section'
+
+@profiled
+def scan_download_dir(download_dir, workers=8):
+    """
+    Lists the files of the download directory with their sizes and modification times. The directory is read
+    once with os.scandir and the entries are stat'ed in parallel threads.
+
+    Returns:
+        pd.DataFrame: 'file', 'video_id', 'suffix' (everything after the first '.'), 'size_bytes' and 'mtime' per file.
+    """
+    with os.scandir(download_dir) as entries:
+        files = [entry for entry in entries if entry.is_file()]
+
+    def stat_chunk(chunk):
+        rows = []
+        for entry in chunk:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # Removed since it was listed (e.g. a finished download)
+                continue
+            rows.append((entry.name, stat.st_size, stat.st_mtime))
+        return rows
+
+    chunks = [files[i:i + 1000] for i in range(0, len(files), 1000)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rows = [row for chunk_rows in executor.map(stat_chunk, chunks) for row in chunk_rows]
+
+    scan = pd.DataFrame(rows, columns=['file', 'size_bytes', 'mtime'])
+    parts = scan['file'].str.split('.', n=1)
+    scan['video_id'] = parts.str[0]
+    scan['suffix'] = parts.str[1].fillna('')
+    return scan[['file', 'video_id', 'suffix', 'size_bytes', 'mtime']]
+###############################################################################################################
+
+@profiled
+def reconcile_downloads(download_dir, log_path, log_df=None, apply=False, stale_minutes=60, min_size_ratio=0.9,
+                        batch_size=500, workers=8, report_path="reconcile_report.csv", audio_cache=None):
+    """
+    Compares the download directory with the download logs and fixes the differences. Generalizes deleting the
+    files that are not logged.
+
+    Parameters:
+        download_dir (str): Directory where downloaded videos are stored.
+        log_path (str): Directory where log files are stored.
+        log_df (pd.DataFrame): Concatenated log entries (default is concatenate_logs(log_path)).
+        apply (bool): If False (default), only the report is made. If True, the fixes are applied.
+        stale_minutes (float): Fragments younger than this are left alone, as they may belong to a running download
+                               (default is 60).
+        min_size_ratio (float): A logged video whose mp4 is smaller than this share of the logged size (or of the
+                                size after transcoding) is truncated (default is 0.9).
+        batch_size (int): Number of fixes applied and recorded at a time (default is 500).
+        workers (int): Threads used to scan the directory (default is 8).
+        report_path (str): Where the report is saved (default is "reconcile_report.csv").
+        audio_cache (AudioCache): The cache streamed audio (artifact_type='audio_stream') was decoded into. Its only copy 
+                                  of the audio can be evicted, so with a cache, streamed videos it no longer holds are 
+                                  missing too (default is None: streamed videos are only checked for their info file).
+
+    Returns:
+        pd.DataFrame: The report, with a row per problem: 'video_id', 'file', 'issue', 'action', 'size_bytes'.
+
+    Notes:
+        Issues and their fixes:
+        - unlogged:  stale files of a video that has no log entry                      -> delete (files younger than 
+                     stale_minutes may belong to a running download, which is logged when it finishes)
+        - unknown:   files whose name does not start with a YouTube video id           -> keep (e.g. subtitles_index.csv; 
+                     reported, never deleted)
+        - orphan:    files (thumbnails, subtitles, info files, ...) of a failed video  -> delete
+        - fragment:  stale .part/.ytdl files and unmerged format streams               -> delete
+        - missing:   a video logged as successful without its media file or info.json  -> requeue (its log entry and
+                     remaining files are deleted, so the next download run tries it again). Also streamed audio 
+                     evicted from audio_cache.
+        - truncated: a video logged as successful whose media file is too small        -> mark_corrupt (the file is
+                     moved to download_dir/corrupt and the log entry gets status 'corrupt', so it is not retried)
+        Applied fixes are appended to log_path/reconcile/applied.csv, a batch at a time.
+    """
+    if log_df is None:
+        log_df = concatenate_logs(log_path)
+    scan = scan_download_dir(download_dir, workers)
+
+    logs = log_df[log_df['video_id'].notna()] if not log_df.empty else pd.DataFrame(columns=['video_id', 'status', 'size_MB'])
+    logs = logs.drop_duplicates(subset=['video_id'], keep='last').set_index('video_id')
+    successful = logs.index[logs['status'] == 'successful']
+
+    # Expected size: the logged size, or the size after transcoding when the video was transcoded
+    expected_MB = logs['size_MB'].astype(float)
+    transcode_dir = os.path.join(log_path, 'transcode')
+    if os.path.exists(transcode_dir):
+        transcodes = [pd.read_csv(os.path.join(transcode_dir, file), dtype={'video_id': str}) for file in os.listdir(transcode_dir) if file.endswith('.csv')]
+        if transcodes:
+            transcoded = pd.concat(transcodes).drop_duplicates(subset=['video_id'], keep='last').set_index('video_id')['size_after_MB']
+            expected_MB = transcoded.combine_first(expected_MB)
+
+    report = []
+    is_fragment = scan['suffix'].str.contains(FRAGMENT_PATTERN, regex=True)
+    is_stale = scan['mtime'] < time.time() - stale_minutes * 60
+    is_logged = scan['video_id'].isin(logs.index)
+    is_video = scan['video_id'].str.fullmatch(VIDEO_ID_PATTERN)  # Other files (indexes, sidecars, ...) are not the downloader's
+    is_successful = scan['video_id'].isin(successful)
+
+    for issue, action, mask in [
+        ('unknown', 'keep', ~is_video),
+        ('unlogged', 'delete', is_video & ~is_logged & is_stale),
+        ('orphan', 'delete', is_logged & ~is_successful & (~is_fragment | is_stale)),
+        ('fragment', 'delete', is_successful & is_fragment & is_stale),
+    ]:
+        rows = scan.loc[mask, ['video_id', 'file', 'size_bytes']]
+        report.append(rows.assign(issue=issue, action=action))
+
+    # Logged successes: missing artifacts and truncated media files. The media file depends on the logged artifact 
+    # type (.mp4 for videos, .m4a for audio); streamed audio only leaves the info file
+    media_suffix = log_artifact_types(logs).map(ARTIFACT_TYPES)
+    present = scan.groupby('video_id')['suffix'].agg(set)
+    missing = [video_id for video_id in successful
+               if not {'info.json', *([media_suffix[video_id]] if pd.notna(media_suffix[video_id]) else [])} <= present.get(video_id, set())]
+    if audio_cache is not None:
+        streamed = successful[(log_artifact_types(logs).reindex(successful) == 'audio_stream').to_numpy()]
+        missing += [video_id for video_id in streamed.difference(missing) if video_id not in audio_cache]
+    report.append(pd.DataFrame({'video_id': missing, 'file': None, 'size_bytes': 0, 'issue': 'missing', 'action': 'requeue'}))
+
+    media = scan[scan['suffix'] == scan['video_id'].map(media_suffix)].set_index('video_id')
+    has_media = successful[successful.isin(media.index)]
+    minimum_bytes = expected_MB.reindex(has_media) * 1024**2 * min_size_ratio
+    truncated = has_media[(media['size_bytes'].reindex(has_media) < minimum_bytes).to_numpy()]
+    report.append(pd.DataFrame({'video_id': truncated, 'file': media['file'].reindex(truncated).to_numpy(),
+                                'size_bytes': media['size_bytes'].reindex(truncated).to_numpy(), 'issue': 'truncated', 'action': 'mark_corrupt'}))
+
+    report = pd.concat(report, ignore_index=True)[['video_id', 'file', 'issue', 'action', 'size_bytes']]
+    report.to_csv(report_path, index=False)
+    print(report.groupby(['issue', 'action']).agg(files=('file', 'count'), videos=('video_id', 'nunique'), MB=('size_bytes', lambda b: round(b.sum() / 1024**2, 1))).to_string()
+          if len(report) else "The download directory and the logs agree.")
+
+    if not apply:
+        print(f"Dry run: nothing changed. Report saved to {report_path}")
+        return report
+
+    applied_dir = os.path.join(log_path, 'reconcile')
+    os.makedirs(applied_dir, exist_ok=True)
+    files_by_video = scan.groupby('video_id')['file'].agg(list)
+    fixes = report[report['action'] != 'keep']
+    for start in range(0, len(fixes), batch_size):
+        batch = fixes.iloc[start:start + batch_size]
+        results = []
+        for video_id, file, issue, action, _ in batch.itertuples(index=False):
+            try:
+                if action == 'delete':
+                    os.remove(os.path.join(download_dir, file))
+                elif action == 'requeue':
+                    for leftover in files_by_video.get(video_id, []):
+                        if os.path.exists(os.path.join(download_dir, leftover)):
+                            os.remove(os.path.join(download_dir, leftover))
+                    os.remove(os.path.join(log_path, f"{video_id}.log.csv"))
+                elif action == 'mark_corrupt':
+                    os.makedirs(os.path.join(download_dir, 'corrupt'), exist_ok=True)
+                    os.replace(os.path.join(download_dir, file), os.path.join(download_dir, 'corrupt', file))
+                    entry_path = os.path.join(log_path, f"{video_id}.log.csv")
+                    entry = pd.read_csv(entry_path, dtype={'Participant ID': str, 'video_id': str})
+                    entry['status'] = 'corrupt'
+                    entry['server_reply'] = f"Marked corrupt by reconcile_downloads ({issue})"
+                    entry.to_csv(entry_path, index=False)
+                results.append('done')
+            except FileNotFoundError:
+                results.append('already gone')
+        batch = batch.assign(result=results, time=now())
+        applied_path = os.path.join(applied_dir, 'applied.csv')
+        batch.to_csv(applied_path, mode='a', header=not os.path.exists(applied_path), index=False)
+        print(f"Applied {min(start + batch_size, len(fixes))}/{len(fixes)} fixes", flush=True)
+
+    return report
+###############################################################################################################
@@ -0,0 +1,193 @@
+"""
+Headless, incremental runner for the whole pipeline.
+
+Runs the same steps as Pre_Download.ipynb and Video_Download_Pipeline.ipynb, followed by
+metadata, scene detection, transcription and concatenation, as one stage graph
+(see ytutils.Pipeline). Every stage is tracked per video by content hash and parameters,
+so a rerun only recomputes the videos whose upstream artifacts changed, and scene
+detection and transcription start on new downloads while downloading continues.
+
+Usage:
+    python run_pipeline.py --history-folder ../Survey_Data/Watch_Data [--work-dir Pipeline] [--no-transcribe]
+
+Outputs (in --work-dir):
+    clean_watch_history.csv, metadata/<id>.csv, scenes/<id>.csv, transcripts/<id>.vtt,
+    transcriptions/<id>.csv, full_data.csv and the pipeline state (state/)
+"""
+import os
+import sys
+import glob
+import argparse
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from ytutils import loadEpinionData, concatenateFullData
+from ytutils.History import clean_dataframe
+from ytutils.Metadata import readInfoFile, mergeWatchHistoryWithMetadata, METADATA_COLUMNS
+from ytutils.PySceneDetect import detectVideoScenes
+from ytutils.Transcription import extractProvidedSubs, createDataFrame
+from ytutils.Pipeline import PipelineRunner, Stage, Source
+from download_utils import download_unique_videos, concatenate_logs, is_video_downloaded, TRANSCODE_PROFILES
+
+
+def clean_watch_history(inputs, params):
+    # Same steps as Pre_Download.ipynb: load, drop missing ids, keep the date range, drop ads and YouTube Music
+    watch_history = loadEpinionData(params["history_folder"])
+    watch_history = watch_history[watch_history["video_id"].notna() & (watch_history["video_id"].str.strip() != "")]
+    watch_history["Participant ID"] = watch_history["Participant ID"].astype(str)
+    watch_history = watch_history[(watch_history["time"] >= params["start_date"]) & (watch_history["time"] <= params["end_date"])]
+    watch_history = clean_dataframe(watch_history)
+
+    path = os.path.join(params["work_dir"], "clean_watch_history.csv")
+    watch_history.to_csv(path, index=False)
+    return {"watch_history": path}
+
+
+def download_artifacts(video_id, download_dir):
+    return {
+        "mp4": os.path.join(download_dir, f"{video_id}.mp4"),
+        "info": os.path.join(download_dir, f"{video_id}.info.json"),
+    }
+
+
+def download(emit, inputs, params):
+    download_dir, log_path = params["download_dir"], params["log_path"]
+    os.makedirs(download_dir, exist_ok=True)
+    os.makedirs(log_path, exist_ok=True)
+
+    # Videos downloaded in earlier runs go straight into the rest of the pipeline
+    log_df = concatenate_logs(log_path)
+    if not log_df.empty:
+        for video_id in log_df.loc[log_df["status"] == "successful", "video_id"].dropna().unique():
+            artifacts = download_artifacts(video_id, download_dir)
+            if is_video_downloaded(video_id, download_dir) and os.path.exists(artifacts["info"]):
+                emit(video_id, artifacts)
+
+    def on_downloaded(participant, video_id):
+        artifacts = download_artifacts(video_id, download_dir)
+        if os.path.exists(artifacts["mp4"]) and os.path.exists(artifacts["info"]):
+            emit(video_id, artifacts)
+
+    watch_history = pd.read_csv(inputs["clean_watch_history"]["watch_history"], dtype={"Participant ID": str})
+    download_unique_videos(watch_history, download_dir, log_path, params["speed_limit"], log_df,
+                           wait_time_range=tuple(params["wait_time_range"]), sample_size=params["sample_size"],
+                           seed=params["seed"], auth_dir=params["auth_dir"], on_downloaded=on_downloaded,
+                           transcode_profile=params["transcode_profile"], min_free_GB=params["min_free_GB"])
+
+
+def metadata(video_id, inputs, params):
+    path = os.path.join(params["work_dir"], "metadata", f"{video_id}.csv")
+    pd.DataFrame([readInfoFile(inputs["download"]["info"])], columns=METADATA_COLUMNS).to_csv(path, index=False)
+    return {"metadata": path}
+
+
+def scenes(video_id, inputs, params):
+    info = pd.read_csv(inputs["metadata"]["metadata"])
+    folder_path = os.path.dirname(inputs["download"]["mp4"]) + os.sep
+    task = (video_id, info["duration_seconds"][0], info["fps"][0], folder_path, params["method"], params["detector_params"])
+    path = os.path.join(params["work_dir"], "scenes", f"{video_id}.csv")
+    detectVideoScenes(task).to_csv(path, index=False)
+    return {"scenes": path}
+
+
+WHISPER_MODELS = {}
+
+
+def transcribe(video_id, inputs, params):
+    import whisper
+    if params["model_size"] not in WHISPER_MODELS:
+        WHISPER_MODELS[params["model_size"]] = whisper.load_model(params["model_size"])
+    result = WHISPER_MODELS[params["model_size"]].transcribe(inputs["download"]["mp4"])
+
+    folder_path = os.path.join(params["work_dir"], "transcripts")
+    whisper.utils.get_writer("vtt", folder_path)(result, video_id + ".vtt")
+    return {"vtt": os.path.join(folder_path, video_id + ".vtt")}
+
+
+def transcriptions(video_id, inputs, params):
+    folder_path = os.path.dirname(inputs["transcribe"]["vtt"]) + os.sep
+    path = os.path.join(params["work_dir"], "transcriptions", f"{video_id}.csv")
+    createDataFrame([extractProvidedSubs(video_id, folder_path)]).to_csv(path, index=False)
+    return {"transcriptions": path}
+
+
+def read_all(artifacts, name, dtype=None):
+    # Concatenate the per-video csv files of one stage
+    frames = [pd.read_csv(outputs[name], dtype=dtype) for outputs in artifacts.values()]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def full_data(inputs, params):
+    watch_history = pd.read_csv(inputs["clean_watch_history"]["watch_history"], dtype={"Participant ID": str})
+    data = read_all(inputs["metadata"], "metadata", dtype={"video_id": str})
+    if data.empty:
+        data = pd.DataFrame(columns=METADATA_COLUMNS)
+    downloaded = mergeWatchHistoryWithMetadata(watch_history[watch_history["video_id"].isin(data["video_id"])], data)
+
+    scene_df = read_all(inputs["scenes"], "scenes", dtype={"id": str})
+    transcription_df = read_all(inputs.get("transcriptions", {}), "transcriptions", dtype={"id": str})
+    if transcription_df.empty:
+        transcription_df = pd.DataFrame(columns=["id", "start_time", "end_time", "text", "whisper_generated"])
+    transcription_df["text"] = transcription_df["text"].fillna("").astype(str)
+
+    path = os.path.join(params["work_dir"], "full_data.csv")
+    concatenateFullData(downloaded, scene_df, transcription_df).to_csv(path, index=False)
+    return {"full_data": path}
+
+
+def build_stages(args):
+    work_dir = args.work_dir
+    for folder in ["metadata", "scenes", "transcripts", "transcriptions"]:
+        os.makedirs(os.path.join(work_dir, folder), exist_ok=True)
+
+    history_files = sorted(glob.glob(os.path.join(args.history_folder, "*.json")))
+    stages = [
+        Stage("clean_watch_history", clean_watch_history, per_video=False, files=history_files,
+              params={"history_folder": args.history_folder, "work_dir": work_dir, "start_date": args.start_date, "end_date": args.end_date}),
+        Source("download", download, inputs=["clean_watch_history"],
+               params={"download_dir": args.download_dir, "log_path": args.log_path, "auth_dir": args.auth_dir,
+                       "speed_limit": int(args.speed_limit_KB * 1024), "wait_time_range": args.wait_time_range,
+                       "sample_size": args.sample_size, "seed": args.seed,
+                       "transcode_profile": args.transcode_profile, "min_free_GB": args.min_free_GB}),
+        Stage("metadata", metadata, inputs=["download"], params={"work_dir": work_dir}, workers=4),
+        Stage("scenes", scenes, inputs=["download", "metadata"], workers=args.processes, processes=True,
+              params={"work_dir": work_dir, "method": args.scene_method,
+                      "detector_params": {"threshold": 27.0} if args.scene_method == "content" else {"threshold": 20.0}}),
+    ]
+    full_data_inputs = ["clean_watch_history", "metadata", "scenes"]
+    if args.transcribe:
+        stages += [
+            Stage("transcribe", transcribe, inputs=["download"], params={"work_dir": work_dir, "model_size": args.whisper_model}),
+            Stage("transcriptions", transcriptions, inputs=["transcribe"], params={"work_dir": work_dir}),
+        ]
+        full_data_inputs.append("transcriptions")
+    stages.append(Stage("full_data", full_data, inputs=full_data_inputs, per_video=False, params={"work_dir": work_dir}))
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history-folder", required=True, help="folder with the participants' watch history .json files")
+    parser.add_argument("--work-dir", default="Pipeline")
+    parser.add_argument("--download-dir", default="Downloads")
+    parser.add_argument("--log-path", default="Log_Entries")
+    parser.add_argument("--auth-dir", default="Authentication")
+    parser.add_argument("--start-date", default="2019-07-01")
+    parser.add_argument("--end-date", default="2024-06-30")
+    parser.add_argument("--speed-limit-KB", type=float, default=800)
+    parser.add_argument("--wait-time-range", type=float, nargs=2, default=(2, 40))
+    parser.add_argument("--sample-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--transcode-profile", choices=list(TRANSCODE_PROFILES), default=None)
+    parser.add_argument("--min-free-GB", type=float, default=None, help="pause downloading below this much free disk space")
+    parser.add_argument("--scene-method", choices=["content", "fast"], default="content")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--no-transcribe", dest="transcribe", action="store_false")
+    args = parser.parse_args()
+
+    PipelineRunner(build_stages(args), os.path.join(args.work_dir, "state")).run()
+
+
+if __name__ == "__main__":
+    main()
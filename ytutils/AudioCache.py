@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import numpy as np
+from .Profiling import profiled
+
+PCM_FORMATS = {
+    "int16": "s16le",
+    "float32": "f32le",
+}
+
+
+def decodeAudio(video_path, output_path, sample_rate=16000, dtype="int16", input_options=None):
+    # Decode the audio track of the video to raw mono PCM with ffmpeg. video_path can also be a stream URL
+    # (input_options are passed to ffmpeg for it, e.g. {"headers": ...}), which is decoded as it downloads
+    import ffmpeg
+    pcm_format = PCM_FORMATS[dtype]
+    (
+        ffmpeg
+        .input(video_path, **(input_options or {}))
+        .output(output_path, format=pcm_format, acodec="pcm_" + pcm_format, ac=1, ar=sample_rate)
+        .overwrite_output()
+        .run(quiet=True)
+    )
+
+
+class AudioCache:
+    """
+    Size-bounded cache of decoded audio tracks, so each video is only decoded once.
+
+    Each video's audio is stored as one raw mono PCM file (<video_id>.pcm) next to a small
+    index.json with sample rate, dtype and number of samples. Reads return numpy memmap
+    views, so slicing by time range does not copy or decode anything.
+
+    --- args ---
+    cache_folder_path: string
+
+    --- kwargs ---
+    max_size_GB: float  |  default: 20       # least recently used files are evicted above this size
+    sample_rate: int    |  default: 16000    # Whisper expects 16 kHz mono
+    dtype: string       |  default: "int16"  # "int16" (compact) or "float32" (zero-copy into Whisper)
+    """
+
+    def __init__(self, cache_folder_path, max_size_GB=20, sample_rate=16000, dtype="int16"):
+        if dtype not in PCM_FORMATS:
+            raise ValueError(f"dtype must be one of {list(PCM_FORMATS)}, got {dtype}")
+        self.cache_folder_path = cache_folder_path
+        self.max_size_bytes = int(max_size_GB * 1024**3)
+        self.sample_rate = sample_rate
+        self.dtype = dtype
+        self.index_path = os.path.join(cache_folder_path, "index.json")
+        os.makedirs(cache_folder_path, exist_ok=True)
+        self.index = self._loadIndex()
+
+    def _loadIndex(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r") as file:
+            index = json.load(file)
+        # Drop entries whose pcm file has disappeared (e.g. deleted by hand)
+        return {video_id: entry for video_id, entry in index.items() if os.path.exists(self._pcmPath(video_id))}
+
+    def _saveIndex(self):
+        # Write to a temporary file first, so a crash never leaves a half written index
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(temp_path, self.index_path)
+
+    def _pcmPath(self, video_id):
+        return os.path.join(self.cache_folder_path, f"{video_id}.pcm")
+
+    def __contains__(self, video_id):
+        return video_id in self.index
+
+    def sizeBytes(self):
+        return sum(entry["bytes"] for entry in self.index.values())
+
+    def add(self, video_id, video_path, input_options=None):
+        """
+        Decode the audio of video_path into the cache (no-op if already cached) and return its index entry.
+        video_path can be an audio stream URL (see download_utils.stream_audio): then only the PCM is written to disk.
+        """
+        if video_id in self.index:
+            return self.index[video_id]
+
+        decodeAudio(video_path, self.partPath(video_id), sample_rate=self.sample_rate, dtype=self.dtype, input_options=input_options)
+        return self.insert(video_id)
+
+    def partPath(self, video_id):
+        # Where audio is decoded to before insert() moves it into the cache (ytutils.InlineAnalysis decodes there itself)
+        return self._pcmPath(video_id) + ".part"
+
+    def insert(self, video_id):
+        """Move audio decoded to partPath(video_id) (raw PCM in the cache's sample rate and dtype) into the cache and return its index entry."""
+        pcm_path = self._pcmPath(video_id)
+        os.replace(self.partPath(video_id), pcm_path)
+
+        size = os.path.getsize(pcm_path)
+        self.index[video_id] = {
+            "sample_rate": self.sample_rate,
+            "dtype": self.dtype,
+            "n_samples": size // np.dtype(self.dtype).itemsize,
+            "bytes": size,
+            "added": time.time(),
+        }
+        self.evict(keep=video_id)
+        self._saveIndex()
+        return self.index[video_id]
+
+    def read(self, video_id, start_seconds=0, end_seconds=None):
+        """
+        Return the samples between start_seconds and end_seconds as a read-only memmap view (zero-copy).
+        Raises KeyError if the video is not cached.
+        """
+        entry = self.index[video_id]
+        pcm_path = self._pcmPath(video_id)
+        os.utime(pcm_path)  # Mark as recently used, for the eviction order
+
+        samples = np.memmap(pcm_path, dtype=entry["dtype"], mode="r", shape=(entry["n_samples"],))
+        start = max(int(start_seconds * entry["sample_rate"]), 0)
+        end = entry["n_samples"] if end_seconds is None else min(int(end_seconds * entry["sample_rate"]), entry["n_samples"])
+        return samples[start:end]
+
+    def readFloat(self, video_id, start_seconds=0, end_seconds=None):
+        """Like read(), but returns float32 in [-1, 1] as expected by Whisper (copies only if the cache is int16)."""
+        samples = self.read(video_id, start_seconds, end_seconds)
+        if samples.dtype == np.float32:
+            return samples
+        return samples.astype(np.float32) / 32768.0
+
+    def _evictUntil(self, done, keep=None):
+        # Remove least recently used audio files (read() touches the modification time) until done(bytes_freed) is true
+        by_last_use = sorted(self.index, key=lambda video_id: os.path.getmtime(self._pcmPath(video_id)))
+        freed = 0
+        evicted = []
+        for video_id in by_last_use:
+            if done(freed):
+                break
+            if video_id == keep:
+                continue
+            freed += self.index[video_id]["bytes"]
+            os.remove(self._pcmPath(video_id))
+            del self.index[video_id]
+            evicted.append(video_id)
+
+        self._saveIndex()
+        return evicted, freed
+
+    def evict(self, keep=None):
+        """Remove least recently used audio files until the cache is below max_size_GB."""
+        total = self.sizeBytes()
+        if total <= self.max_size_bytes:
+            return []
+        evicted, _ = self._evictUntil(lambda freed: total - freed <= self.max_size_bytes, keep)
+        return evicted
+
+    def freeBytes(self, n_bytes):
+        """
+        Remove least recently used audio files until n_bytes are freed (or the cache is empty) and return the bytes freed.
+        Fits the evict hook of download_utils.StorageMonitor: StorageMonitor(..., evict=audio_cache.freeBytes).
+        """
+        _, freed = self._evictUntil(lambda freed: freed >= n_bytes)
+        return freed
+
+
+@profiled
+def cacheAudio(video_folder_path, cache_folder_path, max_size_GB=20, sample_rate=16000, dtype="int16"):
+    """
+    This function decodes the audio track of every video file into the shared audio cache.
+    --- args ---
+    video_folder_path: string  # folder where video files (.mp4) or audio-only downloads (.m4a) are located
+    cache_folder_path: string
+
+    --- kwargs ---
+    max_size_GB: float  |  default: 20
+    sample_rate: int    |  default: 16000
+    dtype: string       |  default: "int16"  # "int16" or "float32"
+
+    --- output ---
+    Outputs from function
+    cache: AudioCache
+
+    Outputs to "cache_folder_path" directory
+    audio: .pcm
+    index: index.json
+    """
+    cache = AudioCache(cache_folder_path, max_size_GB=max_size_GB, sample_rate=sample_rate, dtype=dtype)
+
+    media_files = {file[:11]: file for file in os.listdir(video_folder_path) if file.endswith((".mp4", ".m4a"))}
+    for id, file in media_files.items():
+        if id in cache:
+            continue
+        cache.add(id, os.path.join(video_folder_path, file))
+
+    return cache
@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import threading
+import pandas as pd
+
+
+def fileHash(path, chunk_size=1024**2):
+    # Content hash (sha256) of a file, read in chunks so large videos are never fully loaded into memory
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def paramsHash(params):
+    # Stable hash of a dictionary of parameters (order of the keys does not matter)
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class HashIndex:
+    """
+    Remembers file hashes together with the file size and modification time,
+    so unchanged files are not read again to be hashed on the next run.
+
+    --- args ---
+    index_path: string  # .json file the hashes are saved to
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        if os.path.exists(index_path):
+            with open(index_path, "r") as file:
+                self.hashes = json.load(file)
+        else:
+            self.hashes = {}
+
+    def hash(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        with self.lock:
+            remembered = self.hashes.get(path)
+        if remembered and remembered["size"] == stat.st_size and remembered["mtime_ns"] == stat.st_mtime_ns:
+            return remembered["hash"]
+        file_hash = fileHash(path)
+        with self.lock:
+            self.hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash}
+        return file_hash
+
+    def save(self):
+        with self.lock:
+            with open(self.index_path + ".tmp", "w") as file:
+                json.dump(self.hashes, file)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+
+class ResultCache:
+    """
+    Cache of per-video result dataframes, keyed by the content hash of the input file and the parameters used.
+
+    --- args ---
+    cache_folder_path: string
+    """
+
+    def __init__(self, cache_folder_path):
+        self.cache_folder_path = cache_folder_path
+        os.makedirs(cache_folder_path, exist_ok=True)
+        self.hashes = HashIndex(os.path.join(cache_folder_path, "hashes.json"))
+
+    def key(self, path, params):
+        return self.hashes.hash(path)[:32] + "-" + paramsHash(params)
+
+    def _resultPath(self, key):
+        return os.path.join(self.cache_folder_path, key + ".csv")
+
+    def load(self, key):
+        # Return the cached dataframe, or None if nothing is cached for the key
+        result_path = self._resultPath(key)
+        if not os.path.exists(result_path):
+            return None
+        return pd.read_csv(result_path, dtype={"id": str})
+
+    def save(self, key, df):
+        result_path = self._resultPath(key)
+        df.to_csv(result_path + ".tmp", index=False)
+        os.replace(result_path + ".tmp", result_path)
+
+    def saveHashes(self):
+        self.hashes.save()
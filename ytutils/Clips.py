@@ -0,0 +1,115 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from .Timestamps import parseTimestamps, formatTimestamps
+
+# Partial downloads (download_utils.download_video with clip=...) keep only some time windows of a video, joined into one file.
+# A <video_id>.clip.json sidecar next to the file records where each window came from:
+#     {"video_id": ..., "duration": <seconds of the full video>,
+#      "segments": [{"start": <seconds in the video>, "end": ..., "offset": <seconds in the clipped file>}, ...]}
+# Times measured in the clipped file (scenes, Whisper transcriptions) are mapped back to times in the full video with it,
+# so they line up with the YouTube subtitles and with the results of full downloads.
+
+
+def clipSections(duration, n_segments=1, segment_seconds=180):
+    # Time windows to download: the first segment_seconds for one segment, otherwise n_segments windows spread evenly
+    # over the video (first and last included). None if the windows would cover the whole video anyway.
+    if duration is None or duration <= n_segments * segment_seconds:
+        return None
+    if n_segments == 1:
+        return [(0.0, float(segment_seconds))]
+    starts = np.linspace(0, duration - segment_seconds, n_segments)
+    return [(round(float(start), 3), round(float(start) + segment_seconds, 3)) for start in starts]
+
+
+def writeClip(folder_path, video_id, duration, sections):
+    # Write the <video_id>.clip.json sidecar for the sections (start, end) joined in this order
+    segments, offset = [], 0.0
+    for start, end in sections:
+        segments.append({"start": start, "end": end, "offset": offset})
+        offset += end - start
+    clip = {"video_id": video_id, "duration": duration, "segments": segments}
+    with open(os.path.join(folder_path, f"{video_id}.clip.json"), "w") as file:
+        json.dump(clip, file)
+    return clip
+
+
+def readClip(folder_path, video_id):
+    # The clip sidecar of a video, or None if the whole video was downloaded
+    path = os.path.join(folder_path, f"{video_id}.clip.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def readClips(folder_path):
+    # All clip sidecars in a folder: video id -> clip
+    return {file[:-len(".clip.json")]: readClip(folder_path, file[:-len(".clip.json")])
+            for file in os.listdir(folder_path) if file.endswith(".clip.json")}
+
+
+def clipSummary(clips):
+    # One row per clipped video, for the metadata: the windows as "start-end;start-end" (seconds) and their total length
+    return pd.DataFrame(
+        [(video_id, ";".join(f"{segment['start']:g}-{segment['end']:g}" for segment in clip["segments"]),
+          sum(segment["end"] - segment["start"] for segment in clip["segments"])) for video_id, clip in clips.items()],
+        columns=["video_id", "clip_segments", "clip_duration_seconds"])
+
+
+def segmentOf(clip, seconds):
+    # Index of the segment each time in the clipped file falls in
+    offsets = np.array([segment["offset"] for segment in clip["segments"]])
+    return np.clip(np.searchsorted(offsets, seconds, side="right") - 1, 0, len(offsets) - 1)
+
+
+def toVideoTime(clip, seconds):
+    # Map times in the clipped file (seconds, array-like) to times in the full video
+    seconds = np.asarray(seconds, dtype=float)
+    shift = np.array([segment["start"] - segment["offset"] for segment in clip["segments"]])
+    return seconds + shift[segmentOf(clip, seconds)]
+
+
+def offsetScenes(scenes, clips, fps):
+    """
+    Map scenes detected in clipped files to times in the full videos. Scenes that span the join between two
+    windows are split there (the footage in between was never downloaded).
+    scenes: dataframe with id, start_time, end_time, start_frame_num, end_frame_num; fps: video id -> frame rate
+    """
+    if not clips or scenes.empty or not scenes["id"].isin(list(clips)).any():
+        return scenes
+    clipped = scenes["id"].isin(list(clips))
+    rows = []
+    for id, video_scenes in scenes[clipped].groupby("id", sort=False):
+        clip = clips[id]
+        joins = [segment["offset"] for segment in clip["segments"][1:]]
+        for start, end in zip(parseTimestamps(video_scenes["start_time"]) / 1000, parseTimestamps(video_scenes["end_time"]) / 1000):
+            cuts = [start] + [join for join in joins if start < join < end] + [end]
+            for piece_start, piece_end in zip(cuts[:-1], cuts[1:]):
+                # The end of a piece belongs to the segment it started in
+                video_start = toVideoTime(clip, piece_start)
+                video_end = video_start + (piece_end - piece_start)
+                rows.append((id, video_start, video_end))
+    mapped = pd.DataFrame(rows, columns=["id", "start_seconds", "end_seconds"])
+    frame_rate = mapped["id"].map(fps).astype(float)
+    mapped = pd.DataFrame({
+        "id": mapped["id"],
+        "start_time": formatTimestamps(np.round(mapped["start_seconds"] * 1000)),
+        "end_time": formatTimestamps(np.round(mapped["end_seconds"] * 1000)),
+        "start_frame_num": np.round(mapped["start_seconds"] * frame_rate).astype(int),
+        "end_frame_num": np.round(mapped["end_seconds"] * frame_rate).astype(int),
+    })
+    return pd.concat([scenes[~clipped], mapped], ignore_index=True)
+
+
+def offsetTranscription(result, clip):
+    # Map the segment (and word) times of a Whisper result for a clipped file to times in the full video, in place
+    for segment in result["segments"]:
+        shift = toVideoTime(clip, segment["start"]) - segment["start"]
+        segment["start"] = float(segment["start"] + shift)
+        segment["end"] = float(segment["end"] + shift)
+        for word in segment.get("words", []):
+            word["start"] = float(word["start"] + shift)
+            word["end"] = float(word["end"] + shift)
+    return result
@@ -1,109 +1,48 @@
 import os
+import shutil
 import pandas as pd
 import numpy as np
-from datetime import time
-from copy import deepcopy
+from .Timestamps import parseTimestamps
+from .Parallel import runInProcesses
+from .Features import addVideoFeatures
+from .Output import saveDataFrame, readChunks, outputColumns
+from .Profiling import profiled
 import warnings
 warnings.simplefilter(action='ignore', category=Warning)
 
 def addAverageSpeakingRate(metadata, transcriptions):
-    video_ids = pd.unique(transcriptions["id"]).tolist()
-    subset_df = metadata[metadata["video_id"].isin(video_ids)][["video_id", "duration_seconds"]].drop_duplicates(subset="video_id")
+    return addVideoFeatures(metadata, transcriptions=transcriptions, features=["average_speaking_rate_wpm"])
 
-    # Create a duration- and shots-dictionary
-    duration_dict = subset_df.groupby("video_id")["duration_seconds"].first().to_dict()
-    transcriptions["word_count"] = transcriptions["text"].apply(lambda x: len([word for word in x.split() if word]))
-    total_words_dict = transcriptions.groupby("id")["word_count"].sum().to_dict()
-    transcriptions = transcriptions.drop(columns="word_count")
 
-    # Calculate the averageShotLength for each video
-    averageSpeakingRate = {}
-    for key in duration_dict.keys():
-        averageSpeakingRate[key] = total_words_dict[key]/(duration_dict[key]/60)
+def addAverageShotLength(metadata, scenes):
+    return addVideoFeatures(metadata, scenes=scenes, features=["average_shot_length_seconds"])
+
 
-    metadata["average_speaking_rate_wpm"] = metadata["video_id"].map(averageSpeakingRate)
-    return metadata
+def calculateTimestamps(df, mid_timestamp=True):
+    # Parse the start and end time columns into integer milliseconds, so the tables stay numeric until the join
+    df["start_timestamp"] = parseTimestamps(df["start_time"])
+    df["end_timestamp"] = parseTimestamps(df["end_time"])
+    if mid_timestamp:
+        # Twice the midpoint, so it stays a whole number of milliseconds (a cue from x to x+1 ms has its midpoint at x+0.5 ms);
+        # it is compared against twice the scene end times
+        df["start_plus_end"] = df["start_timestamp"] + df["end_timestamp"]
+    return df
 
 
-def addAverageShotLength(metadata, scenes):
-    video_ids = pd.unique(scenes["id"]).tolist()
-    subset_df = metadata[metadata["video_id"].isin(video_ids)][["video_id", "duration_seconds", "fps"]].drop_duplicates(subset="video_id")
-
-    # Create a duration- and shots-dictionary
-    duration_dict = subset_df.groupby("video_id")["duration_seconds"].first().to_dict()
-    shots_dict = scenes["id"].value_counts().to_dict()
-
-    # Calculate the averageShotLength for each video
-    averageShotLength = {}
-    for key in duration_dict.keys():
-        averageShotLength[key] = duration_dict[key]/shots_dict[key]
-
-    metadata["average_shot_length_seconds"] = metadata["video_id"].map(averageShotLength)
-    return metadata
-
-
-def calculateTimestamps(row, mid_timestamp=True):
-    # Convert start time and end time to time objects
-    start = time.fromisoformat(row["start_time"])
-    end = time.fromisoformat(row["end_time"])
-    if not mid_timestamp:
-        return start, end
-
-    # Convert time objects to total microseconds
-    total_microseconds_start = (start.hour * 3600 + start.minute * 60 + start.second) * 10**6 + start.microsecond
-    total_microseconds_end = (end.hour * 3600 + end.minute * 60 + end.second) * 10**6 + end.microsecond
-    
-    # Calculate the midpoint
-    total_midpoint = (total_microseconds_start + total_microseconds_end) / 2
-    
-    # Calculate the components of the midpoint time
-    hours, remainder = divmod(total_midpoint, 3600 * 10**6)
-    minutes, remainder = divmod(remainder, 60 * 10**6)
-    seconds, microseconds = divmod(remainder, 10**6)
-
-    # Calculate the midpoint time
-    midpoint_time = time(int(hours), int(minutes), int(seconds), int(microseconds))
-    
-    return start, end, midpoint_time
-
-
-def setSceneIds(row, scene_ids):
-    id = row["id"]
-    end = row["end_timestamp"]
-    # Add video id, the timestamp at the end of each scene and an index to define each scene to the scene scene_ids list
-    scene_ids.append((id, end, row.name))
-
-    return row.name
-
-
-def assign(id, mid, scene_ids):
-    iteration = 0  # Initiate counter of iterations
-    # Iterate over each tuple in scene_ids
-    for scene_id in scene_ids:
-        # If id of the subtitle/transcription = id of scene and the midpoint of the subtitle/transcription is less than the endtime of the scene
-        if id == scene_id[0] and mid <= scene_id[1]:
-            output = scene_id[2]  # Add the scene index to output
-            break
-        # Handle that Whisper can sometimes hallucinate after video has ended (>duration)
-        # Else if the scene id is not equal to the next iteration scene id (Next iteration is a new video) and the midpoint of the subtitle/transcription is greater than the endtime of the current scene
-        elif scene_id[0] != scene_ids[iteration+1][0] and mid > scene_id[1]:
-            # Then the current midpoint of the subtitle/transcription is greater than the duration of the video, and thereby is a hallucination
-            output = np.nan  # Add nan to output
-            break   
-        
-        iteration += 1  # If algorithm should move on and check the next scene, then increase the iteration counter
-
-    return iteration, output
-
-
-def assignSceneIds(row, scene_ids_for_transcriptions):
-    id = row["id"]
-    mid = row["mid_timestamp"]
-
-    iteration, output = assign(id, mid, scene_ids_for_transcriptions)  # Call assign function
-    del scene_ids_for_transcriptions[:iteration]  # Remove <iteration> number of scenes from the copy scene_ids, since they have are done
-    
-    return output
+def assignSceneIds(transcriptions, scenes):
+    # Grouped interval join: per video, binary search each subtitle/transcription midpoint against the sorted scene end times,
+    # and take the first scene that ends at or after the midpoint (the scene the midpoint falls in)
+    # (both sides doubled: start+end against 2*end, see calculateTimestamps)
+    cues = pd.DataFrame({"id": transcriptions["id"].to_numpy(), "start_plus_end": transcriptions["start_plus_end"].to_numpy(), "row": np.arange(len(transcriptions))})
+    cues = cues.sort_values("start_plus_end", kind="stable")
+    scene_ends = pd.DataFrame({"id": scenes["id"].to_numpy(), "twice_end": 2 * scenes["end_timestamp"].to_numpy(), "scene_index": scenes["scene_index"].to_numpy()})
+    scene_ends = scene_ends.sort_values("twice_end", kind="stable")
+    joined = pd.merge_asof(cues, scene_ends, left_on="start_plus_end", right_on="twice_end", by="id", direction="forward")
+
+    # Midpoints after the last scene of their video get no match (NaN): Whisper can hallucinate after the video has ended (>duration)
+    scene_index = np.full(len(transcriptions), np.nan)
+    scene_index[joined["row"].to_numpy()] = joined["scene_index"].to_numpy(dtype=float)
+    return scene_index
 
 
 def fillStartAndEndSubtitleTimes(df):
@@ -127,7 +66,7 @@ def joinTranscriptsAndScenes(transcriptions, scenes):
     transcripts_scenes = transcripts_scenes.drop(columns=["scene_index",
                                                 "start_timestamp_transcript",
                                                 "end_timestamp_transcript",
-                                                "mid_timestamp",
+                                                "start_plus_end",
                                                 "start_timestamp_scene",
                                                 "end_timestamp_scene"])
 
@@ -145,7 +84,8 @@ def joinAll(transcripts_scenes, metadata):
     return transcripts_scenes_meta
 
 
-def concatenateFullData(metadata, scenes, transcriptions, from_YouTube=False, save_dataframe=False):
+@profiled
+def concatenateFullData(metadata, scenes, transcriptions, from_YouTube=False, save_dataframe=False, features=("average_speaking_rate_wpm", "average_shot_length_seconds")):
     """
     This function creates a dataframe of the concatenation of metadata, scenes and transcriptions.
     --- args ---
@@ -155,33 +95,29 @@ def concatenateFullData(metadata, scenes, transcriptions, from_YouTube=False, sa
 
     --- kwargs ---
     from_YouTube: bool    |  default: False  # assumes Whisper transcriptions; change to True if YouTube subtitles are being used as input
-    save_dataframe: bool  |  default: False
+    save_dataframe: bool  |  default: False  # or the format: "csv", "parquet" or "arrow" (see Output)
+    features: list        |  default: ["average_speaking_rate_wpm", "average_shot_length_seconds"]  # see Features.addVideoFeatures for all options
 
     --- output ---
     Outputs from function
     full_data: pandas.DataFrame
 
-    Outputs to current directory (if save_dataframe=True)
-    full_data: .csv
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    full_data: .csv, .parquet or .arrow
     """
 
-    metadata = addAverageSpeakingRate(metadata, transcriptions)
-    metadata = addAverageShotLength(metadata, scenes)
+    metadata = addVideoFeatures(metadata, transcriptions=transcriptions, scenes=scenes, features=features)  # Per-video features in one grouped pass
 
     # Create timestamps from the time columns in the dataframe, so that the midpoint can be calculated
-    scenes[["start_timestamp", "end_timestamp"]] = scenes.apply(calculateTimestamps, mid_timestamp=False, axis=1, result_type="expand")
-    transcriptions[["start_timestamp", "end_timestamp", "mid_timestamp"]] = transcriptions.apply(calculateTimestamps, axis=1, result_type="expand")
+    scenes = calculateTimestamps(scenes, mid_timestamp=False)
+    transcriptions = calculateTimestamps(transcriptions)
 
     # Sort the dataframes, except metadata, by video id
     scenes = scenes.sort_values(by=["id", "end_timestamp"]).reset_index(drop=True)
     transcriptions = transcriptions.sort_values(by=["id", "end_timestamp"]).reset_index(drop=True)
 
-
-    scene_ids = []  # Initiate an empty list to store scene_ids
-    scenes["scene_index"] = scenes.apply(setSceneIds, scene_ids=scene_ids, axis=1)  # Call the setSceneIds function on the scene_detections
-
-    scene_ids_for_transcriptions = deepcopy(scene_ids)  # Make a copy of the scene_ids list to be used for iteration and assigning scene ids to transcriptions
-    transcriptions["scene_index"] = transcriptions.apply(assignSceneIds, scene_ids_for_transcriptions=scene_ids_for_transcriptions, axis=1)  # Call the subtitle-variant of the assignSceneIds function on the subtitles
+    scenes["scene_index"] = scenes.index  # Each scene is identified by its row in the sorted scenes dataframe
+    transcriptions["scene_index"] = assignSceneIds(transcriptions, scenes)  # Assign each subtitle/transcription to the scene its midpoint falls in
     if not from_YouTube:
         transcriptions = transcriptions.dropna(subset=["scene_index"]).reset_index(drop=True)  # Drop NaN value scene indexes from the Whisper transcriptions, since they are hallucinations
 
@@ -190,7 +126,116 @@ def concatenateFullData(metadata, scenes, transcriptions, from_YouTube=False, sa
 
     # Join (transcriptions and scenes) and metadata
     full_data = joinAll(transcripts_scenes, metadata)
-    if save_dataframe:
-        full_data.to_csv("full_data.csv", index=False)
+    saveDataFrame(full_data, "full_data", save_dataframe)
+
+    return full_data
+
+
+def partitionOf(video_ids, n_partitions):
+    # Stable partition number of each video id (the same id lands in the same partition on every run and machine)
+    hashes = pd.util.hash_pandas_object(pd.Series(video_ids, dtype=object), index=False).to_numpy()
+    return (hashes % np.uint64(n_partitions)).astype(np.int64)
+
+
+def scatterInput(input_path, key_column, spill_folder_path, n_partitions, chunksize):
+    # Stream the input (.csv, .parquet or .arrow) in chunks and append every row to the spill file of its partition,
+    # so the file is never fully in memory
+    os.makedirs(spill_folder_path, exist_ok=True)
+    written = set()
+    for chunk in readChunks(input_path, chunksize, dtype={key_column: str}):
+        partitions = partitionOf(chunk[key_column], n_partitions)
+        for partition, rows in chunk.groupby(partitions):
+            rows.to_csv(os.path.join(spill_folder_path, f"part-{partition:05d}.csv"), mode="a", header=partition not in written, index=False)
+            written.add(partition)
+    return outputColumns(input_path)  # The header, for partitions without rows
+
+
+def readSpill(spill_folder_path, partition, columns, key_column):
+    path = os.path.join(spill_folder_path, f"part-{partition:05d}.csv")
+    if not os.path.exists(path):
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    return pd.read_csv(path, dtype={key_column: str})
 
-    return full_data
\ No newline at end of file
+
+def concatenatePartition(task):
+    # Run in a worker process: load one partition of each table and run the normal in-memory concatenation on it
+    partition, spill_folder_path, output_folder_path, columns, from_YouTube = task
+    metadata = readSpill(os.path.join(spill_folder_path, "metadata"), partition, columns["metadata"], "video_id")
+    scenes = readSpill(os.path.join(spill_folder_path, "scenes"), partition, columns["scenes"], "id")
+    transcriptions = readSpill(os.path.join(spill_folder_path, "transcriptions"), partition, columns["transcriptions"], "id")
+    transcriptions["text"] = transcriptions["text"].fillna("").astype(str)  # Empty subtitles are read back from csv as NaN
+
+    full_data = concatenateFullData(metadata, scenes, transcriptions, from_YouTube=from_YouTube)
+
+    partition_folder_path = os.path.join(output_folder_path, f"partition={partition:05d}")
+    os.makedirs(partition_folder_path, exist_ok=True)
+    full_data.to_parquet(os.path.join(partition_folder_path, "part-0.parquet"), index=False)
+    return len(full_data)
+
+
+@profiled
+def concatenateFullDataPartitioned(metadata_path, scenes_path, transcriptions_path, output_folder_path, n_partitions=64, processes=None, chunksize=100000, from_YouTube=False):
+    """
+    This function creates the same concatenation of metadata, scenes and transcriptions as concatenateFullData, but out-of-core:
+    the inputs are split into partitions by a hash of the video id, and each partition is joined and written on its own.
+    Peak memory is set by the partition size (times the number of processes), not by the size of the corpus.
+    --- args ---
+    metadata_path: string        # .csv, .parquet or .arrow written by getMetadata
+    scenes_path: string          # .csv, .parquet or .arrow written by mp4ToScenes
+    transcriptions_path: string  # .csv, .parquet or .arrow written by vttToTranscriptions
+    output_folder_path: string
+
+    --- kwargs ---
+    n_partitions: int    |  default: 64     # more partitions means less memory per partition
+    processes: int       |  default: os.cpu_count()
+    chunksize: int       |  default: 100000  # rows read at a time when splitting the inputs
+    from_YouTube: bool   |  default: False   # assumes Whisper transcriptions; change to True if YouTube subtitles are being used as input
+
+    --- output ---
+    Outputs from function
+    partitions: pandas.DataFrame  # one row per partition with the number of rows written, or the error
+
+    Outputs to "output_folder_path" directory
+    full_data: partition=<number>/part-0.parquet  (read all with pandas.read_parquet(output_folder_path); replaces the partitions of earlier runs)
+    """
+    spill_folder_path = os.path.join(output_folder_path, "_spill")
+    staging_folder_path = os.path.join(output_folder_path, "_staging")  # The partitions are written here and swapped in at the end
+    for folder_path in [spill_folder_path, staging_folder_path]:
+        if os.path.exists(folder_path):
+            shutil.rmtree(folder_path)  # Leftovers from an interrupted run
+
+    # Split every input into partitions, streaming through the files
+    columns = {
+        "metadata": scatterInput(metadata_path, "video_id", os.path.join(spill_folder_path, "metadata"), n_partitions, chunksize),
+        "scenes": scatterInput(scenes_path, "id", os.path.join(spill_folder_path, "scenes"), n_partitions, chunksize),
+        "transcriptions": scatterInput(transcriptions_path, "id", os.path.join(spill_folder_path, "transcriptions"), n_partitions, chunksize),
+    }
+
+    # Join the partitions in parallel, each in its own process
+    tasks = [(partition, spill_folder_path, staging_folder_path, columns, from_YouTube) for partition in range(n_partitions)]
+    results = []
+    for i, (task, rows, error) in enumerate(runInProcesses(concatenatePartition, tasks, processes=processes)):
+        print(f"\rProcessing partition {i + 1}/{n_partitions}", end="")
+        results.append({"partition": task[0], "rows": rows, "error": error})
+    print()
+
+    shutil.rmtree(spill_folder_path)
+
+    # Replace the output of earlier runs (also other partition counts), so no stale partitions are read with the new ones.
+    # Failed partitions have no output.
+    for folder in os.listdir(output_folder_path):
+        if folder.startswith("partition="):
+            shutil.rmtree(os.path.join(output_folder_path, folder))
+    if os.path.exists(staging_folder_path):
+        for folder in os.listdir(staging_folder_path):
+            os.replace(os.path.join(staging_folder_path, folder), os.path.join(output_folder_path, folder))
+        shutil.rmtree(staging_folder_path)
+
+    partitions = pd.DataFrame(results).sort_values("partition").reset_index(drop=True)
+    failed = partitions[partitions["error"].notna()]
+    if len(failed):
+        print(f"{len(failed)} of {n_partitions} partitions failed:")
+        for partition, error in failed[["partition", "error"]].itertuples(index=False):
+            print(f"  partition {partition}: {error}")
+
+    return partitions
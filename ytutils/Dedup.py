@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from .Output import saveDataFrame
+from .Profiling import profiled
+
+
+def quickFingerprint(path, chunk_size=1024**2):
+    # Cheap first stage: file size plus a hash of the first and last MB (reads at most 2 MB per video)
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as file:
+        digest.update(file.read(chunk_size))
+        if size > chunk_size:
+            file.seek(max(size - chunk_size, chunk_size))
+            digest.update(file.read(chunk_size))
+    return size, digest.hexdigest()[:32]
+
+
+def videoDuration(path):
+    # Content-independent key for the second stage: the duration in seconds, from the yt-dlp info file next to the video,
+    # or else from the container header (None if unknown). Re-encoded copies of a clip keep (about) the same duration.
+    info_path = os.path.splitext(path)[0] + ".info.json"
+    if os.path.exists(info_path):
+        with open(info_path, "r") as file:
+            duration = json.load(file).get("duration")
+        if duration:
+            return float(duration)
+    import cv2
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        capture.release()
+    return frame_count / fps if fps and frame_count > 0 else None
+
+
+def durationKeys(duration, tolerance_seconds):
+    # The whole seconds a copy of a clip of this duration can be indexed under
+    if duration is None:
+        return []
+    return list(range(int(round(duration - tolerance_seconds)), int(round(duration + tolerance_seconds)) + 1))
+
+
+def perceptualHash(path, n_frames=5):
+    # Second stage: a 64 bit DCT hash (pHash) of a few evenly spaced frames
+    import cv2  # Only needed when durations collide
+    capture = cv2.VideoCapture(path)
+    try:
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        hashes = []
+        for frame_number in np.linspace(0, max(frame_count - 1, 0), n_frames + 2)[1:-1].astype(int):  # Skip the very first/last frame (often black)
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(frame_number))
+            success, frame = capture.read()
+            if not success:
+                continue
+            gray = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+            low_frequencies = cv2.dct(np.float32(gray))[:8, :8].flatten()
+            bits = low_frequencies > np.median(low_frequencies[1:])  # Ignore the DC term
+            hashes.append(int(np.packbits(bits).view(">u8")[0]))
+    finally:
+        capture.release()
+    return hashes
+
+
+def hashDistance(hashes_a, hashes_b):
+    # Mean number of differing bits between the frame hashes of two videos (64 if they can not be compared)
+    if not hashes_a or len(hashes_a) != len(hashes_b):
+        return 64
+    return float(np.mean([bin(a ^ b).count("1") for a, b in zip(hashes_a, hashes_b)]))
+
+
+class DedupIndex:
+    """
+    Index of the downloaded videos by a staged fingerprint, used to find re-uploads of the same clip under different video ids.
+
+    Exact copies are found by size and a hash of their first and last MB, without decoding anything.
+    Re-encoded copies differ in size and bytes, so otherwise frames are decoded for the videos of about the same
+    duration, and two videos are duplicates if the perceptual hashes of sampled frames are close.
+    Every video gets a canonical id: its own, or that of the first indexed copy of the same clip.
+
+    --- args ---
+    index_path: string  # .json file the index is saved to
+
+    --- kwargs ---
+    n_frames: int              |  default: 5
+    max_distance: float        |  default: 6  # mean differing bits (of 64) per frame for two copies to count as the same clip
+    duration_tolerance: float  |  default: 1  # seconds two copies of a clip may differ in duration
+    """
+
+    def __init__(self, index_path, n_frames=5, max_distance=6, duration_tolerance=1):
+        self.index_path = index_path
+        self.n_frames = n_frames
+        self.max_distance = max_distance
+        self.duration_tolerance = duration_tolerance
+        self.lock = threading.Lock()
+        if os.path.exists(index_path):
+            with open(index_path, "r") as file:
+                self.videos = json.load(file)
+        else:
+            self.videos = {}
+        self.by_quick = {}  # (size, quick hash) -> video ids
+        self.by_duration = {}  # duration in whole seconds -> video ids
+        for video_id, entry in self.videos.items():
+            if "duration" not in entry:  # Indexed before durations were recorded
+                entry["duration"] = videoDuration(entry["path"]) if os.path.exists(entry["path"]) else None
+            self.by_quick.setdefault((entry["size"], entry["quick"]), []).append(video_id)
+            if entry["duration"] is not None:
+                self.by_duration.setdefault(int(round(entry["duration"])), []).append(video_id)
+
+    def add(self, video_id, video_path):
+        """Index a video and return its canonical id. Call save() to write the index to disk."""
+        with self.lock:
+            if video_id in self.videos:
+                return self.videos[video_id]["canonical_id"]
+
+        size, quick = quickFingerprint(video_path)
+        duration = videoDuration(video_path)
+        with self.lock:
+            exact = self.by_quick.get((size, quick), [])
+            candidates = [] if exact else [candidate for candidate in dict.fromkeys(candidate for key in durationKeys(duration, self.duration_tolerance)
+                                                                                    for candidate in self.by_duration.get(key, []))
+                                           if abs(self.videos[candidate]["duration"] - duration) <= self.duration_tolerance]
+        entry = {"path": os.path.abspath(video_path), "size": size, "quick": quick, "duration": duration, "phash": None, "canonical_id": video_id}
+
+        if exact:
+            entry["canonical_id"] = self.videos[exact[0]]["canonical_id"]  # Byte-identical copy: nothing to decode
+        elif candidates:
+            entry["phash"] = perceptualHash(video_path, self.n_frames)
+            for candidate in candidates:
+                with self.lock:
+                    other = self.videos[candidate]
+                if other["phash"] is None and os.path.exists(other["path"]):
+                    other["phash"] = perceptualHash(other["path"], self.n_frames)  # Decoded once, on its first collision
+                if other["phash"] is not None and hashDistance(entry["phash"], other["phash"]) <= self.max_distance:
+                    entry["canonical_id"] = other["canonical_id"]
+                    break
+
+        with self.lock:
+            self.videos[video_id] = entry
+            self.by_quick.setdefault((size, quick), []).append(video_id)
+            if duration is not None:
+                self.by_duration.setdefault(int(round(duration)), []).append(video_id)
+        return entry["canonical_id"]
+
+    def canonical(self, video_id):
+        entry = self.videos.get(video_id)
+        return entry["canonical_id"] if entry else video_id
+
+    def groups(self):
+        """Return a dataframe of the duplicates: video_id, canonical_id (only groups with more than one video)."""
+        with self.lock:
+            rows = [(video_id, entry["canonical_id"]) for video_id, entry in self.videos.items()]
+        groups = pd.DataFrame(rows, columns=["video_id", "canonical_id"])
+        return groups[groups["canonical_id"].duplicated(keep=False)].sort_values(["canonical_id", "video_id"]).reset_index(drop=True)
+
+    def save(self):
+        with self.lock:
+            with open(self.index_path + ".tmp", "w") as file:
+                json.dump(self.videos, file)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+
+@profiled
+def deduplicateVideos(video_folder_path, index_path, save_dataframe=True):
+    """
+    This function adds all downloaded videos to a dedup index and finds the groups of duplicates.
+    --- args ---
+    video_folder_path: string  # folder where video files are located (.mp4)
+    index_path: string         # .json file of the DedupIndex; videos already in it are not read again
+
+    --- kwargs ---
+    save_dataframe: bool  |  default: True  # or the format: "csv", "parquet" or "arrow" (see Output)
+
+    --- output ---
+    Outputs from function
+    duplicates: pandas.DataFrame  # video_id, canonical_id
+
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    duplicates: .csv, .parquet or .arrow
+    """
+    index = DedupIndex(index_path)
+    video_ids = sorted(file[:11] for file in os.listdir(video_folder_path) if file.endswith(".mp4"))
+    for i, video_id in enumerate(video_ids):
+        print(f"\rIndexing video {i + 1}/{len(video_ids)}", end="")
+        index.add(video_id, os.path.join(video_folder_path, video_id + ".mp4"))
+    print()
+    index.save()
+
+    duplicates = index.groups()
+    print(f"Found {duplicates['canonical_id'].nunique()} clips downloaded more than once ({len(duplicates)} videos)")
+    saveDataFrame(duplicates, "duplicates", save_dataframe)
+    return duplicates
+
+
+def skippedDuplicates(video_ids, duplicates):
+    # The video ids that can reuse the result of their canonical copy (the canonical copy is among video_ids)
+    if duplicates is None or duplicates.empty:
+        return set()
+    canonical = duplicates.set_index("video_id")["canonical_id"]
+    video_ids = set(video_ids)
+    return {video_id for video_id in video_ids if canonical.get(video_id, video_id) != video_id and canonical[video_id] in video_ids}
+
+
+def expandDuplicates(df, duplicates, skipped, id_column="id"):
+    # Copy the rows of each canonical copy to the duplicates that were skipped
+    if not skipped:
+        return df
+    canonical = duplicates.set_index("video_id")["canonical_id"]
+    mapping = pd.DataFrame({"copy_id": sorted(skipped)})
+    mapping["canonical_id"] = mapping["copy_id"].map(canonical)
+    copies = df.merge(mapping, left_on=id_column, right_on="canonical_id", how="inner")
+    copies[id_column] = copies["copy_id"]
+    return pd.concat([df, copies[df.columns]], ignore_index=True)
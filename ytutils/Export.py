@@ -0,0 +1,168 @@
+import os
+import io
+import time
+import tarfile
+import pandas as pd
+from .Metadata import readInfoFile
+from .Profiling import profiled
+
+BLOCK = tarfile.BLOCKSIZE
+
+
+def paddedSize(size):
+    # Tar stores member data in whole 512 byte blocks
+    return -(-size // BLOCK) * BLOCK
+
+
+def videoBundle(video_id, video_folder_path, transcription_folder_path, scenes, cues, include_media):
+    # The members of one video, in a fixed order: (name, path or bytes)
+    members = []
+    if include_media:
+        members.append((f"{video_id}.mp4", os.path.join(video_folder_path, video_id + ".mp4")))
+
+    info_path = os.path.join(video_folder_path, video_id + ".info.json")
+    if os.path.exists(info_path):
+        info = pd.Series(readInfoFile(info_path)).to_json()  # Slim metadata instead of the full (several MB) info file
+        members.append((f"{video_id}.info.json", info.encode("utf-8")))
+
+    if transcription_folder_path is not None:
+        vtt_files = sorted(file for file in os.listdir(transcription_folder_path) if file.startswith(video_id) and file.endswith(".vtt"))
+        if vtt_files:
+            members.append((f"{video_id}.vtt", os.path.join(transcription_folder_path, vtt_files[0])))
+
+    if video_id in scenes:
+        members.append((f"{video_id}.scenes.csv", scenes[video_id].to_csv(index=False).encode("utf-8")))
+    if video_id in cues:
+        members.append((f"{video_id}.cues.csv", cues[video_id].to_csv(index=False).encode("utf-8")))
+    return members
+
+
+def memberSize(content):
+    return os.path.getsize(content) if isinstance(content, str) else len(content)
+
+
+def bundleSize(members):
+    return sum(BLOCK + paddedSize(memberSize(content)) for _, content in members)
+
+
+class ShardWriter:
+    # Writes members to shard-000000.tar, shard-000001.tar, ... and an index per shard with the byte offset of every member
+    def __init__(self, output_folder_path, max_shard_bytes, prefix):
+        self.output_folder_path = output_folder_path
+        self.max_shard_bytes = max_shard_bytes
+        self.prefix = prefix
+        self.shard_number = -1
+        self.tar = None
+        self.shards = []
+
+    def path(self, extension):
+        return os.path.join(self.output_folder_path, f"{self.prefix}-{self.shard_number:06d}{extension}")
+
+    def open(self):
+        self.shard_number += 1
+        self.tar = tarfile.open(self.path(".tar.tmp"), "w", format=tarfile.USTAR_FORMAT)
+        self.index = []
+        self.keys = 0
+
+    def close(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        # Rename only complete shards, so that readers never see a half written one
+        os.replace(self.path(".tar.tmp"), self.path(".tar"))
+        pd.DataFrame(self.index, columns=["key", "name", "offset", "size"]).to_csv(self.path(".index.csv"), index=False)
+        self.shards.append({"shard": os.path.basename(self.path(".tar")), "videos": self.keys, "bytes": os.path.getsize(self.path(".tar"))})
+        self.tar = None
+
+    def write(self, key, members):
+        # A bundle is never split across shards; a new shard is started when the bundle would not fit
+        size = bundleSize(members)
+        if self.tar is None or (self.keys > 0 and self.tar.offset + size > self.max_shard_bytes):
+            self.close()
+            self.open()
+
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = memberSize(content)
+            info.mtime = time.time()
+            if isinstance(content, str):
+                with open(content, "rb") as file:
+                    self.tar.addfile(info, file)
+            else:
+                self.tar.addfile(info, io.BytesIO(content))
+            self.index.append((key, name, self.tar.offset - paddedSize(info.size), info.size))
+        self.keys += 1
+        return os.path.basename(self.path(".tar"))
+
+
+@profiled
+def exportShards(video_folder_path, output_folder_path, scenes=None, transcriptions=None, transcription_folder_path=None, max_shard_size_MB=1024, include_media=True, prefix="shard"):
+    """
+    This function packs the artifacts of each downloaded video into size-bounded tar shards (WebDataset layout),
+    so that they can be read with large sequential reads and shuffled at shard level.
+    --- args ---
+    video_folder_path: string   # folder where video files and info files are located (.mp4, .info.json)
+    output_folder_path: string
+
+    --- kwargs ---
+    scenes: pandas.DataFrame          |  default: None  # output of mp4ToScenes
+    transcriptions: pandas.DataFrame  |  default: None  # output of vttToTranscriptions or transcribeVideos
+    transcription_folder_path: string |  default: None  # folder where transcription/subtitle files are located (.vtt)
+    max_shard_size_MB: float          |  default: 1024  # a single video larger than this gets a shard of its own
+    include_media: bool               |  default: True  # False exports metadata, cues and scenes only
+    prefix: string                    |  default: "shard"
+
+    --- output ---
+    Outputs from function
+    index: pandas.DataFrame  # video_id, shard
+
+    Outputs to "output_folder_path" directory
+    shards: <prefix>-000000.tar, ...  # members <id>.mp4, <id>.info.json, <id>.vtt, <id>.scenes.csv, <id>.cues.csv
+    shard indexes: <prefix>-000000.index.csv, ...  # key, name, offset (of the member data in the tar), size
+    index: index.csv  # the shard of every video
+    shards: shards.csv  # number of videos and bytes per shard
+    """
+    os.makedirs(output_folder_path, exist_ok=True)
+    video_ids = sorted(file[:-4] for file in os.listdir(video_folder_path) if file.endswith(".mp4"))
+
+    # Split the tables per video once, instead of filtering them for every video
+    scenes = dict(tuple(scenes.groupby("id"))) if scenes is not None else {}
+    cues = dict(tuple(transcriptions.groupby("id"))) if transcriptions is not None else {}
+
+    writer = ShardWriter(output_folder_path, max_shard_size_MB * 1024 ** 2, prefix)
+    index = []
+    for i, video_id in enumerate(video_ids):
+        print(f"\rExporting video {i + 1}/{len(video_ids)}", end="")
+        members = videoBundle(video_id, video_folder_path, transcription_folder_path, scenes, cues, include_media)
+        index.append((video_id, writer.write(video_id, members)))
+    writer.close()
+    print(f"\nExported {len(video_ids)} videos to {len(writer.shards)} shards")
+
+    index = pd.DataFrame(index, columns=["video_id", "shard"])
+    index.to_csv(os.path.join(output_folder_path, "index.csv"), index=False)
+    pd.DataFrame(writer.shards, columns=["shard", "videos", "bytes"]).to_csv(os.path.join(output_folder_path, "shards.csv"), index=False)
+    return index
+
+
+def readShard(shard_path):
+    """
+    Read one shard sequentially, yielding a dictionary per video: {"__key__": video_id, "mp4": bytes, "info.json": bytes, ...}
+    """
+    sample = {}
+    with tarfile.open(shard_path, "r|") as tar:  # Stream mode, no seeking
+        for member in tar:
+            key, extension = member.name.split(".", 1)
+            if sample and sample["__key__"] != key:
+                yield sample
+                sample = {}
+            sample["__key__"] = key
+            sample[extension] = tar.extractfile(member).read()
+    if sample:
+        yield sample
+
+
+def readMember(shard_path, offset, size):
+    """Read a single member with the offset and size from the shard index, without reading the rest of the shard."""
+    with open(shard_path, "rb") as file:
+        file.seek(offset)
+        return file.read(size)
@@ -0,0 +1,110 @@
+import numpy as np
+import ffmpeg
+from scenedetect.frame_timecode import FrameTimecode
+
+
+def keyframeNumbers(video_path, fps):
+    # Read the keyframe positions from the packet flags of the container (no decoding needed)
+    probe = ffmpeg.probe(video_path, select_streams="v:0", show_entries="packet=pts_time,flags")
+    times = [float(packet["pts_time"]) for packet in probe.get("packets", []) if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A")]
+    return np.unique(np.round(np.array(times) * fps).astype(np.int64))
+
+
+def lowResFrameStream(video_path, width=32, height=18):
+    # Start an ffmpeg process that decodes the video to tiny grayscale frames on stdout
+    return (
+        ffmpeg
+        .input(video_path, skip_loop_filter="all", flags2="fast")  # Cheaper decoding; quality does not matter at this size
+        .output("pipe:", format="rawvideo", pix_fmt="gray", vf=f"scale={width}:{height}:flags=area", an=None, sn=None)
+        .global_args("-loglevel", "error", "-nostats")  # Keep stderr small, so its pipe never fills up
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+
+
+class LowResCutDetector:
+    """
+    Proposes scene cuts from a stream of tiny grayscale frames.
+
+    A frame is a cut when its mean absolute difference to the previous frame is above the threshold,
+    or above threshold * keyframe_factor when the encoder placed a keyframe on it (encoders tend to
+    put keyframes on shot changes). Cuts closer than min_scene_len frames to the previous cut are dropped.
+    """
+
+    def __init__(self, threshold=20.0, keyframes=(), keyframe_factor=0.5, min_scene_len=15):
+        self.threshold = threshold
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.keyframe_factor = keyframe_factor
+        self.min_scene_len = min_scene_len
+        self.previous = None
+        self.differences = []
+        self.n_frames = 0
+
+    def push(self, frames):
+        # frames: uint8 array of shape (n, height, width), in display order
+        if len(frames) == 0:
+            return
+        frames = frames.astype(np.int16)
+        if self.previous is not None:
+            frames_with_previous = np.concatenate([self.previous[None], frames])
+        else:
+            frames_with_previous = frames
+            self.differences.append(np.zeros(1, dtype=np.float32))  # The first frame can never be a cut
+        self.differences.append(np.abs(np.diff(frames_with_previous, axis=0)).mean(axis=(1, 2)).astype(np.float32))
+        self.previous = frames[-1]
+        self.n_frames += len(frames)
+
+    def cuts(self):
+        if self.n_frames == 0:
+            return np.array([], dtype=np.int64)
+        differences = np.concatenate(self.differences)
+        thresholds = np.full(len(differences), self.threshold, dtype=np.float32)
+        keyframes = self.keyframes[(self.keyframes > 0) & (self.keyframes < len(differences))]
+        thresholds[keyframes] *= self.keyframe_factor
+        candidates = np.flatnonzero(differences > thresholds)
+
+        # Enforce the minimum scene length (few candidates, so a plain loop is fine)
+        cuts = []
+        last = 0
+        for frame in candidates:
+            if frame - last >= self.min_scene_len:
+                cuts.append(frame)
+                last = frame
+        return np.array(cuts, dtype=np.int64)
+
+    def scenes(self, fps):
+        # Turn the cuts into (start, end) FrameTimecode tuples, like scenedetect's scene lists
+        boundaries = [0, *self.cuts().tolist(), self.n_frames]
+        return [(FrameTimecode(timecode=int(start), fps=fps), FrameTimecode(timecode=int(end), fps=fps)) for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def findScenesFast(video_path, fps, threshold=20.0, width=32, height=18, min_scene_len=15, use_keyframes=True, chunk_frames=1024):
+    """
+    Approximate scene detection from the keyframe positions and a heavily downscaled decode of the video.
+    Returns a list of (start, end) FrameTimecode tuples, or an empty list if no cuts are found.
+    """
+    keyframes = keyframeNumbers(video_path, fps) if use_keyframes else ()
+    detector = LowResCutDetector(threshold=threshold, keyframes=keyframes, min_scene_len=min_scene_len)
+
+    frame_size = width * height
+    process = lowResFrameStream(video_path, width=width, height=height)
+    leftover = b""
+    try:
+        while True:
+            data = process.stdout.read(frame_size * chunk_frames)
+            if not data:
+                break
+            data = leftover + data
+            complete = len(data) - len(data) % frame_size  # Keep a partial frame for the next read
+            leftover = data[complete:]
+            detector.push(np.frombuffer(data[:complete], dtype=np.uint8).reshape(-1, height, width))
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors="replace")
+        return_code = process.wait()
+    if return_code != 0:
+        raise RuntimeError(f"ffmpeg could not decode {video_path} (exit code {return_code}): {stderr.strip()}")
+
+    scenes = detector.scenes(fps)
+    if len(scenes) == 1:  # No cuts found
+        return []
+    return scenes
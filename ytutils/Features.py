@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from .Timestamps import parseTimestamps
+
+# Registries of per-video aggregates and of the features computed from them.
+# Every aggregate of a table is computed in the same grouped pass over that table,
+# and every feature is plain column arithmetic on the resulting per-video table,
+# so registering a new one does not add another pass over the data.
+AGGREGATES = {"transcriptions": {}, "scenes": {}}
+FEATURES = {}
+
+
+def registerAggregate(table, name, column, how):
+    """
+    Declare a per-video aggregate of the "transcriptions" or "scenes" table.
+    column(df) returns a Series with one value per row, which is reduced per video with how ("sum", "size", "mean", "median", ...).
+    """
+    AGGREGATES[table][name] = (column, how)
+
+
+def registerFeature(name):
+    """Decorator that declares a per-video feature: func(aggregates) -> Series, with aggregates indexed by video_id."""
+    def register(func):
+        FEATURES[name] = func
+        return func
+    return register
+
+
+def durationMilliseconds(df):
+    return pd.Series(parseTimestamps(df["end_time"]) - parseTimestamps(df["start_time"]), index=df.index)
+
+
+registerAggregate("transcriptions", "words", lambda df: df["text"].fillna("").astype(str).str.count(r"\S+"), "sum")
+registerAggregate("transcriptions", "cues", lambda df: df["text"], "size")
+registerAggregate("transcriptions", "caption_seconds", lambda df: durationMilliseconds(df).clip(lower=0) / 1000, "sum")
+registerAggregate("scenes", "shots", lambda df: df["id"], "size")
+registerAggregate("scenes", "mean_shot_seconds", lambda df: durationMilliseconds(df) / 1000, "mean")
+registerAggregate("scenes", "median_shot_seconds", lambda df: durationMilliseconds(df) / 1000, "median")
+
+
+def perMinute(count, duration_seconds):
+    # Missing or zero durations give NaN instead of inf
+    return count / (duration_seconds.where(duration_seconds > 0) / 60)
+
+
+@registerFeature("average_speaking_rate_wpm")
+def averageSpeakingRate(aggregates):
+    return perMinute(aggregates["words"], aggregates["duration_seconds"])
+
+
+@registerFeature("average_shot_length_seconds")
+def averageShotLength(aggregates):
+    return aggregates["duration_seconds"] / aggregates["shots"]
+
+
+@registerFeature("shots_per_minute")
+def shotsPerMinute(aggregates):
+    return perMinute(aggregates["shots"], aggregates["duration_seconds"])
+
+
+@registerFeature("mean_shot_length_seconds")
+def meanShotLength(aggregates):
+    return aggregates["mean_shot_seconds"]
+
+
+@registerFeature("median_shot_length_seconds")
+def medianShotLength(aggregates):
+    return aggregates["median_shot_seconds"]
+
+
+@registerFeature("caption_coverage")
+def captionCoverage(aggregates):
+    # Share of the video covered by subtitles/transcriptions (rolling auto-captions overlap, so cap at 1)
+    return (aggregates["caption_seconds"] / aggregates["duration_seconds"].where(aggregates["duration_seconds"] > 0)).clip(upper=1)
+
+
+def aggregateTable(df, table):
+    # One grouped pass computing every registered aggregate of the table
+    aggregates = AGGREGATES[table]
+    if df is None or df.empty:
+        return pd.DataFrame(columns=list(aggregates), dtype=float)
+    columns = pd.DataFrame({name: column(df) for name, (column, _) in aggregates.items()})
+    columns["id"] = df["id"].to_numpy()
+    return columns.groupby("id").agg(**{name: (name, how) for name, (_, how) in aggregates.items()})
+
+
+def videoAggregates(metadata, transcriptions=None, scenes=None):
+    # Per-video table with the duration from the metadata and the aggregates of the transcriptions and scenes.
+    # Videos missing from a table get NaN for its aggregates (never a KeyError); videos with data but no metadata are dropped.
+    durations = metadata.drop_duplicates(subset="video_id").set_index("video_id")[["duration_seconds"]]
+    durations["duration_seconds"] = pd.to_numeric(durations["duration_seconds"], errors="coerce")
+    aggregates = durations.join(aggregateTable(transcriptions, "transcriptions"), how="left")
+    aggregates = aggregates.join(aggregateTable(scenes, "scenes"), how="left")
+    return aggregates
+
+
+def addVideoFeatures(metadata, transcriptions=None, scenes=None, features=None):
+    """
+    This function adds per-video features to the metadata, computed in one grouped pass over the transcriptions and the scenes.
+    --- args ---
+    metadata: pandas.DataFrame
+
+    --- kwargs ---
+    transcriptions: pandas.DataFrame  |  default: None  # features based on transcriptions are NaN without it
+    scenes: pandas.DataFrame          |  default: None  # features based on scenes are NaN without it
+    features: list                    |  default: All registered features
+
+    --- output ---
+    Outputs from function
+    metadata: pandas.DataFrame  # with one column per feature; NaN where a video has no transcriptions/scenes or no duration
+
+    ## registered features ##
+    average_speaking_rate_wpm    (words per minute of video)
+    average_shot_length_seconds  (duration divided by the number of shots)
+    shots_per_minute
+    mean_shot_length_seconds     (from the scene start and end times)
+    median_shot_length_seconds
+    caption_coverage             (share of the video covered by subtitles/transcriptions)
+    """
+    features = list(FEATURES) if features is None else list(features)
+    unknown = [name for name in features if name not in FEATURES]
+    if unknown:
+        raise ValueError(f"Unknown features {unknown}; registered features are {list(FEATURES)}")
+
+    aggregates = videoAggregates(metadata, transcriptions, scenes)
+    for name in features:
+        values = FEATURES[name](aggregates).replace([np.inf, -np.inf], np.nan)
+        metadata[name] = metadata["video_id"].map(values)
+    return metadata
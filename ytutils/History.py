@@ -1,8 +1,12 @@
 import pandas as pd
 import os
+import re
 import numpy as np
+from urllib.parse import unquote_plus
 from datetime import date
 import random
+from .Output import saveDataFrame
+from .Profiling import profiled
 
 def concatenateDataForEpinion(folder_path, filename, dataframe):
     data = pd.read_json(folder_path + "/" + filename)  # read json files from folder path
@@ -10,10 +14,15 @@ def concatenateDataForEpinion(folder_path, filename, dataframe):
     output_data = pd.concat([dataframe, data], ignore_index=True)  # concatenate the json files
     return output_data
 
-def concatenateData(folder_path, filename, dataframe):
-    data = pd.read_json(folder_path + "/" + filename)  # read json files from folder path
-    output_data = pd.concat([dataframe, data], ignore_index=True)  # concatenate the json files
-    return output_data
+def participantFromFilename(filename):
+    # "watch-history-123.json", "search_history_123.json", "w123.json" -> "123" ("" for a single "watch-history.json")
+    return re.sub(r"^(?:search|watch|s|w)(?:[-_ ]?history)?[-_ ]*", "", filename[:-5], flags=re.IGNORECASE)
+
+
+def readHistoryFiles(folder_path, files):
+    # Read every file first and concatenate once: concatenating file by file copies everything read so far each time
+    frames = [pd.read_json(folder_path + "/" + file).assign(**{"Participant ID": participantFromFilename(file)}) for file in files]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
 
 def renameColumnsForEpinion(watch_history):
@@ -54,6 +63,7 @@ def getIds(df):
     return id_list
 
 
+@profiled
 def loadEpinionData(folder_path, save_dataframe=False):
     """
     This function creates one watch history dataframe from the inputted watch-history json files.
@@ -61,14 +71,14 @@ def loadEpinionData(folder_path, save_dataframe=False):
     folder_path: string  # folder where watch-history files are located (.json)
 
     --- kwargs ---
-    save_dataframe: bool  |  default: False
+    save_dataframe: bool  |  default: False  # or the format: "csv", "parquet" or "arrow" (see Output)
 
     --- output ---
     Outputs from function
     watch_history: pandas.DataFrame
 
-    Outputs to current directory (if save_dataframe=True)
-    watch_history: .csv
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    watch_history: .csv, .parquet or .arrow
     """
     files = [file for file in os.listdir(folder_path) if file.endswith(".json")]
     total_files = len(files)
@@ -91,27 +101,22 @@ def loadEpinionData(folder_path, save_dataframe=False):
     watch_history = renameColumnsForEpinion(watch_history)
     watch_history["video_id"] = getIds(watch_history)
 
-    # Save to CSV if needed
-    if save_dataframe:
-        watch_history.to_csv("watch_history.csv", index=False)
+    saveDataFrame(watch_history, "watch_history", save_dataframe)
     
     print("\nProcessing complete.")
 
     return watch_history
 
 
+@profiled
 def loadHistoryData(history_folder_path, save_dataframe=False):
 
     files = [file for file in os.listdir(history_folder_path) if file.endswith(".json")]  # Get all .json files in the specified history_folder_path as a list
 
-    search_history = pd.DataFrame()
-    watch_history = pd.DataFrame()  # creates 2 new dataframe, one for search history and one for watch history
-    for file in files:
-        # Iterate through the filenames and check the following
-        if file[0].lower() == "s":
-            search_history = concatenateData(history_folder_path, file, search_history)  # If file starts with an "s", use the concatenateData()-function, to add it to the search history dataframe
-        if file[0].lower() == "w":
-            watch_history = concatenateData(history_folder_path, file, watch_history)  # If file starts with a "w", use the concatenateData()-function, to add it to the watch history dataframe
+    # Files starting with an "s" are search histories and files starting with a "w" watch histories.
+    # The rest of the file name is the participant (see participantFromFilename)
+    search_history = readHistoryFiles(history_folder_path, [file for file in files if file[0].lower() == "s"])
+    watch_history = readHistoryFiles(history_folder_path, [file for file in files if file[0].lower() == "w"])
 
     # Rename some of the columns in the two dataframes
     search_history, watch_history = renameColumns(search_history, watch_history)
@@ -123,12 +128,67 @@ def loadHistoryData(history_folder_path, save_dataframe=False):
     watch_history["video_id"] = getIds(watch_history)
     watch_history = watch_history.drop(["subtitles", "description"], axis=1)
 
-    if save_dataframe:
-        search_history.to_csv("search_history.csv", index=False)
-        watch_history.to_csv("watch_history.csv", index=False)
+    saveDataFrame(search_history, "search_history", save_dataframe)
+    saveDataFrame(watch_history, "watch_history", save_dataframe)
 
     return search_history, watch_history
 
+
+def searchText(search_query):
+    # "search_query=cats+and+dogs" (what getIds leaves of a search url) -> "cats and dogs", decoded once per distinct query
+    queries = search_query.astype("category")
+    decoded = {query: unquote_plus(query.split("search_query=", 1)[-1]) for query in queries.cat.categories}
+    return queries.map(decoded).astype("category")
+
+
+@profiled
+def linkSearchesToWatches(search_history, watch_history, window_minutes=30, save_dataframe=False):
+    """
+    This function links every watch event to the last search of the same participant in the window_minutes before it.
+    Both histories are sorted by time once and joined as-of per participant, so it scales linearly with the number of events.
+    --- args ---
+    search_history: pandas.DataFrame  # output of loadHistoryData
+    watch_history: pandas.DataFrame   # output of loadHistoryData
+
+    --- kwargs ---
+    window_minutes: float  |  default: 30     # watches later than this after the last search are not linked
+    save_dataframe: bool   |  default: False  # or the format: "csv", "parquet" or "arrow" (see Output)
+
+    --- output ---
+    Outputs from function
+    links: pandas.DataFrame  # one row per watch event: Participant ID, watch_time, video_id, search_time, search_query, minutes_since_search
+                             # (search columns empty for watches without a search in the window; categorical ids and queries)
+
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    search_watch_links: .csv, .parquet or .arrow
+    """
+    searches = pd.DataFrame({
+        "Participant ID": search_history["Participant ID"].astype(str),
+        "search_time": pd.to_datetime(search_history["time"], format="ISO8601", utc=True),
+        "search_query": searchText(search_history["search_query"].astype(str).where(search_history["search_query"].notna())),
+    }).dropna(subset=["search_time", "search_query"])
+    watches = pd.DataFrame({
+        "Participant ID": watch_history["Participant ID"].astype(str),
+        "watch_time": pd.to_datetime(watch_history["time"], format="ISO8601", utc=True),
+        "video_id": watch_history["video_id"],
+    }).dropna(subset=["watch_time"])
+
+    # merge_asof needs both sides sorted by time; "by" keeps the match within each participant
+    links = pd.merge_asof(
+        watches.sort_values("watch_time"), searches.sort_values("search_time"),
+        left_on="watch_time", right_on="search_time", by="Participant ID",
+        direction="backward", tolerance=pd.Timedelta(minutes=window_minutes),
+    )
+    links["minutes_since_search"] = ((links["watch_time"] - links["search_time"]).dt.total_seconds() / 60).astype("float32")
+    links["Participant ID"] = links["Participant ID"].astype("category")
+    links["search_query"] = links["search_query"].astype(searches["search_query"].dtype)
+    links = links.sort_values(["Participant ID", "watch_time"], kind="stable").reset_index(drop=True)
+
+    saveDataFrame(links, "search_watch_links", save_dataframe)
+
+    return links
+
+@profiled
 def loadNewData(existing_dataframe, folder_path ,save_dataframe=True):
     # load the ids from exiting dataframe and add .json to get the file names 
     old_ids = pd.unique(existing_dataframe["Participant ID"])
@@ -155,9 +215,8 @@ def loadNewData(existing_dataframe, folder_path ,save_dataframe=True):
     # concatinate the old and new dataframe
     watch_history = pd.concat([existing_dataframe, watch_history], ignore_index = True)
     
-    if save_dataframe:
-        # Save new dataframe with time-stamp
-        watch_history.to_csv("Saved_dataframes/" + date.today().strftime('%Y-%m-%d') + "-watch_history.csv", index=False)
+    # Save new dataframe with time-stamp
+    saveDataFrame(watch_history, os.path.join("Saved_dataframes", date.today().strftime('%Y-%m-%d') + "-watch_history"), save_dataframe)
 
     return watch_history
 
@@ -172,6 +231,7 @@ def clean_dataframe(dataframe):
     
     return df
 
+@profiled
 def sampleVids(dataframe, sample_size=10, random_state=42):
     # make it reproducible by setting seed
     random.seed(random_state)
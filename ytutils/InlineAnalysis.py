@@ -0,0 +1,174 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import ffmpeg
+from .FastScenes import LowResCutDetector
+from .AudioCache import PCM_FORMATS
+from .Profiling import profiled
+
+# Inline analysis (download_utils.download_unique_videos with inline_analysis=True) reads each downloaded file once,
+# right after it is written (while it is still in the page cache), instead of once per later stage:
+#     <video_id>.probe.json   stream facts from the container header (duration, fps, resolution, codecs, ...)
+#     <video_id>.scenes.csv   approximate scenes from a low resolution decode (as mp4ToScenes(method="fast"))
+#     audio cache             the decoded audio, when an AudioCache is given (read by Whisper.transcribeVideos)
+# One ffmpeg process decodes the file once and tees it: tiny grayscale frames to the cut detector on stdout
+# and the audio track to the cache. mp4ToScenes(method="fast", inline_scenes=True) uses the scenes sidecars of the videos
+# analyzed with the same detector parameters instead of decoding them again.
+
+PROBE_SUFFIX = ".probe.json"
+SCENES_SUFFIX = ".scenes.csv"
+
+SCENE_COLUMNS = ["id", "start_time", "end_time", "start_frame_num", "end_frame_num"]
+
+
+def frameRate(rate):
+    # "30000/1001" -> 29.97; None for missing or zero rates
+    numerator, _, denominator = (rate or "0/0").partition("/")
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def probeMedia(media_path):
+    # Basic stream facts from the container header (ffprobe only reads the header, not the streams)
+    probe = ffmpeg.probe(media_path)
+    video = next((stream for stream in probe["streams"] if stream.get("codec_type") == "video"), None)
+    audio = next((stream for stream in probe["streams"] if stream.get("codec_type") == "audio"), None)
+    facts = {
+        "duration_seconds": float(probe["format"]["duration"]) if "duration" in probe["format"] else None,
+        "size_bytes": int(probe["format"]["size"]) if "size" in probe["format"] else None,
+        "bit_rate": int(probe["format"]["bit_rate"]) if "bit_rate" in probe["format"] else None,
+        "container": probe["format"].get("format_name"),
+        "has_video": video is not None,
+        "has_audio": audio is not None,
+    }
+    if video is not None:
+        facts.update({
+            "vcodec": video.get("codec_name"),
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "fps": frameRate(video.get("avg_frame_rate")) or frameRate(video.get("r_frame_rate")),
+            "pix_fmt": video.get("pix_fmt"),
+        })
+    if audio is not None:
+        facts.update({
+            "acodec": audio.get("codec_name"),
+            "audio_sampling_rate": int(audio["sample_rate"]) if "sample_rate" in audio else None,
+            "audio_channels": audio.get("channels"),
+        })
+    return facts
+
+
+def teeStreams(media_path, facts, width, height, audio_output=None):
+    # One ffmpeg process for one read of the file: tiny grayscale frames on stdout and (optionally) the audio to a PCM file
+    source = ffmpeg.input(media_path, skip_loop_filter="all", flags2="fast")  # Cheaper decoding; quality does not matter at this size
+    outputs = []
+    if facts["has_video"]:
+        outputs.append(source.video.output("pipe:", format="rawvideo", pix_fmt="gray", vf=f"scale={width}:{height}:flags=area"))
+    if audio_output is not None:
+        path, sample_rate, dtype = audio_output
+        outputs.append(source.audio.output(path, format=PCM_FORMATS[dtype], acodec="pcm_" + PCM_FORMATS[dtype], ac=1, ar=sample_rate))
+    return (
+        ffmpeg
+        .merge_outputs(*outputs)
+        .global_args("-loglevel", "error", "-nostats")  # Keep stderr small, so its pipe never fills up
+        .overwrite_output()
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+
+
+@profiled
+def analyzeMedia(media_path, video_id, output_folder_path, audio_cache=None, threshold=20.0, width=32, height=18, min_scene_len=15, chunk_frames=1024):
+    """
+    This function probes and analyzes a freshly downloaded file in a single read (see the top of this module).
+    --- args ---
+    media_path: string          # downloaded video (.mp4) or audio-only file (.m4a)
+    video_id: string
+    output_folder_path: string  # where the sidecars are written (usually the download folder)
+
+    --- kwargs ---
+    audio_cache: AudioCache  |  default: None  # also decode the audio into the cache (skipped if it is cached already)
+    threshold: float         |  default: 20.0  # cut detector threshold, as mp4ToScenes(method="fast")
+    width: int               |  default: 32
+    height: int              |  default: 18
+    min_scene_len: int       |  default: 15    # frames
+
+    --- output ---
+    Outputs from function
+    facts: dict  # the probe, with the number of scenes ("n_scenes", None for audio-only files)
+
+    Outputs to "output_folder_path" directory
+    probe: <video_id>.probe.json
+    scenes: <video_id>.scenes.csv  (files with a video stream)
+    """
+    facts = probeMedia(media_path)
+    facts["scene_detector"] = {"threshold": threshold, "width": width, "height": height, "min_scene_len": min_scene_len}
+    audio_output = None
+    if audio_cache is not None and video_id not in audio_cache and facts["has_audio"]:
+        audio_output = (audio_cache.partPath(video_id), audio_cache.sample_rate, audio_cache.dtype)
+    if not facts["has_video"] and audio_output is None:
+        facts["n_scenes"] = None
+        writeProbe(output_folder_path, video_id, facts)
+        return facts
+
+    # Keyframe positions would take another pass over the file, so the detector only uses the frame differences
+    detector = LowResCutDetector(threshold=threshold, min_scene_len=min_scene_len)
+    frame_size = width * height
+    process = teeStreams(media_path, facts, width, height, audio_output)
+    leftover = b""
+    try:
+        while facts["has_video"]:
+            data = process.stdout.read(frame_size * chunk_frames)
+            if not data:
+                break
+            data = leftover + data
+            complete = len(data) - len(data) % frame_size  # Keep a partial frame for the next read
+            leftover = data[complete:]
+            detector.push(np.frombuffer(data[:complete], dtype=np.uint8).reshape(-1, height, width))
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors="replace")
+        return_code = process.wait()
+    if return_code != 0:
+        raise RuntimeError(f"ffmpeg could not decode {media_path} (exit code {return_code}): {stderr.strip()}")
+
+    if audio_output is not None:
+        audio_cache.insert(video_id)
+    facts["n_scenes"] = None
+    if facts["has_video"] and facts["fps"]:
+        scenes = [[video_id, start.get_timecode(), end.get_timecode(), start.frame_num, end.frame_num] for start, end in detector.scenes(facts["fps"])]
+        pd.DataFrame(scenes, columns=SCENE_COLUMNS).to_csv(os.path.join(output_folder_path, video_id + SCENES_SUFFIX), index=False)
+        facts["n_scenes"] = len(scenes)
+    writeProbe(output_folder_path, video_id, facts)
+    return facts
+
+
+def writeProbe(folder_path, video_id, facts):
+    # Written last, so a probe sidecar means the analysis of the video is complete
+    with open(os.path.join(folder_path, video_id + PROBE_SUFFIX), "w") as file:
+        json.dump(facts, file)
+
+
+def readProbe(folder_path, video_id):
+    # The probe sidecar of a video, or None if it was not analyzed inline
+    path = os.path.join(folder_path, video_id + PROBE_SUFFIX)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def readInlineScenes(folder_path, video_ids, threshold=20.0, width=32, height=18, min_scene_len=15):
+    # Scenes found while downloading, for the videos that have a complete analysis with these detector parameters: video id -> dataframe
+    detector = {"threshold": threshold, "width": width, "height": height, "min_scene_len": min_scene_len}
+    scenes = {}
+    for id in video_ids:
+        path = os.path.join(folder_path, id + SCENES_SUFFIX)
+        if not os.path.exists(path):
+            continue
+        probe = readProbe(folder_path, id)
+        if probe is not None and probe.get("scene_detector") == detector:
+            scenes[id] = pd.read_csv(path, dtype={"id": str})
+    return scenes
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pandas as pd
+import cv2
+from .Parallel import runInProcesses
+from .Profiling import profiled
+
+FRAMES_FILE = "frames.npy"
+INDEX_FILE = "index.csv"
+
+
+def extractVideoKeyframes(task):
+    # Run in a worker process: seek to the middle frame of each scene, and write the thumbnails straight into the shared frame store
+    video_path, frame_numbers, offset, store_path, width, height = task
+    frames = np.load(store_path, mmap_mode="r+")
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open {video_path}")
+
+    found = np.zeros(len(frame_numbers), dtype=bool)
+    try:
+        for i, frame_number in enumerate(frame_numbers):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(frame_number))  # Seek, instead of decoding every frame up to it
+            success, frame = capture.read()
+            if not success:
+                continue
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            frames[offset + i] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            found[i] = True
+    finally:
+        capture.release()
+        frames.flush()
+    return found
+
+
+@profiled
+def extractKeyframes(scenes, video_folder_path, output_folder_path, width=160, height=90, processes=None, timeout=None):
+    """
+    This function extracts the middle frame of every scene into one memory-mapped array of fixed size thumbnails.
+    --- args ---
+    scenes: pandas.DataFrame   # output of mp4ToScenes
+    video_folder_path: string  # folder where video files are located (.mp4)
+    output_folder_path: string
+
+    --- kwargs ---
+    width: int       |  default: 160
+    height: int      |  default: 90
+    processes: int   |  default: os.cpu_count()
+    timeout: float   |  default: None  # seconds per video
+
+    --- output ---
+    Outputs from function
+    index: pandas.DataFrame  # video_id, scene_index, frame_num, offset (row in the frame array), found
+
+    Outputs to "output_folder_path" directory
+    frames: frames.npy  # uint8 array of shape (number of scenes, height, width, 3), RGB
+    index: index.csv
+    """
+    os.makedirs(output_folder_path, exist_ok=True)
+
+    # Number the scenes within each video and find their middle frames
+    index = scenes[["id", "start_frame_num", "end_frame_num"]].rename(columns={"id": "video_id"})
+    index = index.sort_values(["video_id", "start_frame_num"]).reset_index(drop=True)
+    index["scene_index"] = index.groupby("video_id").cumcount()
+    index["frame_num"] = (index["start_frame_num"] + index["end_frame_num"]) // 2
+    index["offset"] = np.arange(len(index))
+    index["found"] = False
+
+    store_path = os.path.join(output_folder_path, FRAMES_FILE)
+    frames = np.lib.format.open_memmap(store_path, mode="w+", dtype=np.uint8, shape=(len(index), height, width, 3))
+    del frames  # Created with zeros; the workers write into it
+
+    # One task per video; every video owns a contiguous block of rows in the frame store
+    available = {file[:11] for file in os.listdir(video_folder_path) if file.endswith(".mp4")}
+    tasks = []
+    for video_id, rows in index.groupby("video_id", sort=False):
+        if video_id not in available:
+            continue
+        tasks.append((os.path.join(video_folder_path, video_id + ".mp4"), rows["frame_num"].to_numpy(), int(rows["offset"].iloc[0]), store_path, width, height))
+
+    errors = 0
+    for i, (task, found, error) in enumerate(runInProcesses(extractVideoKeyframes, tasks, processes=processes, timeout=timeout)):
+        print(f"\rProcessing video {i + 1}/{len(tasks)}", end="")
+        if error is not None:
+            print(f"\n{os.path.basename(task[0])}: {error}")
+            errors += 1
+            continue
+        offset = task[2]
+        index.loc[offset:offset + len(found) - 1, "found"] = found
+    print(f"\nExtracted {int(index['found'].sum())} of {len(index)} keyframes ({errors} videos failed)")
+
+    index = index[["video_id", "scene_index", "frame_num", "offset", "found"]]
+    index.to_csv(os.path.join(output_folder_path, INDEX_FILE), index=False)
+    return index
+
+
+def loadKeyframes(output_folder_path):
+    """
+    Open the frame store written by extractKeyframes without reading it into memory.
+    Returns (frames, index): frames is a read-only memmap; frames[index.offset] is the thumbnail of a scene.
+    """
+    frames = np.load(os.path.join(output_folder_path, FRAMES_FILE), mmap_mode="r")
+    index = pd.read_csv(os.path.join(output_folder_path, INDEX_FILE), dtype={"video_id": str})
+    return frames, index
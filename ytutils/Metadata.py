@@ -1,12 +1,88 @@
 import pandas as pd
 import os
 import numpy as np
+from .Output import saveDataFrame
+from .Profiling import profiled
+from .Clips import readClips, clipSummary
 
 def mergeWatchHistoryWithMetadata(watch_history, data):
     metadata = pd.merge(watch_history, data, on="video_id", how="left")
     return metadata
 
 
+METADATA_COLUMNS = [
+    "video_id", "title", "upload_date", "channel_id", "channel_title", "channel_subscriber_count", "channel_is_verified",
+    "video_view_count", "video_like_count", "video_comment_count", "duration_seconds", "description", "tags", "categories",
+    "subtitles_are_provided", "age_limit", "is_live", "was_live", "privacy_setting", "fps", "audio_sampling_rate",
+    "audio_channels", "height", "width", "resolution", "dynamic_range", "aspect_ratio", "clip_segments", "clip_duration_seconds"
+]
+
+# Sidecar written by YouTube.downloadVideos: which videos got provided (uploaded) subtitles
+SUBTITLES_INDEX = "subtitles_index.csv"
+
+
+def readInfoFile(file_path):
+    # Read one .info.json file into a dictionary with the metadata columns
+    file_info = pd.read_json(file_path)
+
+    def value(key, default):
+        # Some fields are missing for some videos (e.g. hidden like counts)
+        try:
+            return file_info[key][0]
+        except KeyError:
+            return default
+
+    return {
+        "video_id": file_info["id"][0],
+        "title": file_info["title"][0],
+        "upload_date": file_info["upload_date"][0],
+        "channel_id": file_info["channel_id"][0],
+        "channel_title": file_info["channel"][0],
+        "channel_subscriber_count": value("channel_follower_count", 0),
+        "channel_is_verified": bool(value("channel_is_verified", False)),
+        "video_view_count": value("view_count", 0),
+        "video_like_count": value("like_count", 0),
+        "video_comment_count": value("comment_count", 0),
+        "duration_seconds": file_info["duration"][0],
+        "description": file_info["description"][0],
+        "tags": file_info["tags"][0],
+        "categories": file_info["categories"][0],
+        "subtitles_are_provided": value("subtitles_are_provided", False),  # Set in info files by earlier versions of downloadVideos
+        "age_limit": file_info["age_limit"][0],
+        "is_live": file_info["is_live"][0],
+        "was_live": file_info["was_live"][0],
+        "privacy_setting": file_info["availability"][0],
+        "fps": file_info["fps"][0],
+        "audio_sampling_rate": value("asr", np.nan),
+        "audio_channels": value("audio_channels", np.nan),
+        "height": file_info["height"][0],
+        "width": file_info["width"][0],
+        "resolution": file_info["format_note"][0],
+        "dynamic_range": file_info["dynamic_range"][0],
+        "aspect_ratio": file_info["aspect_ratio"][0]
+    }
+
+
+def addSubtitleProvenance(data, info_folder_path):
+    # Take subtitles_are_provided from the subtitles_index.csv sidecar of downloadVideos, where there is one
+    index_path = os.path.join(info_folder_path, SUBTITLES_INDEX)
+    if not os.path.exists(index_path):
+        return data
+    index = pd.read_csv(index_path, dtype={"video_id": str}).drop_duplicates(subset="video_id", keep="last")
+    provided = data["video_id"].map(index.set_index("video_id")["subtitles_are_provided"].astype(bool))
+    data["subtitles_are_provided"] = provided.fillna(data["subtitles_are_provided"]).astype(bool)
+    return data
+
+
+def addClipWindows(data, info_folder_path):
+    # The time windows of partial downloads (<video_id>.clip.json sidecars); empty for videos downloaded whole
+    clips = clipSummary(readClips(info_folder_path)).set_index("video_id")
+    data["clip_segments"] = data["video_id"].map(clips["clip_segments"])
+    data["clip_duration_seconds"] = data["video_id"].map(clips["clip_duration_seconds"])
+    return data
+
+
+@profiled
 def getMetadata(watch_history, info_folder_path, save_dataframe=True):
     """
     This function creates a dataframe of metadata from the downloaded info files and combines it with the watch history dataframe.
@@ -15,132 +91,23 @@ def getMetadata(watch_history, info_folder_path, save_dataframe=True):
     info_folder_path: string  # folder where info files are located (.json)
 
     --- kwargs ---
-    save_dataframe: bool  |  default: True
+    save_dataframe: bool  |  default: True  # or the format: "csv", "parquet" or "arrow" (see Output)
 
     --- output ---
     Outputs from function
     metadata: pandas.DataFrame
 
-    Outputs to current directory (if save_dataframe=True)
-    metadata: .csv
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    metadata: .csv, .parquet or .arrow
     """
     files = [file for file in os.listdir(info_folder_path) if file.endswith(".info.json")]
-    
-    # Initiate empty lists for storing file info
-    ids = []
-    titles = []
-    upload_dates = []
-    channel_ids = []
-    channel_titles = []
-    channel_subscriber_counts = []
-    channel_is_verifieds = []
-    video_view_counts = []
-    video_like_counts = []
-    video_comment_counts = []
-    duration_secondss = []
-    descriptions = []
-    tagss = []
-    categoriess = []
-    subtitles_are_provideds = []
-    subtitless = []
-    age_limits = []
-    is_lives = []
-    was_lives = []
-    privacy_settings = []
-    fpss = []
-    audio_sampling_rates = []
-    audio_channelss = []
-    heights = []
-    widths = []
-    resolutions = []
-    dynamic_ranges = []
-    aspect_ratios = []
-
-    # Iterate over info files and add their contents to the lists
-    for file in files:
-        file_info = pd.read_json(info_folder_path + file)
-        ids.append(file_info["id"][0])
-        titles.append(file_info["title"][0])
-        upload_dates.append(file_info["upload_date"][0])
-        channel_ids.append(file_info["channel_id"][0])
-        channel_titles.append(file_info["channel"][0])
-        try:
-            channel_subscriber_counts.append(file_info["channel_follower_count"][0])
-        except KeyError:
-            channel_subscriber_counts.append(0)
-        try:
-            channel_is_verifieds.append(bool(file_info["channel_is_verified"][0]))
-        except KeyError:
-            channel_is_verifieds.append(False)
-        try:
-            video_view_counts.append(file_info["view_count"][0])
-        except KeyError:
-            video_view_counts.append(0)
-        try:
-            video_like_counts.append(file_info["like_count"][0])
-        except KeyError:
-            video_like_counts.append(0)
-        try:
-            video_comment_counts.append(file_info["comment_count"][0])
-        except KeyError:
-            video_comment_counts.append(0)
-        duration_secondss.append(file_info["duration"][0])
-        descriptions.append(file_info["description"][0])
-        tagss.append(file_info["tags"][0])
-        categoriess.append(file_info["categories"][0])
-        subtitles_are_provideds.append(file_info["subtitles_are_provided"][0])
-        age_limits.append(file_info["age_limit"][0])
-        is_lives.append(file_info["is_live"][0])
-        was_lives.append(file_info["was_live"][0])
-        privacy_settings.append(file_info["availability"][0])
-        fpss.append(file_info["fps"][0])
-        try:
-            audio_sampling_rates.append(file_info["asr"][0])
-        except KeyError:
-            audio_sampling_rates.append(np.nan)
-        try:
-            audio_channelss.append(file_info["audio_channels"][0])
-        except KeyError:
-            audio_channelss.append(np.nan)
-        heights.append(file_info["height"][0])
-        widths.append(file_info["width"][0])
-        resolutions.append(file_info["format_note"][0])
-        dynamic_ranges.append(file_info["dynamic_range"][0])
-        aspect_ratios.append(file_info["aspect_ratio"][0])
-
-    # Create a metadata dataframe from the lists with the info file content
-    data = pd.DataFrame({
-        "video_id": ids,
-        "title": titles,
-        "upload_date": upload_dates,
-        "channel_id": channel_ids,
-        "channel_title": channel_titles,
-        "channel_subscriber_count": channel_subscriber_counts,
-        "channel_is_verified": channel_is_verifieds,
-        "video_view_count": video_view_counts,
-        "video_like_count": video_like_counts,
-        "video_comment_count": video_comment_counts,
-        "duration_seconds": duration_secondss,
-        "description": descriptions,
-        "tags": tagss,
-        "categories": categoriess,
-        "subtitles_are_provided": subtitles_are_provideds,
-        "age_limit": age_limits,
-        "is_live": is_lives,
-        "was_live": was_lives,
-        "privacy_setting": privacy_settings,
-        "fps": fpss,
-        "audio_sampling_rate": audio_sampling_rates,
-        "audio_channels": audio_channelss,
-        "height": heights,
-        "width": widths,
-        "resolution": resolutions,
-        "dynamic_range": dynamic_ranges,
-        "aspect_ratio": aspect_ratios
-    })
+
+    # Read the info files and create a metadata dataframe from their content
+    data = pd.DataFrame([readInfoFile(info_folder_path + file) for file in files], columns=METADATA_COLUMNS)
+    data = addSubtitleProvenance(data, info_folder_path)
+    data = addClipWindows(data, info_folder_path)
 
     metadata = mergeWatchHistoryWithMetadata(watch_history, data)
-    if save_dataframe:
-        metadata.to_csv("metadata.csv", index=False)
+    saveDataFrame(metadata, "metadata", save_dataframe)
 
     return metadata
\ No newline at end of file
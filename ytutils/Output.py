@@ -0,0 +1,162 @@
+import os
+
+# Where the stages write their dataframes (save_dataframe=...) and in which format. Set for a whole run with
+#     YTUTILS_OUTPUT_DIR=Results         folder the dataframes are written to (default: the current directory)
+#     YTUTILS_OUTPUT_FORMAT=parquet      "csv" (default), "parquet" or "arrow"
+# or in code with setOutput("Results", "arrow"). A stage can also be given the format directly: save_dataframe="parquet".
+#
+#     csv      plain text, for spreadsheets and other tools; lists (tags, categories, ...) are written as their repr
+#     parquet  typed and compressed; lists stay lists
+#     arrow    Arrow IPC file, uncompressed, so loadTable memory-maps it without copying (lists stay lists)
+
+OUTPUT_DIR_ENV = "YTUTILS_OUTPUT_DIR"
+OUTPUT_FORMAT_ENV = "YTUTILS_OUTPUT_FORMAT"
+
+OUTPUT_FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+_output = {
+    "folder_path": os.environ.get(OUTPUT_DIR_ENV, "."),
+    "format": os.environ.get(OUTPUT_FORMAT_ENV, "csv").strip().lower(),
+}
+
+
+def checkFormat(format):
+    if format not in OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of {list(OUTPUT_FORMATS)}, got {format!r}")
+    return format
+
+
+def setOutput(folder_path=None, format=None):
+    """
+    Sets where the stages write their dataframes and in which format (None keeps the current setting).
+    --- kwargs ---
+    folder_path: string  |  default: None  # created on the first write
+    format: string       |  default: None  # "csv", "parquet" or "arrow"
+    """
+    if format is not None:
+        _output["format"] = checkFormat(format)
+    if folder_path is not None:
+        _output["folder_path"] = folder_path
+
+
+def outputPath(name, format=None):
+    # Path of a named output (e.g. "metadata") in the output folder, with the extension of the format
+    return os.path.join(_output["folder_path"], name + OUTPUT_FORMATS[checkFormat(format or _output["format"])])
+
+
+def arrowTable(dataframe):
+    # Arrow table of a dataframe. Object columns Arrow can not type (e.g. lists mixed with False) are written as strings.
+    import pyarrow as pa
+    try:
+        return pa.Table.from_pandas(dataframe, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    dataframe = dataframe.copy()
+    for column in dataframe.columns[dataframe.dtypes == object]:
+        try:
+            pa.array(dataframe[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            dataframe[column] = dataframe[column].map(lambda value: value if value is None else str(value))
+    return pa.Table.from_pandas(dataframe, preserve_index=False)
+
+
+def saveDataFrame(dataframe, name, save_dataframe=True):
+    """
+    Writes a stage's dataframe to the output folder as <name>.csv, <name>.parquet or <name>.arrow.
+    save_dataframe: False (nothing is written), True (the format from setOutput) or a format name.
+    Returns the path written to, or None.
+    """
+    if save_dataframe is False or save_dataframe is None:
+        return None
+    path = outputPath(name, None if save_dataframe is True else save_dataframe)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if path.endswith(".csv"):
+        dataframe.to_csv(path, index=False)
+        return path
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = arrowTable(dataframe)
+    temp_path = path + ".tmp"  # A crash never leaves a half written file under the real name
+    if path.endswith(".parquet"):
+        pq.write_table(table, temp_path)
+    else:
+        with pa.OSFile(temp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+    return path
+
+
+def findOutput(name_or_path):
+    # A path as it is, or the named output in the output folder (in the configured format first, then any format)
+    if os.path.exists(name_or_path):
+        return name_or_path
+    candidates = [outputPath(name_or_path)] + [outputPath(name_or_path, format) for format in OUTPUT_FORMATS]
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No output named {name_or_path!r} in {_output['folder_path']!r}")
+
+
+def loadTable(name_or_path):
+    """
+    Reads a saved dataframe (a name like "metadata", or a path) as a pyarrow.Table.
+    Arrow files are memory-mapped: nothing is copied or decoded until the columns are used.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    path = findOutput(name_or_path)
+    if path.endswith(".arrow"):
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    if path.endswith(".parquet"):
+        return pq.read_table(path, memory_map=True)
+    from pyarrow import csv
+    return csv.read_csv(path)
+
+
+def loadDataFrame(name_or_path, columns=None):
+    """
+    Reads a saved dataframe (a name like "metadata", or a path) as a pandas.DataFrame, with the types it was saved with
+    (for parquet and arrow). columns: only read these columns.
+    """
+    import pandas as pd
+    path = findOutput(name_or_path)
+    if path.endswith(".csv"):
+        return pd.read_csv(path, usecols=columns, dtype={"video_id": str, "id": str, "Participant ID": str})
+    table = loadTable(path)
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+
+def outputColumns(path):
+    # Column names of a saved dataframe, without reading its rows
+    if path.endswith(".csv"):
+        import pandas as pd
+        return pd.read_csv(path, nrows=0).columns.tolist()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if path.endswith(".parquet"):
+        return pq.read_schema(path).names
+    return pa.ipc.open_file(pa.memory_map(path, "r")).schema.names
+
+
+def readChunks(path, chunksize, dtype=None):
+    # A saved dataframe as pandas.DataFrames of at most chunksize rows, so it is never fully in memory
+    # (dtype is for csv files: parquet and arrow files keep the types they were saved with)
+    import pandas as pd
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=dtype)
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if path.endswith(".parquet"):
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize)
+    else:
+        batches = pa.ipc.open_file(pa.memory_map(path, "r")).read_all().to_batches(max_chunksize=chunksize)
+    for batch in batches:
+        yield batch.to_pandas()
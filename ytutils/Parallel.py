@@ -0,0 +1,69 @@
+import os
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+
+def _worker(func, item, connection):
+    # Run func on one item inside the child process and send the result (or the error) back to the parent
+    try:
+        connection.send((func(item), None))
+    except BaseException as e:
+        connection.send((None, f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+def runInProcesses(func, items, processes=None, timeout=None):
+    """
+    This function runs func on each item in its own process, with at most "processes" running at a time.
+    A crash, an exception or a timeout only affects the item it happened on.
+    --- args ---
+    func: function  # must take a single item as argument
+    items: iterable
+
+    --- kwargs ---
+    processes: int   |  default: os.cpu_count()
+    timeout: float   |  default: None  # seconds before a process is killed
+
+    --- output ---
+    Yields (item, result, error) tuples as the items finish, where error is None on success
+    """
+    processes = processes or os.cpu_count()
+    context = mp.get_context()
+    pending = list(items)[::-1]  # Reversed, so that pop() takes the items in their original order
+    running = {}  # receiving connection -> (item, process, deadline)
+
+    while pending or running:
+        # Start new processes until all slots are in use
+        while pending and len(running) < processes:
+            item = pending.pop()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_worker, args=(func, item, sender), daemon=True)
+            process.start()
+            sender.close()  # Only the child writes to the pipe
+            deadline = time.monotonic() + timeout if timeout else None
+            running[receiver] = (item, process, deadline)
+
+        # Wait until a process finishes or the earliest deadline passes
+        deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+        wait_time = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+        for receiver in wait(list(running), timeout=wait_time):
+            item, process, _ = running.pop(receiver)
+            try:
+                result, error = receiver.recv()
+            except EOFError:  # The process died without sending anything (segfault, killed for memory, ...)
+                result, error = None, f"Process exited with code {process.exitcode}"
+            receiver.close()
+            process.join()
+            yield item, result, error
+
+        # Kill processes that have run past their deadline
+        now = time.monotonic()
+        for receiver, (item, process, deadline) in list(running.items()):
+            if deadline is not None and now >= deadline:
+                process.kill()
+                process.join()
+                receiver.close()
+                del running[receiver]
+                yield item, None, f"TimeoutError: no result after {timeout} seconds"
@@ -0,0 +1,273 @@
+import os
+import json
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .Cache import HashIndex, paramsHash
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    A per-video stage is called once per video as soon as all its inputs exist for that video:
+        func(video_id, inputs, params) -> {artifact_name: path}
+        inputs = {upstream_stage_name: {artifact_name: path}}
+
+    A corpus stage is called once, after all its upstream stages have finished:
+        func(inputs, params) -> {artifact_name: path}
+        inputs = {upstream_stage_name: {video_id: {artifact_name: path}}}  (or {artifact_name: path} for an upstream corpus stage)
+
+    --- args ---
+    name: string
+    func: function
+
+    --- kwargs ---
+    inputs: list      |  default: []     # names of upstream stages
+    params: dict      |  default: {}     # passed to func and part of the cache key; change them to recompute
+    per_video: bool   |  default: True
+    files: list       |  default: []     # external input files whose content is part of the cache key (corpus stages)
+    workers: int      |  default: 1      # videos processed at the same time
+    processes: bool   |  default: False  # run in processes instead of threads (for CPU bound stages; func must be picklable)
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, per_video=True, files=(), workers=1, processes=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.per_video = per_video
+        self.files = list(files)
+        self.workers = workers
+        self.processes = processes
+
+
+class Source:
+    """
+    The start of a pipeline: produces videos while the rest of the pipeline runs.
+
+        func(emit, inputs, params), calling emit(video_id, {artifact_name: path}) for every available video
+
+    Downstream per-video stages start on a video as soon as it is emitted, e.g. scene detection
+    on new downloads while the download continues. inputs are the outputs of upstream corpus stages.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.per_video = True
+
+
+class PipelineRunner:
+    """
+    Runs a graph of stages incrementally.
+
+    Every output is tracked per stage and video by the content hash of the files it was made from
+    and the stage parameters (journal.jsonl in state_folder_path). A stage is only rerun for the
+    videos where that key changed, or whose outputs have been changed or deleted since.
+
+    --- args ---
+    stages: list                # Source and Stage objects, in any order
+    state_folder_path: string
+    """
+
+    def __init__(self, stages, state_folder_path):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {name}")
+                if stage.per_video and not isinstance(stage, Source) and not self.stages[name].per_video:
+                    raise ValueError(f"Per-video stage {stage.name} can only depend on sources and per-video stages, not {name}")
+        self.downstream = {name: [stage for stage in stages if name in stage.inputs] for name in self.stages}
+
+        self.state_folder_path = state_folder_path
+        os.makedirs(state_folder_path, exist_ok=True)
+        self.journal_path = os.path.join(state_folder_path, "journal.jsonl")
+        self.hashes = HashIndex(os.path.join(state_folder_path, "hashes.json"))
+        self.records = self._loadJournal()
+
+    def _loadJournal(self):
+        # Replay the journal; the last record for a (stage, video) wins
+        records = {}
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:  # Half written line from a crash
+                        continue
+                    records[(record["stage"], record["video"])] = record
+        return records
+
+    def _writeRecord(self, record):
+        self.records[(record["stage"], record["video"])] = record
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+
+    def _compactJournal(self):
+        # Rewrite the journal with only the latest record per (stage, video)
+        with open(self.journal_path + ".tmp", "w") as file:
+            for record in self.records.values():
+                file.write(json.dumps(record) + "\n")
+        os.replace(self.journal_path + ".tmp", self.journal_path)
+
+    def _hashOutputs(self, outputs):
+        return {name: self.hashes.hash(path) for name, path in outputs.items()}
+
+    def _upToDate(self, stage_name, video, key):
+        # True if the stage already ran with this key and its outputs are unchanged on disk
+        record = self.records.get((stage_name, video))
+        if not record or record["key"] != key or record["error"]:
+            return False
+        for name, path in record["outputs"].items():
+            if not os.path.exists(path) or self.hashes.hash(path) != record["hashes"][name]:
+                return False
+        return True
+
+    def _inputKey(self, stage, video, inputs_hashes):
+        files = {path: self.hashes.hash(path) for path in stage.files if os.path.exists(path)}
+        return paramsHash({"stage": stage.name, "params": stage.params, "video": video, "inputs": inputs_hashes, "files": files})
+
+    def run(self):
+        """Run the pipeline until every stage is done. Returns a dictionary of counts per stage."""
+        self.events = queue.Queue()
+        self.results = {name: {} for name in self.stages}  # stage -> video -> (outputs, hashes), successful only
+        self.pending = {name: 0 for name in self.stages}  # tasks scheduled but not finished
+        self.finished = set()  # stages that will not produce anything more
+        self.started = set()
+        self.counts = {name: {"computed": 0, "reused": 0, "failed": 0} for name in self.stages}
+        self.executors = {
+            name: (ProcessPoolExecutor if stage.processes else ThreadPoolExecutor)(max_workers=stage.workers)
+            for name, stage in self.stages.items() if isinstance(stage, Stage)
+        }
+        self.journal = open(self.journal_path, "a")
+
+        try:
+            self._startReadyStages()
+            while len(self.finished) < len(self.stages):
+                self._handle(self.events.get())
+                self._startReadyStages()
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown(cancel_futures=True)
+            self.journal.close()
+            self._compactJournal()
+            self.hashes.save()
+
+        for name, counts in self.counts.items():
+            if isinstance(self.stages[name], Source):
+                print(f"{name}: {counts['computed']} videos")
+            else:
+                print(f"{name}: {counts['computed']} computed, {counts['reused']} up to date, {counts['failed']} failed")
+        return self.counts
+
+    def _upstreamFinished(self, stage):
+        return all(name in self.finished for name in stage.inputs)
+
+    def _startReadyStages(self):
+        for name, stage in self.stages.items():
+            if name in self.finished:
+                continue
+            if isinstance(stage, Source):
+                if name not in self.started and self._upstreamFinished(stage):
+                    self.started.add(name)
+                    threading.Thread(target=self._runSource, args=(stage, self._corpusInputs(stage)), daemon=True).start()
+            elif not stage.per_video:
+                if name not in self.started and self._upstreamFinished(stage):
+                    self.started.add(name)
+                    self._schedule(stage, None)
+            elif self._upstreamFinished(stage) and self.pending[name] == 0:
+                self.finished.add(name)  # Nothing more can arrive for this per-video stage
+
+    def _corpusInputs(self, stage):
+        return {name: self.results[name][None][0] for name in stage.inputs if None in self.results[name]}
+
+    def _runSource(self, source, inputs):
+        def emit(video, outputs):
+            # Hash here, in the source's thread, so the main loop is never blocked reading large files
+            self.events.put(("emitted", source.name, video, (outputs, self._hashOutputs(outputs)), None))
+        try:
+            source.func(emit, inputs, source.params)
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        self.events.put(("source_finished", source.name, None, None, error))
+
+    def _schedule(self, stage, video):
+        if stage.per_video:
+            if not all(video in self.results[name] for name in stage.inputs):
+                return  # Not all inputs exist for this video (yet)
+            inputs = {name: self.results[name][video][0] for name in stage.inputs}
+            inputs_hashes = {name: self.results[name][video][1] for name in stage.inputs}
+        else:
+            inputs = {}
+            inputs_hashes = {}
+            for name in stage.inputs:
+                if self.stages[name].per_video:
+                    inputs[name] = {v: result[0] for v, result in self.results[name].items()}
+                    inputs_hashes[name] = {v: result[1] for v, result in sorted(self.results[name].items())}
+                else:
+                    inputs[name], inputs_hashes[name] = self.results[name].get(None, ({}, {}))
+
+        key = self._inputKey(stage, video, inputs_hashes)
+        self.pending[stage.name] += 1
+        if self._upToDate(stage.name, video, key):
+            record = self.records[(stage.name, video)]
+            self.events.put(("reused", stage.name, video, (record["outputs"], record["hashes"]), None))
+            return
+
+        if stage.per_video:
+            future = self.executors[stage.name].submit(stage.func, video, inputs, stage.params)
+        else:
+            future = self.executors[stage.name].submit(stage.func, inputs, stage.params)
+        future.add_done_callback(lambda future: self._taskDone(stage.name, video, key, future))
+
+    def _taskDone(self, stage_name, video, key, future):
+        try:
+            outputs = future.result()
+            self.events.put(("computed", stage_name, video, (outputs, self._hashOutputs(outputs)), key))
+        except Exception as e:
+            self.events.put(("failed", stage_name, video, None, f"{type(e).__name__}: {e}"))
+
+    def _handle(self, event):
+        kind, stage_name, video, payload, extra = event
+
+        if kind == "source_finished":
+            if extra:
+                print(f"Source {stage_name} failed:\n{extra}")
+            self.finished.add(stage_name)
+            return
+
+        if kind == "emitted":
+            outputs, hashes = payload
+            self.counts[stage_name]["computed"] += 1
+            self._succeeded(stage_name, video, outputs, hashes)
+            return
+
+        self.pending[stage_name] -= 1
+        if kind == "failed":
+            self.counts[stage_name]["failed"] += 1
+            self._writeRecord({"stage": stage_name, "video": video, "key": None, "outputs": {}, "hashes": {}, "error": extra})
+            print(f"{stage_name} failed for {video}: {extra}")
+        else:
+            outputs, hashes = payload
+            self.counts[stage_name][kind] += 1
+            if kind == "computed":
+                self._writeRecord({"stage": stage_name, "video": video, "key": extra, "outputs": outputs, "hashes": hashes, "error": None})
+            self._succeeded(stage_name, video, outputs, hashes)
+
+        if not self.stages[stage_name].per_video:
+            self.finished.add(stage_name)
+
+    def _succeeded(self, stage_name, video, outputs, hashes):
+        self.results[stage_name][video] = (outputs, hashes)
+        if video is None:
+            return
+        # Start downstream per-video stages on this video right away
+        for stage in self.downstream[stage_name]:
+            if stage.per_video and not isinstance(stage, Source):
+                self._schedule(stage, video)
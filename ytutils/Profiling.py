@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import atexit
+import cProfile
+import contextlib
+import threading
+import functools
+import tracemalloc
+
+# Opt-in instrumentation of the pipeline entry points. Functions decorated with @profiled record a stage
+# (wall time, CPU time, peak memory, items) while a ProfileSession is active, and just call through otherwise.
+#
+# Enable it for a whole run with the environment variable (comma separated options, "1" for time and memory):
+#     YTUTILS_PROFILE=1                      wall/CPU time, peak memory and item counts per stage
+#     YTUTILS_PROFILE=time                   the same without memory tracing (tracemalloc slows Python code down)
+#     YTUTILS_PROFILE=time,memory,cprofile,trace
+#     YTUTILS_PROFILE_DIR=profile            where the results are written (default: "profile")
+# or for a block of code:
+#     with ProfileSession("profile", cprofile=True, trace=True) as session:
+#         ...
+#     session.stages  # the recorded stages as a dataframe
+
+PROFILE_ENV = "YTUTILS_PROFILE"
+PROFILE_DIR_ENV = "YTUTILS_PROFILE_DIR"
+
+STAGE_COLUMNS = ["stage", "start", "wall_seconds", "cpu_seconds", "peak_MB", "items", "depth", "thread"]
+
+_session = None  # The active ProfileSession; None means profiling is off
+
+
+def countItems(result):
+    # Number of items a stage returned: rows of a dataframe, length of a list, the first element of a tuple
+    # (e.g. the samples of sampleVids) or the number of entries of a dict. None if there is nothing to count.
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+class ProfileSession:
+    """
+    Records every @profiled stage (and every profileStage block) that runs while the session is active.
+    On exit, the stages are printed as a summary and written to stages.csv in output_folder_path.
+    --- args ---
+    output_folder_path: string  |  default: "profile"
+
+    --- kwargs ---
+    memory: bool    |  default: True   # peak traced memory per stage (tracemalloc; slows Python code down)
+    cprofile: bool  |  default: False  # a cProfile dump per outermost stage (<stage>-<n>.prof, open with pstats or snakeviz)
+    trace: bool     |  default: False  # trace.json in the Chrome trace format (open in chrome://tracing or ui.perfetto.dev)
+    summary: bool   |  default: True   # print the summary on exit
+
+    Only the calling process is recorded: work done in the processes of Parallel.runInProcesses is part
+    of the wall time of the stage that started them, but not of its CPU time or memory. When stages run
+    in several threads at once, their peak memory includes what the other threads allocated.
+    """
+
+    def __init__(self, output_folder_path="profile", memory=True, cprofile=False, trace=False, summary=True):
+        self.output_folder_path = output_folder_path
+        self.memory = memory
+        self.cprofile = cprofile
+        self.trace = trace
+        self.summary = summary
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Stack of open stages per thread
+        self._profiler_busy = False
+        self._profile_counts = {}
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        global _session
+        if _session is not None:
+            raise RuntimeError("A ProfileSession is already active")
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.origin = time.perf_counter()
+        _session = self
+        return self
+
+    def __exit__(self, *exc):
+        global _session
+        _session = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        self.write()
+        return False
+
+    @property
+    def stages(self):
+        import pandas as pd  # Imported here, so importing ytutils (which imports this module) stays light
+        return pd.DataFrame(self.records, columns=STAGE_COLUMNS)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, name):
+        stack = self._stack()
+        frame = {"name": name, "start": time.perf_counter(), "cpu": time.thread_time(), "profiler": None}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)  # Keep the parent's peak before it is reset
+            tracemalloc.reset_peak()
+            frame["base"], frame["peak"] = current, current
+        if self.cprofile:
+            with self._lock:
+                # cProfile can only profile one stage at a time: the outermost stage of the first thread gets it
+                if not self._profiler_busy:
+                    self._profiler_busy = True
+                    frame["profiler"] = cProfile.Profile()
+            if frame["profiler"] is not None:
+                frame["profiler"].enable()
+        stack.append(frame)
+
+    def _exit(self, result):
+        end, cpu_end = time.perf_counter(), time.thread_time()
+        stack = self._stack()
+        frame = stack.pop()
+        if frame["profiler"] is not None:
+            frame["profiler"].disable()
+        peak_MB = None
+        if self.memory:
+            frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            peak_MB = (frame["peak"] - frame["base"]) / 1024**2
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], frame["peak"])
+        record = [frame["name"], frame["start"] - self.origin, end - frame["start"], cpu_end - frame["cpu"], peak_MB,
+                  countItems(result), len(stack), threading.current_thread().name]
+        with self._lock:
+            self.records.append(record)
+            if frame["profiler"] is not None:
+                n = self._profile_counts[frame["name"]] = self._profile_counts.get(frame["name"], 0) + 1
+                os.makedirs(self.output_folder_path, exist_ok=True)
+                frame["profiler"].dump_stats(os.path.join(self.output_folder_path, f"{frame['name']}-{n}.prof"))
+                self._profiler_busy = False
+
+    def write(self):
+        # Summary per stage, stages.csv and (optionally) trace.json
+        stages = self.stages
+        if stages.empty:
+            return
+        os.makedirs(self.output_folder_path, exist_ok=True)
+        stages.to_csv(os.path.join(self.output_folder_path, "stages.csv"), index=False)
+        if self.trace:
+            pid = os.getpid()
+            thread_ids = {name: i for i, name in enumerate(stages["thread"].unique())}
+            events = [{"name": stage, "ph": "X", "ts": start * 1e6, "dur": wall * 1e6, "pid": pid, "tid": thread_ids[thread],
+                       "args": {"cpu_seconds": cpu, "peak_MB": peak, "items": items}}
+                      for stage, start, wall, cpu, peak, items, _, thread in self.records]
+            with open(os.path.join(self.output_folder_path, "trace.json"), "w", encoding="utf-8") as file:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        if self.summary:
+            summary = stages.groupby("stage", sort=False).agg(calls=("stage", "size"), wall_seconds=("wall_seconds", "sum"),
+                                                              cpu_seconds=("cpu_seconds", "sum"), peak_MB=("peak_MB", "max"), items=("items", lambda items: items.sum(min_count=1)))
+            print(summary.round(3).to_string())
+            print(f"Profile saved to {self.output_folder_path}")
+
+
+@contextlib.contextmanager
+def profileStage(name):
+    """
+    Records a block of code as a stage of the active ProfileSession (does nothing without one).
+        with profileStage("load subtitles"):
+            ...
+    """
+    session = _session
+    if session is None:
+        yield
+        return
+    session._enter(name)
+    try:
+        yield
+    finally:
+        session._exit(None)
+
+
+def profiled(func=None, name=None):
+    """
+    Decorator that records each call of func as a stage of the active ProfileSession.
+    Without an active session the only cost is one global lookup per call.
+        @profiled
+        def getMetadata(...): ...
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    stage_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _session
+        if session is None:
+            return func(*args, **kwargs)
+        session._enter(stage_name)
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            session._exit(result)
+    return wrapper
+
+
+def sessionFromEnvironment():
+    # A session for the whole run when YTUTILS_PROFILE is set (closed, and written, when the interpreter exits)
+    value = os.environ.get(PROFILE_ENV, "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    options = {"time", "memory"} if value in ("1", "true", "yes", "on") else {option.strip() for option in value.split(",")}
+    session = ProfileSession(os.environ.get(PROFILE_DIR_ENV, "profile"), memory="memory" in options,
+                             cprofile="cprofile" in options, trace="trace" in options)
+    session.__enter__()
+    atexit.register(session.__exit__, None, None, None)
+    return session
+
+
+sessionFromEnvironment()
@@ -1,38 +1,65 @@
-from scenedetect import detect, ContentDetector
+from scenedetect import open_video, SceneManager, ContentDetector
 from scenedetect.frame_timecode import FrameTimecode
 import cv2
 import os
 import pandas as pd
-from IPython.display import clear_output
+from .Parallel import runInProcesses
+from .Cache import ResultCache
+from .FastScenes import findScenesFast
+from .Dedup import skippedDuplicates, expandDuplicates
+from .Clips import readClips, clipSummary, offsetScenes
+from .InlineAnalysis import readInlineScenes
+from .Output import saveDataFrame
+from .Profiling import profiled
 
 def findmp4File(id, folder_path):
-    # Find the .vtt file corresponding to the video id provided
+    # Find the .mp4 file corresponding to the video id provided
     mp4_filename = [file for file in os.listdir(folder_path) if file.startswith(id) and file.endswith(".mp4")]
     return mp4_filename[0]
 
 
-def findScenes(id, duration, fps, folder_path):
-    try:
-        # Detect the scenes from the downloaded .mp4 file, using the detect-function
-        scenes = detect(folder_path + findmp4File(id, folder_path), ContentDetector())  # Each scene is a tuple of (start_frame, end_frame)
-        # If there are no scenes detected, then return the video as one scene
-        if len(scenes) == 0:
-            start = FrameTimecode(timecode=0, fps=fps)
-            end = FrameTimecode(timecode=int(duration*fps), fps=fps)
-            scenes = [(start, end)]
-    # Catch error related to corrupt video
-    except:
-        start = FrameTimecode(timecode=0, fps=fps)
-        end = FrameTimecode(timecode=int(duration*fps), fps=fps)
-        scenes = [(start, end)]
+def wholeVideoAsScene(duration, fps):
+    # Return the video as one scene, used when no cuts are detected
+    start = FrameTimecode(timecode=0, fps=fps)
+    end = FrameTimecode(timecode=int(duration*fps), fps=fps)
+    return [(start, end)]
+
+
+def findScenes(id, duration, fps, folder_path, downscale=None, frame_skip=0, threshold=27.0):
+    # Open the downloaded .mp4 file and detect the scenes with a ContentDetector
+    video = open_video(folder_path + findmp4File(id, folder_path))
+    scene_manager = SceneManager()
+    scene_manager.add_detector(ContentDetector(threshold=threshold))
+    if downscale:  # Otherwise the scene manager picks a downscale factor based on the resolution
+        scene_manager.auto_downscale = False
+        scene_manager.downscale = downscale
+    scene_manager.detect_scenes(video, frame_skip=frame_skip)
+    scenes = scene_manager.get_scene_list()  # Each scene is a tuple of (start_frame, end_frame)
+
+    # If there are no scenes detected, then return the video as one scene
+    if len(scenes) == 0:
+        scenes = wholeVideoAsScene(duration, fps)
+    return scenes
+
+
+def findScenesApproximate(id, duration, fps, folder_path, threshold=20.0, width=32, height=18):
+    # Approximate scenes from the keyframe positions and a low resolution decode (see FastScenes)
+    scenes = findScenesFast(folder_path + findmp4File(id, folder_path), fps, threshold=threshold, width=width, height=height)
+    if len(scenes) == 0:
+        scenes = wholeVideoAsScene(duration, fps)
     return scenes
 
 
-def extractScenesFrommp4(row, folder_path, scene_list):
-    id = row["video_id"]  # Find the video id of the video that has been inputted
-    duration = row["duration_seconds"]  # Find the duration of the video that has been inputted
-    fps = row["fps"]  # Find the fps of the video that has been inputted
-    scene_list.append([id, findScenes(id, duration, fps, folder_path)])  # Add the detected scenes from the find_scenes-function to the scenes list
+SCENE_DETECTORS = {
+    "content": findScenes,
+    "fast": findScenesApproximate,
+}
+
+
+def detectVideoScenes(task):
+    # Run in a worker process: detect the scenes of one video and return them as a scenes dataframe
+    id, duration, fps, folder_path, method, detector_params = task
+    return createDataFrame([[id, SCENE_DETECTORS[method](id, duration, fps, folder_path, **detector_params)]])
 
 
 def createDataFrame(scene_list):
@@ -62,35 +89,126 @@ def createDataFrame(scene_list):
     return scenes
 
 
-def mp4ToScenes(metadata, video_folder_path, save_dataframe=True):
+@profiled
+def mp4ToScenes(metadata, video_folder_path, save_dataframe=True, method="content", processes=None, timeout=None, downscale=None, frame_skip=0, threshold=None, cache_folder_path=None, fallback_on_error=False, return_errors=False, duplicates=None, inline_scenes=False):
     """
     This function creates a dataframe of scenes from the video files.
+    The videos are processed in parallel, each in its own process, so a corrupt or hanging video only affects itself.
     --- args ---
     metadata: pandas.DataFrame
-    video_folder_path: string  # folder where video files are located (.mp4)
+    video_folder_path: string  # folder where video files are located (.mp4); scenes of partial downloads (<id>.clip.json) are mapped to times in the full video
 
     --- kwargs ---
-    save_dataframe: bool  |  default: True
+    save_dataframe: bool     |  default: True  # or the format: "csv", "parquet" or "arrow" (see Output)
+    method: string           |  default: "content"  # "content" (PySceneDetect ContentDetector) or "fast" (approximate, see below)
+    processes: int           |  default: os.cpu_count()
+    timeout: float           |  default: None   # seconds per video before it is stopped and reported as an error
+    downscale: int           |  default: None   # "content" only: factor to downscale frames by; None picks one from the resolution
+    frame_skip: int          |  default: 0      # "content" only: frames to skip after each processed frame (faster, less precise)
+    threshold: float         |  default: None   # detector threshold; None uses 27.0 for "content" and 20.0 for "fast"
+    cache_folder_path: str   |  default: None   # cache results per video; reruns only process new or changed videos
+    fallback_on_error: bool  |  default: False  # add failed videos as one scene spanning the whole video (still reported)
+    return_errors: bool      |  default: False  # also return the dataframe of errors
+    duplicates: pandas.DataFrame  |  default: None  # output of deduplicateVideos; duplicates get the scenes of their canonical copy
+    inline_scenes: bool      |  default: False  # "fast" only: use the scenes found while downloading with the same threshold (<id>.scenes.csv, see InlineAnalysis) instead of decoding those videos
 
     --- output ---
     Outputs from function
     scenes: pandas.DataFrame
+    errors: pandas.DataFrame  (if return_errors=True)
+
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    scenes: .csv, .parquet or .arrow
+    scene_errors: .csv, .parquet or .arrow  (if any videos failed)
 
-    Outputs to current directory (if save_dataframe=True)
-    scenes: .csv
+    ## method options ##
+    method="content"  (Precise; decodes every frame)
+    method="fast"     (Approximate; proposes cuts from keyframe positions and a 32x18 grayscale decode)
     """
 
     video_ids = [file[:11] for file in os.listdir(video_folder_path) if file.endswith(".mp4")]
 
     subset_df = metadata[metadata["video_id"].isin(video_ids)][["video_id", "duration_seconds", "fps"]].drop_duplicates(subset="video_id")
 
-    scene_list = []  # Initiate a list for storing the scenes
-    # Call the extractScenesFrommp4-function on each row of the dataframe containing the downloaded video ids
-    subset_df.apply(extractScenesFrommp4, folder_path=video_folder_path, scene_list=scene_list, axis=1)
-    clear_output()  # Call clear_output(), or else it will print None many times, since the extractScenesFrommp4-function is not outputting anything
-
-    scenes = createDataFrame(scene_list)
-    if save_dataframe:
-        scenes.to_csv("scenes.csv", index=False)
-
-    return scenes
\ No newline at end of file
+    # Partial downloads (see Clips) only contain their time windows, so their length is that of the windows
+    clips = readClips(video_folder_path)
+    clip_durations = clipSummary(clips).set_index("video_id")["clip_duration_seconds"]
+    subset_df["duration_seconds"] = subset_df["video_id"].map(clip_durations).fillna(subset_df["duration_seconds"])
+
+    # Re-uploads of a clip that is also processed here reuse its scenes instead of being decoded again
+    skipped = skippedDuplicates(subset_df["video_id"], duplicates)
+    subset_df = subset_df[~subset_df["video_id"].isin(skipped)]
+
+    frame_rates = subset_df.set_index("video_id")["fps"]
+
+    if method == "content":
+        detector_params = {"downscale": downscale, "frame_skip": frame_skip, "threshold": 27.0 if threshold is None else threshold}
+    elif method == "fast":
+        detector_params = {"threshold": 20.0 if threshold is None else threshold}
+    else:
+        raise ValueError(f"method must be one of {list(SCENE_DETECTORS)}, got {method}")
+    if inline_scenes and method != "fast":
+        raise ValueError("The scenes found while downloading are approximate, so inline_scenes=True needs method=\"fast\"")
+
+    # Videos analyzed while they were downloaded (with the same threshold) already have their approximate scenes
+    inline = readInlineScenes(video_folder_path, subset_df["video_id"], threshold=detector_params["threshold"]) if inline_scenes else {}
+    subset_df = subset_df[~subset_df["video_id"].isin(list(inline))]
+
+    cache = ResultCache(cache_folder_path) if cache_folder_path else None
+
+    scene_dfs = list(inline.values())  # Initiate a list for storing the scenes of each video
+    tasks = []  # Videos that are not cached and have to be processed
+    cache_keys = {}
+    for id, duration, fps in subset_df.itertuples(index=False):
+        if cache is not None:
+            # The key covers the file content and everything that changes the output
+            key = cache.key(video_folder_path + findmp4File(id, video_folder_path), {"detector": method, "duration": duration, "fps": fps, **detector_params})
+            cached = cache.load(key)
+            if cached is not None:
+                cached["id"] = id  # The same file may have been cached under another video id
+                scene_dfs.append(cached)
+                continue
+            cache_keys[id] = key
+        tasks.append((id, duration, fps, video_folder_path, method, detector_params))
+    if cache is not None:
+        cache.saveHashes()
+
+    errors = []
+    total = len(tasks)
+    for i, (task, video_scenes, error) in enumerate(runInProcesses(detectVideoScenes, tasks, processes=processes, timeout=timeout)):
+        print(f"\rProcessing video {i + 1}/{total}", end="")
+        id, duration, fps = task[:3]
+        if error is not None:
+            errors.append({"id": id, "error": error})
+            if fallback_on_error:
+                scene_dfs.append(createDataFrame([[id, wholeVideoAsScene(duration, fps)]]))
+            continue
+        if cache is not None:
+            cache.save(cache_keys[id], video_scenes)
+        scene_dfs.append(video_scenes)
+    if total:
+        print()
+
+    # Duplicates of a failed canonical copy have no scenes to reuse, so they failed too
+    if skipped and errors:
+        failed = {error["id"]: error["error"] for error in errors}
+        canonical = duplicates.set_index("video_id")["canonical_id"]
+        errors += [{"id": id, "error": f"canonical copy {canonical[id]} failed: {failed[canonical[id]]}"} for id in sorted(skipped) if canonical[id] in failed]
+
+    errors = pd.DataFrame(errors, columns=["id", "error"])
+    if len(errors):
+        print(f"Scene detection failed for {len(errors)} of {len(subset_df) + len(skipped)} videos:")
+        for id, error in errors.itertuples(index=False):
+            print(f"  {id}: {error}")
+
+    scenes = pd.concat(scene_dfs, ignore_index=True) if scene_dfs else createDataFrame([])
+    # Partial downloads: times in the clipped files become times in the full videos (before duplicates copy them)
+    scenes = offsetScenes(scenes, clips, frame_rates)
+    scenes = expandDuplicates(scenes, duplicates, skipped)
+    saveDataFrame(scenes, "scenes", save_dataframe)
+    if len(errors):
+        saveDataFrame(errors, "scene_errors", save_dataframe)
+
+    if return_errors:
+        return scenes, errors
+    return scenes
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+# Position of each digit in "HH:MM:SS.mmm" and its value in milliseconds
+DIGIT_POSITIONS = np.array([0, 1, 3, 4, 6, 7, 9, 10, 11])
+DIGIT_MILLISECONDS = np.array([36000000, 3600000, 600000, 60000, 10000, 1000, 100, 10, 1], dtype=np.int64)
+
+
+def parseTimestamps(timestamps):
+    # Parse a whole column of "HH:MM:SS.mmm" strings at once into integer milliseconds
+    values = np.asarray(timestamps, dtype="U13")  # One character more than the format, to detect longer strings
+    characters = values.view(np.uint32).reshape(len(values), 13)  # One unicode code point per character
+
+    # Fast path: every value has the fixed width layout, so the digits can be read straight from the code points
+    digits = characters[:, DIGIT_POSITIONS].astype(np.int64) - ord("0")
+    fixed_width = (
+        (characters[:, 2] == ord(":")) & (characters[:, 5] == ord(":")) & (characters[:, 8] == ord("."))
+        & (characters[:, 12] == 0) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+    )
+    if fixed_width.all():
+        return digits @ DIGIT_MILLISECONDS
+
+    # Anything else (missing hours, other precision, ...) goes through the general pandas parser
+    return pd.to_timedelta(pd.Series(timestamps)).to_numpy(dtype="timedelta64[ns]").astype(np.int64) // 10**6
+
+
+def formatTimestamps(milliseconds):
+    # The inverse of parseTimestamps: integer milliseconds to "HH:MM:SS.mmm" strings
+    milliseconds = np.asarray(milliseconds, dtype=np.int64)
+    hours, rest = np.divmod(milliseconds, 3600000)
+    minutes, rest = np.divmod(rest, 60000)
+    seconds, rest = np.divmod(rest, 1000)
+    return [f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}" for h, m, s, ms in zip(hours.tolist(), minutes.tolist(), seconds.tolist(), rest.tolist())]
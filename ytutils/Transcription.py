@@ -1,6 +1,7 @@
 import os
 import pandas as pd
-from IPython.display import clear_output
+from .Output import saveDataFrame
+from .Profiling import profiled
 pd.set_option('display.max_colwidth', None)
 
 def findvttFile(id, folder_path):
@@ -154,6 +155,7 @@ def createDataFrame(subtitle_list, from_YouTube=False):
     return transcriptions
 
 
+@profiled
 def vttToTranscriptions(metadata, transcription_folder_path, from_YouTube=False, save_dataframe=True):
     """
     This function creates a dataframe of transcriptions from either the transcription files or the subtitle files.
@@ -163,14 +165,14 @@ def vttToTranscriptions(metadata, transcription_folder_path, from_YouTube=False,
 
     --- kwargs ---
     from_YouTube: bool    |  default: False  # assumes Whisper transcriptions; change to True if YouTube subtitles are being used as input
-    save_dataframe: bool  |  default: True
+    save_dataframe: bool  |  default: True  # or the format: "csv", "parquet" or "arrow" (see Output)
 
     --- output ---
     Outputs from function
     transcriptions: pandas.DataFrame
 
-    Outputs to current directory (if save_dataframe=True)
-    transcriptions: .csv
+    Outputs to the output folder (if save_dataframe; see Output.setOutput)
+    transcriptions: .csv, .parquet or .arrow
     """
 
     video_ids = [file[:11] for file in os.listdir(transcription_folder_path) if file.endswith(".vtt")]
@@ -183,10 +185,10 @@ def vttToTranscriptions(metadata, transcription_folder_path, from_YouTube=False,
     subtitle_list = []  # Initiate a list for storing the subtitles
     # Call the extractTextFromvtt-function on each row of the dataframe containing the downloaded video ids
     subset_df.apply(extractTextFromvtt, folder_path=transcription_folder_path, subtitle_list=subtitle_list, axis=1)
+    from IPython.display import clear_output  # Imported here, so scripts that only parse subtitles do not load IPython
     clear_output()  # Call clear_output(), or else it will print None many times, since the extractTextFromvtt-function is not outputting anything
 
     transcriptions = createDataFrame(subtitle_list, from_YouTube=from_YouTube)
-    if save_dataframe:
-        transcriptions.to_csv("transcriptions.csv", index=False)
+    saveDataFrame(transcriptions, "transcriptions", save_dataframe)
 
     return transcriptions
\ No newline at end of file
@@ -1,19 +1,26 @@
 import os
+import shutil
 import pandas as pd
 #import whisper
+from .Dedup import skippedDuplicates
+from .Clips import readClip, offsetTranscription
+from .Profiling import profiled
 import warnings
 warnings.filterwarnings("ignore", message="FP16 is not supported on CPU; using FP32 instead")
 
-def transcribeVideos(video_folder_path, output_folder_path, model_size="tiny", number_to_transcribe=False):
+@profiled
+def transcribeVideos(video_folder_path, output_folder_path, model_size="tiny", number_to_transcribe=False, audio_cache=None, duplicates=None):
     """
     This function creates transcriptions from the video files.
     --- args ---
-    video_folder_path: string  # folder where video files are located (.mp4)
+    video_folder_path: string  # folder where video files (.mp4) or audio-only downloads (.m4a) are located
     output_folder_path: string
 
     --- kwargs ---
     model_size: string         |  default: "tiny"
     number_to_transcribe: int  |  default: All unique videos
+    audio_cache: AudioCache    |  default: None  # read decoded audio from the shared cache instead of decoding each .mp4
+    duplicates: pandas.DataFrame  |  default: None  # output of deduplicateVideos; duplicates get a copy of the transcription of their canonical copy
 
     --- output ---
     Outputs to "output_folder_path" directory
@@ -27,22 +34,64 @@ def transcribeVideos(video_folder_path, output_folder_path, model_size="tiny", n
     model_size="tiny"  (Best efficiency)
     """
 
-    # Get video ids for the downloaded .mp4 files
-    video_ids = [file[:11] for file in os.listdir(video_folder_path) if file.endswith(".mp4")]
+    # Get video ids for the downloaded .mp4 files and audio-only .m4a files
+    files = os.listdir(video_folder_path)
+    media_files = {file[:11]: file for file in files if file.endswith((".mp4", ".m4a"))}
+    if audio_cache is not None:
+        # Audio streamed into the cache while downloading (download_utils.stream_audio) has an info file but no media file
+        for file in files:
+            if file.endswith(".info.json") and file[:11] not in media_files and file[:11] in audio_cache:
+                media_files[file[:11]] = None
+    video_ids = list(media_files)
 
     # Get number of videos to transcribe (primarily for testing)
     if number_to_transcribe:
         video_ids = video_ids[:number_to_transcribe]
 
+    # Streamed audio only exists in the cache, so it is transcribed first, before decoding other videos can evict it
+    video_ids = sorted(video_ids, key=lambda id: media_files[id] is not None)
+
+    # Whisper only accepts raw audio sampled at 16 kHz
+    if audio_cache is not None and audio_cache.sample_rate != 16000:
+        raise ValueError(f"Whisper needs 16 kHz audio, but the audio cache uses {audio_cache.sample_rate} Hz")
+
     # Load whisper model
     model = whisper.load_model(model_size)
 
     # Create output folder if it doesn't exist already
     os.makedirs(output_folder_path)
 
-    for id in video_ids:
-        result = model.transcribe(video_folder_path + id + ".mp4")  # Transcribe the video
+    # Re-uploads of a clip that is also transcribed here are copied afterwards instead of transcribed again
+    skipped = skippedDuplicates(video_ids, duplicates)
+
+    def transcribe(id):
+        if media_files[id] is None and id not in audio_cache:
+            print(f"Skipping {id}: its streamed audio is no longer in the audio cache (download it again)")
+            return
+        if audio_cache is not None:
+            if id not in audio_cache:
+                audio_cache.add(id, video_folder_path + media_files[id])  # Decode once
+            result = model.transcribe(audio_cache.readFloat(id))  # Transcribe the cached audio
+        else:
+            result = model.transcribe(video_folder_path + media_files[id])  # Transcribe the video (or audio file)
+
+        clip = readClip(video_folder_path, id)
+        if clip is not None:
+            offsetTranscription(result, clip)  # Partial download: times in the clipped file become times in the full video
 
         # Save as a VTT file
         vtt_writer = whisper.utils.get_writer("vtt", output_folder_path)
-        vtt_writer(result, id + ".vtt")
\ No newline at end of file
+        vtt_writer(result, id + ".vtt")
+
+    for id in video_ids:
+        if id not in skipped:
+            transcribe(id)
+
+    if skipped:
+        canonical = duplicates.set_index("video_id")["canonical_id"]
+        for id in skipped:
+            canonical_path = os.path.join(output_folder_path, canonical[id] + ".vtt")
+            if os.path.exists(canonical_path):
+                shutil.copyfile(canonical_path, os.path.join(output_folder_path, id + ".vtt"))
+            else:
+                transcribe(id)  # The canonical copy has no transcription, so the duplicate is transcribed itself
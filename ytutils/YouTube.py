@@ -1,23 +1,47 @@
 import pandas as pd
 import yt_dlp as yt
-import subprocess
 import os
-import numpy as np
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .Profiling import profiled
+from .Metadata import SUBTITLES_INDEX
 
-def downloadVideos(watch_history, output_folder_path, s=0, format="b", provided=False, generated=False, number_to_download=False):
+URL_PREFIX = "https://www.youtube.com/watch?v="
+
+# Rows of the sidecar index of which subtitles were downloaded for each video, so the info files are never rewritten
+SUBTITLES_INDEX_COLUMNS = ["video_id", "language", "subtitles_are_provided", "subtitle_file"]
+
+
+def subtitleRows(video_id, info):
+    # Provenance of the subtitles yt-dlp wrote for one video: provided (uploaded) or auto-generated
+    requested = info.get("requested_subtitles") or {}
+    if not requested:
+        return [[video_id, None, False, None]]
+    rows = []
+    for language, subtitle in requested.items():
+        provided = language in (info.get("subtitles") or {})
+        rows.append([video_id, language, provided, os.path.basename(subtitle.get("filepath") or "") or None])
+    return rows
+
+
+@profiled
+def downloadVideos(watch_history, output_folder_path, s=0, format="b", provided=False, generated=False, number_to_download=False, workers=4):
     """
     This function downloads subtitles, info files, thumbnails and videos from the watch history dataframe.
+    Each video is fetched with a single in-process extraction (provided subtitles, or auto-generated ones when there are
+    none), several videos at a time, and the kind of subtitles each video got is recorded in subtitles_index.csv.
     --- args ---
     watch_history: pandas.DataFrame
     output_folder_path: string
 
     --- kwargs ---
-    s: float                 |  default: 0     # set to amount of seconds to pause between downloads
+    s: float                 |  default: 0     # set to amount of seconds between the starts of two downloads (across all workers)
     format: string           |  default: "b"   # see in format options below
-    provided: bool           |  default: True  # set to False to only download auto-generated subtitles
-    generated: bool          |  default: True  # set to False to only download provided subtitles
+    provided: bool           |  default: False  # download provided (uploaded) subtitles
+    generated: bool          |  default: False  # download auto-generated subtitles (only used for videos without provided ones if provided=True)
     number_to_download: int  |  default: All unique videos
+    workers: int             |  default: 4      # videos downloaded at the same time
 
     --- output ---
     Outputs to "output_folder_path" directory
@@ -25,6 +49,7 @@ def downloadVideos(watch_history, output_folder_path, s=0, format="b", provided=
     info files: .json
     thumbnails: .webp
     videos: .mp4
+    subtitles_index: .csv  # video_id, language, subtitles_are_provided, subtitle_file (read by Metadata.getMetadata)
 
     ## format options ##
     format="b"    (Best)
@@ -40,63 +65,52 @@ def downloadVideos(watch_history, output_folder_path, s=0, format="b", provided=
     video_ids = pd.unique(na_removed_watch_history["video_id"]).tolist()
 
     downloaded_videos = os.listdir(output_folder_path)  # Find all files in folder
-    downloaded_videos_id = [file[:11] for file in downloaded_videos if file.endswith(".mp4")]  # Find all downloaded videos in the folder and extract their video id to a list
+    downloaded_videos_id = {file[:11] for file in downloaded_videos if file.endswith(".mp4")}  # Find all downloaded videos in the folder and extract their video id
 
     # Get number of videos to download (primarily for testing)
     if number_to_download:
         video_ids = video_ids[:number_to_download]
-
-    url_prefix = "https://www.youtube.com/watch?v="  # Get the url prefix for merging with video id's
-
-    # Iterate through the id's
-    for video_id in video_ids:
-        if video_id in downloaded_videos_id:
-            continue
-
-        url = url_prefix + video_id  # Get the url
-
-        if provided:
-            # We define the yt-dlp command with the below command for the command line, where we can specify options.
-            yt_dlp_command = f"yt-dlp -f {format} --write-sub --write-info-json --write-thumbnail -o \"{output_folder_path}{video_id}.mp4\" \"{url}\""
-        if not provided and generated:
-            # We define the yt-dlp command with the below command for the command line, where we can specify options.
-            yt_dlp_command = f"yt-dlp -f {format} --write-auto-subs --write-info-json --write-thumbnail -o \"{output_folder_path}{video_id}.mp4\" \"{url}\""
-        if not provided and not generated:
-            # We define the yt-dlp command with the below command for the command line, where we can specify options.
-            yt_dlp_command = f"yt-dlp -f {format} --write-info-json --write-thumbnail -o \"{output_folder_path}{video_id}.mp4\" \"{url}\""
-
-        time.sleep(s)
-        # Run the command from command line
-        subprocess.run(yt_dlp_command, stdout=subprocess.PIPE, shell=True, text=True)
-
-        # Read .info.json file
+    video_ids = [video_id for video_id in video_ids if video_id not in downloaded_videos_id]
+
+    ydl_opts = {
+        "format": format,
+        "outtmpl": os.path.join(output_folder_path, "%(id)s.mp4"),  # Always .mp4, which the skip check above and mp4ToScenes look for
+        "writeinfojson": True,
+        "writethumbnail": True,
+        "writesubtitles": provided,  # With both, yt-dlp takes the provided subtitles and falls back to the auto-generated ones
+        "writeautomaticsub": generated,
+        "quiet": True,
+        "noprogress": True,
+    }
+    index_path = os.path.join(output_folder_path, SUBTITLES_INDEX)
+    local = threading.local()
+    pace = threading.Lock()
+    next_start = [time.monotonic()]
+
+    def waitTurn():
+        # Space the starts of the downloads s seconds apart, however many workers there are
+        with pace:
+            wait = next_start[0] - time.monotonic()
+            next_start[0] = max(next_start[0], time.monotonic()) + s
+        if wait > 0:
+            time.sleep(wait)
+
+    def download(video_id):
+        # One YoutubeDL per worker thread, reused for all its videos (a YoutubeDL must not be shared between threads)
+        if not hasattr(local, "ydl"):
+            local.ydl = yt.YoutubeDL(ydl_opts)
+        waitTurn()
         try:
-            infofile = pd.read_json(f"{output_folder_path}{video_id}.info.json", lines=True)
-            if provided:
-                # Initiate that videos have provided subtitles
-                infofile["subtitles_are_provided"] = True
-            if not provided:
-                # Initiate that videos don't have provided subtitles
-                infofile["subtitles_are_provided"] = False
-            # Write initialization to .info.json file
-            infofile.to_json(f"{output_folder_path}{video_id}.info.json", index=False)
-        except FileNotFoundError:
-            continue
-
-    if provided and generated:
-        downloaded_subtitles = os.listdir(output_folder_path)  # Find all files in folder
-        downloaded_subtitles_id = [file[:11] for file in downloaded_subtitles if file.endswith(".vtt")]  # Find all downloaded subtitles in the folder and extract their video id to a list
-        not_downloaded = [id for id in video_ids if id not in downloaded_subtitles_id]  # Create a list with the id's for the subtitles that needs to be downloaded, but hasn't been downloaded yet
-
-        for video_id in not_downloaded:
-            # Video does not have provided subtitles
-            try:
-                infofile = pd.read_json(f"{output_folder_path}{video_id}.info.json")
-                infofile["subtitles_are_provided"] = False
-                infofile.to_json(f"{output_folder_path}{video_id}.info.json", index=False)
-
-                url = url_prefix + video_id  # Get the url
-                yt_dlp_command = f"yt-dlp --skip-download --write-auto-subs -o \"{output_folder_path}{video_id}\" \"{url}\""
-                subprocess.run(yt_dlp_command, stdout=subprocess.PIPE, shell=True, text=True)
-            except FileNotFoundError:
-                continue
\ No newline at end of file
+            info = local.ydl.extract_info(URL_PREFIX + video_id, download=True)  # Video, info file, thumbnail and subtitles in one extraction
+            return subtitleRows(video_id, info)
+        except Exception as e:  # A failed video never stops the others (yt-dlp has reported its own errors already)
+            if not isinstance(e, yt.utils.DownloadError):
+                print(f"Download of {video_id} failed: {e}")
+            return []
+
+    # Each finished video is appended to the index right away, so an interrupted run keeps what it found
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for rows in executor.map(download, video_ids):
+            if rows:
+                pd.DataFrame(rows, columns=SUBTITLES_INDEX_COLUMNS).to_csv(index_path, mode="a", header=not os.path.exists(index_path), index=False)
+
@@ -1,5 +1,49 @@
-from .History import loadEpinionData, loadHistoryData, loadNewData, sampleVids
-from .Metadata import getMetadata
-from .Transcription import vttToTranscriptions
-from .PySceneDetect import mp4ToScenes
-from .Concatenate import concatenateFullData
+import importlib
+
+# The public functions and the module they live in. They are imported on first use (see __getattr__),
+# so "import ytutils" stays fast and OpenCV, PySceneDetect, ffmpeg and IPython are only loaded
+# by the stages that need them.
+_EXPORTS = {
+    "loadEpinionData": "History",
+    "loadHistoryData": "History",
+    "loadNewData": "History",
+    "linkSearchesToWatches": "History",
+    "sampleVids": "History",
+    "getMetadata": "Metadata",
+    "vttToTranscriptions": "Transcription",
+    "mp4ToScenes": "PySceneDetect",
+    "concatenateFullData": "Concatenate",
+    "concatenateFullDataPartitioned": "Concatenate",
+    "cacheAudio": "AudioCache",
+    "analyzeMedia": "InlineAnalysis",
+    "extractKeyframes": "Keyframes",
+    "loadKeyframes": "Keyframes",
+    "exportShards": "Export",
+    "readShard": "Export",
+    "DedupIndex": "Dedup",
+    "deduplicateVideos": "Dedup",
+    "setOutput": "Output",
+    "saveDataFrame": "Output",
+    "loadDataFrame": "Output",
+    "loadTable": "Output",
+    "ProfileSession": "Profiling",
+    "profileStage": "Profiling",
+}
+
+__all__ = list(_EXPORTS) + ["AudioCache"]
+
+# Imported right away (it only needs numpy), because the class has the same name as its module:
+# a lazy attribute would be shadowed by the submodule once anything imports ytutils.AudioCache
+from .AudioCache import AudioCache
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value  # Later lookups do not go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))